@@ -0,0 +1,130 @@
+import threading
+import time
+
+# Admission control for client connections. Every connection's frames are charged against two token buckets:
+# its own, and one shared by every connection from the same address, so neither one fast client nor many
+# connections from one host can take more than their share of the server. FrameDecoder does the charging
+# (see framing.py): a frame over budget is dropped before it is even decoded, which makes spam nearly free
+# to turn away. A connection that keeps overrunning its budget also runs out of strikes and is disconnected.
+# Connections per address are capped as well. An address is forgotten once it has no connections and its
+# shared budget has refilled.
+#
+# Limits are process-wide; in --workers mode each worker enforces them on its own.
+
+# defaults for the server's flags: messages per second per connection and per address, the bursts allowed on
+# top, and concurrent connections per address (0 disables a limit)
+RATE = 50
+BURST = 100
+ADDRESS_RATE = 500
+ADDRESS_BURST = 1000
+MAX_CONNECTIONS_PER_ADDRESS = 64
+
+# rejected frames a connection may rack up (recovering this many per second) before it is disconnected
+STRIKES = 100
+STRIKE_RATE = 1
+
+lock = threading.Lock()
+limits = {'rate': RATE, 'burst': BURST, 'address_rate': ADDRESS_RATE, 'address_burst': ADDRESS_BURST,
+          'max_connections': MAX_CONNECTIONS_PER_ADDRESS}
+# address -> [open connections, shared bucket or None]
+addresses = {}
+# how often, in seconds, connect() forgets addresses with no connections left and a full shared budget
+SWEEP_INTERVAL = 10
+next_sweep = 0
+
+
+def configure(rate=RATE, burst=BURST, address_rate=ADDRESS_RATE, address_burst=ADDRESS_BURST,
+              max_connections=MAX_CONNECTIONS_PER_ADDRESS):
+    limits.update(rate=rate, burst=burst, address_rate=address_rate, address_burst=address_burst,
+                  max_connections=max_connections)
+
+
+class TokenBucket:
+    # `rate` tokens a second, holding at most `burst`; only used under the module lock
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+
+class RateLimiter:
+    # The budgets one connection's frames are charged against
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.strikes = TokenBucket(STRIKE_RATE, STRIKES)
+
+    def allow(self):
+        # charge one frame to every bucket, or to none of them if any is empty
+        now = time.monotonic()
+        with lock:
+            for bucket in self.buckets:
+                bucket.refill(now)
+                if bucket.tokens < 1:
+                    return False
+            for bucket in self.buckets:
+                bucket.tokens -= 1
+        return True
+
+    def strike(self, count):
+        # Record `count` rejected frames; False once the connection has run out of strikes
+        now = time.monotonic()
+        with lock:
+            self.strikes.refill(now)
+            self.strikes.tokens -= count
+            return self.strikes.tokens >= 0
+
+
+def connect(address):
+    # Admit a new connection from `address` (a host). Returns its RateLimiter, or None if the address is at its
+    # connection cap. Every admitted connection must be released with disconnect().
+    global next_sweep
+    with lock:
+        now = time.monotonic()
+        if now >= next_sweep:
+            next_sweep = now + SWEEP_INTERVAL
+            forget_idle(now)
+        entry = addresses.get(address)
+        if entry is None:
+            shared = TokenBucket(limits['address_rate'], limits['address_burst']) if limits['address_rate'] else None
+            entry = addresses[address] = [0, shared]
+        if limits['max_connections'] and entry[0] >= limits['max_connections']:
+            return None
+        entry[0] += 1
+    buckets = [bucket for bucket in (TokenBucket(limits['rate'], limits['burst']) if limits['rate'] else None, entry[1])
+               if bucket is not None]
+    return RateLimiter(buckets)
+
+
+def disconnect(address):
+    with lock:
+        entry = addresses.get(address)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if idle(entry, time.monotonic()):
+            del addresses[address]
+
+
+def idle(entry, now):
+    # An address can be forgotten once it has no connections and its shared budget has refilled; forgetting it
+    # while the budget is still spent would make reconnecting a way to refill it. A client nearly always spends
+    # a token just before it disconnects, so addresses left behind are picked up later by forget_idle().
+    if entry[0] > 0:
+        return False
+    shared = entry[1]
+    if shared is None:
+        return True
+    shared.refill(now)
+    return shared.tokens >= shared.burst
+
+
+def forget_idle(now):
+    # called under the lock
+    for address, entry in list(addresses.items()):
+        if idle(entry, now):
+            del addresses[address]
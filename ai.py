@@ -0,0 +1,76 @@
+import importlib
+import random
+
+from board import Variant, format_cell
+
+# Probability-density targeting for server-side bot opponents. For every ship the opponent still has afloat,
+# the bot counts each placement consistent with what it has seen (no misses or sunk ships under it) and adds
+# up how many of those placements cover each cell; it then fires at the densest cell it hasn't shot yet.
+# While it has hits on a ship that isn't sunk yet, placements through those hits outweigh everything else,
+# so it finishes off a ship once it finds one.
+#
+# The bot's view of the board and the counting live in a board backend, chosen with use_backend() (the server's
+# --bot-backend): numpyboard does the counting in a few NumPy array operations per ship size, arrayboard in plain
+# Python over bytearrays. Only the backend in use is imported, so a server on the stdlib backend never loads NumPy.
+
+# how much more a placement through one unsunk hit counts than a placement through open water
+HIT_WEIGHT = 50
+# random tries at placing one ship before random_fleet gives up on a layout
+PLACEMENT_ATTEMPTS = 1000
+
+# backend name -> module
+BACKENDS = {'numpy': 'numpyboard', 'stdlib': 'arrayboard'}
+DEFAULT_BACKEND = 'numpy'
+# the backend module DensityBot uses; the default is loaded on first use
+backend = None
+
+
+def use_backend(name=DEFAULT_BACKEND):
+    global backend
+    backend = importlib.import_module(BACKENDS[name])
+    return backend
+
+
+class DensityBot:
+    # Targeting state for one bot player: what it has seen of the opponent's board and which ships are still afloat
+    def __init__(self, variant=Variant()):
+        self.remaining = dict(variant.fleet)
+        self.columns = variant.columns
+        self.board = (backend or use_backend()).TargetBoard(variant.rows, variant.columns)
+
+    def choose_target(self):
+        # (row, column) of the densest unshot cell, ties broken at random
+        return divmod(int(random.choice(self.board.densest(self.remaining))), self.columns)
+
+    def record(self, row, column, hit, sunk_cells=None):
+        # The outcome of our shot at (row, column); sunk_cells lists the cells of the ship it sank, if any
+        if not hit:
+            self.board.miss(row, column)
+            return
+        self.board.hit(row, column)
+        if sunk_cells:
+            self.board.sink(sunk_cells)
+            self.remaining[len(sunk_cells)] -= 1
+
+
+def random_fleet(variant=Variant()):
+    # A random legal layout as "size orientation start" position strings, largest ship first. A crowded board
+    # can leave no room for the last ships; the layout is then started over.
+    rows, columns = variant.rows, variant.columns
+    sizes = sorted((size for size, number in variant.fleet.items() for _ in range(number)), reverse=True)
+    while True:
+        board = variant.new_board()
+        positions = []
+        for size in sizes:
+            for _ in range(PLACEMENT_ATTEMPTS):
+                vertical = random.random() < 0.5 if size <= min(rows, columns) else size <= rows
+                row = random.randrange(rows - size + 1 if vertical else rows)
+                column = random.randrange(columns if vertical else columns - size + 1)
+                if board.is_free(row, column, size, vertical):
+                    board.place_ship(row, column, size, vertical)
+                    positions.append(f"{size} {'V' if vertical else 'H'} {format_cell(row, column)}")
+                    break
+            else:
+                break
+        else:
+            return positions
@@ -0,0 +1,459 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+
+from framing import FrameDecoder, FrameError, encode_frame, RECV_SIZE
+from codec import JSON_CODEC, MAX_USERNAME_LENGTH, codecs_for
+from board import Variant, variant_of, parse_coord
+
+# Programmatic asyncio client for the Shippy protocol, with no terminal I/O, so bots, tests and services can
+# run many connections on one event loop:
+#
+#   client = await ShippyClient.connect("127.0.0.1", 12358, username="bot", codec="binary")
+#   await client.join()
+#   await client.place("5 H A1")           # or the whole fleet at once: await client.fleet(["5 H A1", ...])
+#   shot = await client.target("B2")        # -> TargetEvent, or raises ServerError
+#   async for event in client.events():    # opponent moves, chat, quit, ...
+#       ...
+#
+# Requests resolve with the server's reply to them. Everything else the server pushes (the opponent's shots,
+# chat, joins and quits) arrives through events(). The client keeps `boards` current from snapshots and delta
+# updates, asking for a resync by itself if it ever misses one.
+#
+# With resume=True, a connection the server drops mid-game is re-established automatically and the client takes
+# its seat back (servers running with --journal restore their games after a restart); a ResumeEvent marks the
+# moment play can continue. Requests in flight when the connection dropped fail with ConnectionError.
+#
+# The server matches players by rating. When nobody close to ours is waiting, join() resolves with a QueueEvent
+# and we wait; the MatchEvent that follows once we are matched may move us to a new seat (`player`, `session`).
+#
+# Instead of joining, a connection can spectate() a game: `boards` then holds each player's shots, keyed by
+# player, and every shot arrives through events() as a TargetEvent for the player who fired it.
+#
+# The welcome says which variant the server plays (`variant`: board size and fleet). Each board in `boards` is
+# a list of rows of glyphs, except on large variants (board.LARGE_CELLS), where the server never sends whole
+# boards and each one is a {cell: glyph} dict of its marked cells, open water left out.
+
+# how long quit() waits for the server to close the connection
+QUIT_TIMEOUT = 5
+# how often and how many times to try reconnecting to a server that went away mid-game
+RESUME_DELAY = 1
+RESUME_ATTEMPTS = 30
+# refuse to buffer frames from the server larger than this; a sane server never sends one
+MAX_FRAME_SIZE = 1024 * 1024
+
+
+@dataclass
+class Event:
+    type: str
+    player: str = None
+    message: str = None  # the server's prose, only present with the JSON codec
+    raw: dict = field(default=None, repr=False)
+
+
+@dataclass
+class JoinEvent(Event):
+    username: str = None
+
+
+@dataclass
+class PlaceEvent(Event):
+    position: str = None
+
+
+@dataclass
+class FleetEvent(Event):
+    positions: list = None  # every ship placed, as "size orientation start"
+
+
+@dataclass
+class TargetEvent(Event):
+    target: str = None
+    result: str = None  # 'miss', 'hit', 'sunk' or 'win'
+
+    @property
+    def won(self):
+        return self.result == 'win'
+
+
+@dataclass
+class ChatEvent(Event):
+    pass
+
+
+@dataclass
+class QuitEvent(Event):
+    username: str = None
+
+
+@dataclass
+class SyncEvent(Event):
+    seq: int = 0
+
+
+@dataclass
+class ErrorEvent(Event):
+    reason: str = None
+
+
+@dataclass
+class ResumeEvent(Event):
+    # the client reconnected and took back its seat in the same game
+    username: str = None
+    session: int = None
+
+
+@dataclass
+class SpectateEvent(Event):
+    # a full snapshot of the game being watched
+    session: int = None
+    seq: int = 0
+    players: dict = None  # player -> username
+
+
+@dataclass
+class QueueEvent(Event):
+    # nobody close to our rating was waiting, so we wait to be matched
+    rating: int = None
+
+
+@dataclass
+class MatchEvent(Event):
+    # we were matched with an opponent and seated in a game with them; join responses for both players follow
+    session: int = None
+    rating: int = None
+    username: str = None  # the opponent's
+
+
+@dataclass
+class RejectedEvent(Event):
+    # the server was full and turned the connection away
+    pass
+
+
+@dataclass
+class DisconnectEvent(Event):
+    pass
+
+
+EVENT_TYPES = {
+    'join_response': JoinEvent,
+    'place_response': PlaceEvent,
+    'fleet_response': FleetEvent,
+    'target_response': TargetEvent,
+    'chat_response': ChatEvent,
+    'quit_response': QuitEvent,
+    'sync_response': SyncEvent,
+    'error_response': ErrorEvent,
+    'third_client': RejectedEvent,
+    'resume_response': ResumeEvent,
+    'spectate_response': SpectateEvent,
+    'queue_response': QueueEvent,
+    'match_response': MatchEvent,
+}
+EVENT_FIELDS = ('username', 'position', 'positions', 'target', 'result', 'seq', 'reason', 'session', 'players', 'rating')
+
+
+def check_username(username):
+    # The server refuses any other username, and its error would answer whichever request is pending
+    if not username.strip() or len(username) > MAX_USERNAME_LENGTH:
+        raise ValueError(f"A username must be 1 to {MAX_USERNAME_LENGTH} characters long.")
+
+
+def make_event(message):
+    event_class = EVENT_TYPES.get(message.get('type'), Event)
+    fields = {name: message[name] for name in EVENT_FIELDS if name in message and name in event_class.__dataclass_fields__}
+    return event_class(type=message.get('type'), player=message.get('player'), message=message.get('message'),
+                       raw=message, **fields)
+
+
+class ServerError(Exception):
+    def __init__(self, event):
+        super().__init__(event.message or event.reason)
+        self.event = event
+        self.reason = event.reason
+
+
+class ShippyClient:
+    def __init__(self, reader, writer, delta=True, resume=False):
+        self.reader = reader
+        self.writer = writer
+        self.delta = delta
+        self.resume = resume
+        self.address = None  # (host, port) to reconnect to
+        self.codec = JSON_CODEC
+        self.decoder = FrameDecoder(MAX_FRAME_SIZE)
+        self.player = None
+        self.codecs = []
+        # the server's game variant, and the codecs that can encode it by name
+        self.variant = Variant()
+        self.codec_table = codecs_for(self.variant.rows, self.variant.columns)
+        self.username = None
+        # our seat, from the welcome; what a resume presents to get it back
+        self.session = None
+        self.token = None
+        # set once the game is over (won, or someone quit), after which a dropped connection isn't resumed
+        self.finished = False
+        self.spectating = False
+        # local copy of this player's boards and the revision it is at
+        self.boards = None
+        self.seq = 0
+        self.resync_pending = False
+        # requests awaiting their reply, in the order they were sent: (reply types, future)
+        self.pending = deque()
+        self.event_queue = asyncio.Queue()
+        self.closed = False
+        self.reader_task = None
+
+    @classmethod
+    async def connect(cls, host, port, username=None, codec='json', delta=True, resume=False):
+        if username:
+            check_username(username)
+        reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer, delta, resume)
+        client.address = (host, port)
+        await client.handshake(codec)
+        if username:
+            client.set_username(username)
+        return client
+
+    async def handshake(self, codec):
+        # The welcome is always JSON; switch codecs (if asked and offered) before anything else is sent
+        welcome, frames = await self.read_first_frame()
+        if welcome.get('type') == 'third_client':
+            self.writer.close()
+            raise ConnectionRefusedError(welcome.get('message'))
+        self.player = welcome.get('player')
+        self.codecs = welcome.get('codecs', ['json'])
+        self.variant = variant_of(welcome)
+        self.codec_table = codecs_for(self.variant.rows, self.variant.columns)
+        self.session = welcome.get('session')
+        self.token = welcome.get('token')
+        # anything that arrived together with the welcome was sent before any codec switch
+        for frame in frames:
+            self.handle_message(JSON_CODEC.decode(frame))
+        self.switch_codec(codec)
+        self.reader_task = asyncio.ensure_future(self.read_loop())
+
+    async def read_frames(self):
+        # Whatever complete frames arrive next, at least one
+        while True:
+            data = await self.reader.read(RECV_SIZE)
+            if not data:
+                raise ConnectionError("Server closed the connection.")
+            frames = self.decoder.feed(data)
+            if frames:
+                return frames
+
+    async def read_first_frame(self):
+        # The next frame as JSON, plus any frames that arrived with it
+        frames = await self.read_frames()
+        return JSON_CODEC.decode(frames[0]), frames[1:]
+
+    def switch_codec(self, codec):
+        if codec != 'json':
+            if codec not in self.codecs:
+                raise ValueError(f"Server does not offer the {codec} codec")
+            self.send({'type': 'codec', 'codec': codec})
+        self.codec = self.codec_table[codec]
+
+    async def reconnect(self):
+        # Reconnect to a server that went away mid-game and take our seat back. Returns False if the game is gone.
+        codec = self.codec.name
+        self.writer.close()
+        for _ in range(RESUME_ATTEMPTS):
+            await asyncio.sleep(RESUME_DELAY)
+            if self.closed:
+                return False
+            try:
+                self.reader, self.writer = await asyncio.open_connection(*self.address)
+                self.decoder = FrameDecoder(MAX_FRAME_SIZE)
+                self.codec = JSON_CODEC
+                # the server seats every new connection; the welcome is for that throwaway seat
+                welcome, _ = await self.read_first_frame()
+                if welcome.get('type') == 'third_client':
+                    self.writer.close()
+                    continue
+                self.send({'type': 'resume', 'session': self.session, 'token': self.token})
+                reply, frames = await self.read_first_frame()
+            except OSError:
+                continue
+            if reply.get('type') != 'resume_response':
+                self.writer.close()
+                return False
+            self.player = reply.get('player')
+            # the resume is followed by a fresh snapshot of our boards, still in JSON; switch codecs only after it
+            try:
+                while True:
+                    messages = [JSON_CODEC.decode(frame) for frame in frames]
+                    for message in messages:
+                        self.handle_message(message)
+                    if any(message.get('type') == 'sync_response' for message in messages):
+                        break
+                    frames = await self.read_frames()
+            except OSError:
+                continue
+            self.switch_codec(codec)
+            self.event_queue.put_nowait(make_event(reply))
+            return True
+        return False
+
+    def send(self, message):
+        self.writer.write(encode_frame(self.codec.encode(message)))
+
+    def request(self, message, *reply_types):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((reply_types, future))
+        self.send(message)
+        return future
+
+    # Protocol commands
+
+    def set_username(self, username):
+        check_username(username)
+        self.username = username
+        self.send({'type': 'username', 'username': username})
+
+    async def join(self, opponent=None):
+        # Resolves with our JoinEvent once we are in a game, or with a QueueEvent if we have to wait to be matched
+        # with an opponent; a MatchEvent, then both players' JoinEvents, arrive through events() once we are.
+        # opponent="bot" asks the server to seat its AI as the other player instead.
+        message = {'type': 'join', 'delta': self.delta}
+        if opponent:
+            message['opponent'] = opponent
+        return await self.request(message, 'join_response', 'queue_response')
+
+    async def place(self, position, orientation=None, start=None):
+        # place("3 H A1") or place(3, "H", "A1")
+        if orientation is not None:
+            position = f"{position} {orientation} {start}"
+        return await self.request({'type': 'place', 'position': position.upper()}, 'place_response')
+
+    async def fleet(self, positions):
+        # place several ships (normally the whole fleet) in one request; all of them are placed or none is
+        return await self.request({'type': 'fleet', 'positions': [position.upper() for position in positions]},
+                                  'fleet_response')
+
+    async def target(self, cell):
+        return await self.request({'type': 'target', 'target': cell.upper()}, 'target_response')
+
+    async def chat(self, text):
+        return await self.request({'type': 'chat', 'message': text}, 'chat_response')
+
+    async def resync(self):
+        self.resync_pending = True
+        return await self.request({'type': 'resync'}, 'spectate_response' if self.spectating else 'sync_response')
+
+    async def spectate(self, session=None):
+        # Watch a game instead of playing: the given session, or the server's most watched game in progress
+        self.spectating = True
+        self.player = "Spectator"
+        self.token = None  # the seat from the welcome is given up, so there is nothing to resume
+        return await self.request({'type': 'spectate', 'session': session or 0}, 'spectate_response')
+
+    async def quit(self):
+        # the server tells both players with a quit_response and then closes the connection
+        if not self.closed:
+            self.send({'type': 'quit'})
+            await asyncio.wait({self.reader_task}, timeout=QUIT_TIMEOUT)
+            await self.close()
+
+    async def close(self):
+        self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    # Incoming messages
+
+    async def read_loop(self):
+        try:
+            while True:
+                try:
+                    data = await self.reader.read(RECV_SIZE)
+                except ConnectionError:
+                    data = b""
+                if not data:
+                    if not (self.resume and self.token and not self.closed and not self.finished):
+                        break
+                    self.fail_pending()
+                    if not await self.reconnect():
+                        break
+                    continue
+                for frame in self.decoder.feed(data):
+                    self.handle_message(self.codec.decode(frame))
+        except (ConnectionError, FrameError):
+            pass
+        finally:
+            self.closed = True
+            self.fail_pending()
+            self.event_queue.put_nowait(DisconnectEvent(type='disconnect', message="Server closed the connection."))
+
+    def fail_pending(self):
+        for _, future in self.pending:
+            if not future.done():
+                future.set_exception(ConnectionError("Server closed the connection."))
+        self.pending.clear()
+
+    def handle_message(self, message):
+        event = make_event(message)
+        if isinstance(event, MatchEvent):
+            # a match may move us into the waiting player's game, under a new seat
+            self.player = event.player
+            self.session = event.session
+        self.update_boards(message)
+        if isinstance(event, QuitEvent) or (isinstance(event, TargetEvent) and event.won):
+            self.finished = True
+
+        if self.pending:
+            reply_types, future = self.pending[0]
+            # the server answers our requests in order; an error always answers the oldest one
+            if event.type == 'error_response' or (event.type in reply_types and event.player == self.player):
+                self.pending.popleft()
+                if not future.done():
+                    if isinstance(event, ErrorEvent):
+                        future.set_exception(ServerError(event))
+                    else:
+                        future.set_result(event)
+                return
+        self.event_queue.put_nowait(event)
+
+    def update_boards(self, message):
+        if 'boards' in message or 'cells' in message:
+            self.boards = message.get('boards') or message['cells']
+            self.seq = message.get('seq', self.seq)
+            self.resync_pending = False
+        elif 'changes' in message and not self.resync_pending:
+            if self.boards is not None and message['seq'] <= self.seq:
+                return  # already part of the snapshot we have (the server sent one in place of a backlog)
+            if self.boards is None or message['seq'] != self.seq + 1:
+                # missed an update; a fresh snapshot arrives as a sync event
+                self.resync_pending = True
+                self.send({'type': 'resync'})
+                return
+            for board_name, cells in message['changes'].items():
+                # a spectator's boards are the players' shots, so cells land on the board of the player who fired
+                board = self.boards[message['player']] if self.spectating else self.boards[board_name]
+                if isinstance(board, dict):
+                    board.update(cells)
+                    continue
+                for coord, glyph in cells.items():
+                    row, column = parse_coord(coord)
+                    board[row][column] = glyph
+            self.seq = message['seq']
+
+    async def next_event(self, *event_classes):
+        # Next pushed event, optionally skipping everything that isn't one of `event_classes`
+        while True:
+            event = await self.event_queue.get()
+            if not event_classes or isinstance(event, event_classes) or isinstance(event, DisconnectEvent):
+                return event
+
+    async def events(self):
+        while True:
+            event = await self.event_queue.get()
+            yield event
+            if isinstance(event, DisconnectEvent):
+                return
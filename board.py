@@ -0,0 +1,328 @@
+import re
+
+# Compact game-board state. Every layer of a board is one integer bitmask where bit (row * columns + column)
+# is set when that cell belongs to the layer, so a whole board is a handful of small ints instead of a grid
+# of boxed glyph strings. Glyphs are only produced when a board is rendered for the wire.
+#
+# Boards bigger than LARGE_CELLS are kept in a SparseBoard instead, which only stores ship cells and shots:
+# a 1000x1000 game costs memory and time in proportion to its fleet and the shots fired, not to its area.
+
+# the classic game
+ROWS = 10
+COLUMNS = 10
+# ship size -> how many ships of that size each player places
+FLEET = {2: 1, 3: 2, 4: 1, 5: 1}
+
+# limits on a variant (--rows, --columns, --fleet on the server)
+MAX_ROWS = 1000
+MAX_COLUMNS = 1000
+MAX_SHIP_SIZE = 127
+# ship ids are stored in a byte per cell
+MAX_FLEET_SHIPS = 255
+# boards with more cells than this (64x64) use SparseBoard, and their snapshots list marked cells only
+LARGE_CELLS = 64 * 64
+
+WATER = '~'
+HIT = '*'
+MISS = 'o'
+# a ship's middle cells, bow and stern, horizontal and vertical
+SHIP_GLYPHS = ('▭', '▯', '△', '▷', '▽', '◁')
+MIDDLE_H, MIDDLE_V, BOW_V, STERN_H, STERN_V, BOW_H = SHIP_GLYPHS
+
+# a cell is written as its row label and 1-based column: A1, J10, AA7, ALL1000
+COORD = re.compile(r"([A-Za-z]{1,3})([0-9]{1,4})")
+
+
+def row_label(row):
+    # Rows are lettered like spreadsheet columns: A..Z, AA..AZ, BA.. (row 999 is ALL)
+    label = ""
+    row += 1
+    while row:
+        row, letter = divmod(row - 1, 26)
+        label = chr(ord('A') + letter) + label
+    return label
+
+
+def format_cell(row, column):
+    return f"{row_label(row)}{column + 1}"
+
+
+def parse_coord(coord):
+    # (row, column) of a cell written like A1 or AB12 (case-insensitive), or None if it isn't one. Bounds are
+    # the caller's business.
+    match = COORD.fullmatch(coord) if isinstance(coord, str) else None
+    if not match:
+        return None
+    row = 0
+    for letter in match.group(1).upper():
+        row = row * 26 + ord(letter) - ord('A') + 1
+    return row - 1, int(match.group(2)) - 1
+
+
+def parse_fleet(text):
+    # A fleet written as "size:count" pairs, e.g. "5:1,4:1,3:2,2:1"; raises ValueError if it isn't one
+    fleet = {}
+    for part in text.split(","):
+        size, _, number = part.strip().partition(":")
+        size, number = int(size), int(number or 1)
+        if number < 1:
+            raise ValueError(f"no ships of size {size}")
+        fleet[size] = fleet.get(size, 0) + number
+    return fleet
+
+
+def is_large(rows, columns):
+    return rows * columns > LARGE_CELLS
+
+
+def cell_bit(row, column, columns=COLUMNS):
+    return 1 << (row * columns + column)
+
+
+def ship_mask(row, column, size, vertical, columns=COLUMNS):
+    step = columns if vertical else 1
+    first = row * columns + column
+    mask = 0
+    for i in range(size):
+        mask |= 1 << (first + i * step)
+    return mask
+
+
+def ship_span(row, column, size, vertical):
+    # every (row, column) a ship placed here covers
+    if vertical:
+        return [(row + i, column) for i in range(size)]
+    return [(row, column + i) for i in range(size)]
+
+
+class Variant:
+    # The rules of a game: board dimensions and the fleet each player places. The server runs one variant,
+    # announced to every client in its welcome.
+    def __init__(self, rows=ROWS, columns=COLUMNS, fleet=FLEET):
+        if not (1 <= rows <= MAX_ROWS and 1 <= columns <= MAX_COLUMNS):
+            raise ValueError(f"boards must be between 1x1 and {MAX_ROWS}x{MAX_COLUMNS}")
+        if not fleet or any(not 1 <= size <= min(MAX_SHIP_SIZE, max(rows, columns)) for size in fleet):
+            raise ValueError("every ship must fit on the board")
+        if sum(fleet.values()) > MAX_FLEET_SHIPS:
+            raise ValueError(f"a fleet can have at most {MAX_FLEET_SHIPS} ships")
+        if sum(size * number for size, number in fleet.items()) > rows * columns:
+            raise ValueError("the fleet doesn't fit on the board")
+        self.rows = rows
+        self.columns = columns
+        self.fleet = dict(fleet)
+        self.ships = sum(fleet.values())
+        self.large = is_large(rows, columns)
+
+    def new_board(self):
+        return SparseBoard(self.rows, self.columns) if self.large else Board(self.rows, self.columns)
+
+    def contains(self, row, column):
+        return 0 <= row < self.rows and 0 <= column < self.columns
+
+    def fits(self, row, column, size, vertical):
+        # whether a ship placed here stays on the board
+        end_row, end_column = (row + size - 1, column) if vertical else (row, column + size - 1)
+        return self.contains(row, column) and self.contains(end_row, end_column)
+
+    def describe(self):
+        # the variant's fields in the server's welcome
+        return {"rows": self.rows, "columns": self.columns,
+                "fleet": {str(size): number for size, number in sorted(self.fleet.items(), reverse=True)}}
+
+
+def variant_of(message):
+    # The variant a server's welcome describes; servers that don't say play the classic game
+    fleet = message.get("fleet")
+    return Variant(message.get("rows", ROWS), message.get("columns", COLUMNS),
+                   {int(size): number for size, number in fleet.items()} if fleet else FLEET)
+
+
+class Board:
+    # ships: every ship cell, vertical: cells of vertically placed ships,
+    # bows/sterns: first and last cell of each ship, hits/misses: shots received (or fired, for a target board).
+    # cell_ship maps a cell to 1 + the id of the ship on it (0 for water) and remaining counts the unhit cells
+    # of each ship, so hit, sunk and win checks never have to walk the fleet.
+    __slots__ = ('rows', 'columns', 'ships', 'vertical', 'bows', 'sterns', 'hits', 'misses', 'cell_ship',
+                 'remaining', 'afloat')
+
+    def __init__(self, rows=ROWS, columns=COLUMNS):
+        self.rows = rows
+        self.columns = columns
+        self.ships = 0
+        self.vertical = 0
+        self.bows = 0
+        self.sterns = 0
+        self.hits = 0
+        self.misses = 0
+        # only boards that get ships need the index
+        self.cell_ship = None
+        self.remaining = []
+        self.afloat = 0
+
+    def is_free(self, row, column, size, vertical):
+        return not self.ships & ship_mask(row, column, size, vertical, self.columns)
+
+    def place_ship(self, row, column, size, vertical):
+        columns = self.columns
+        mask = ship_mask(row, column, size, vertical, columns)
+        self.ships |= mask
+        if vertical:
+            self.vertical |= mask
+            self.sterns |= cell_bit(row + size - 1, column, columns)
+        else:
+            self.sterns |= cell_bit(row, column + size - 1, columns)
+        self.bows |= cell_bit(row, column, columns)
+
+        if self.cell_ship is None:
+            self.cell_ship = bytearray(self.rows * columns)
+        self.remaining.append(size)
+        self.afloat += 1
+        ship_id = len(self.remaining)
+        step = columns if vertical else 1
+        first = row * columns + column
+        for i in range(size):
+            self.cell_ship[first + i * step] = ship_id
+
+    def already_shot(self, row, column):
+        return bool((self.hits | self.misses) & cell_bit(row, column, self.columns))
+
+    def is_hit(self, row, column):
+        return bool(self.hits & cell_bit(row, column, self.columns))
+
+    def fire(self, row, column):
+        # Record a shot at this board; returns (hit, sunk)
+        index = row * self.columns + column
+        ship_id = self.cell_ship[index] if self.cell_ship else 0
+        if not ship_id:
+            self.misses |= 1 << index
+            return False, False
+        self.hits |= 1 << index
+        self.remaining[ship_id - 1] -= 1
+        if self.remaining[ship_id - 1]:
+            return True, False
+        self.afloat -= 1
+        return True, True
+
+    def ship_cells(self, row, column):
+        # every (row, column) of the ship occupying this cell
+        ship_id = self.cell_ship[row * self.columns + column]
+        return [divmod(index, self.columns) for index, owner in enumerate(self.cell_ship) if owner == ship_id]
+
+    def mark(self, row, column, hit):
+        # Record the outcome of a shot fired at the opponent on this (target) board
+        if hit:
+            self.hits |= cell_bit(row, column, self.columns)
+        else:
+            self.misses |= cell_bit(row, column, self.columns)
+
+    def all_sunk(self):
+        return self.afloat == 0
+
+    def glyph(self, row, column):
+        bit = cell_bit(row, column, self.columns)
+        if self.hits & bit:
+            return HIT
+        if self.misses & bit:
+            return MISS
+        if not self.ships & bit:
+            return WATER
+        if self.vertical & bit:
+            return BOW_V if self.bows & bit else STERN_V if self.sterns & bit else MIDDLE_V
+        return BOW_H if self.bows & bit else STERN_H if self.sterns & bit else MIDDLE_H
+
+    def render(self):
+        return [[self.glyph(row, column) for column in range(self.columns)] for row in range(self.rows)]
+
+    def marked_cells(self):
+        # {cell: glyph} for every cell that isn't open water
+        marked = {}
+        layers = self.ships | self.hits | self.misses
+        while layers:
+            index = (layers & -layers).bit_length() - 1
+            layers &= layers - 1
+            row, column = divmod(index, self.columns)
+            marked[format_cell(row, column)] = self.glyph(row, column)
+        return marked
+
+
+class SparseBoard:
+    # The same board for large variants, keyed by cell index (row * columns + column) instead of bit position:
+    # cell_ship only holds the cells ships sit on and hits/misses only the cells shot at, so nothing here grows
+    # with the area of the board. placements holds each ship's (row, column, size, vertical) by id - 1.
+    __slots__ = ('rows', 'columns', 'cell_ship', 'placements', 'hits', 'misses', 'remaining', 'afloat')
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.cell_ship = {}
+        self.placements = []
+        self.hits = set()
+        self.misses = set()
+        self.remaining = []
+        self.afloat = 0
+
+    def is_free(self, row, column, size, vertical):
+        columns = self.columns
+        return not any(r * columns + c in self.cell_ship for r, c in ship_span(row, column, size, vertical))
+
+    def place_ship(self, row, column, size, vertical):
+        self.placements.append((row, column, size, vertical))
+        self.remaining.append(size)
+        self.afloat += 1
+        ship_id = len(self.remaining)
+        for r, c in ship_span(row, column, size, vertical):
+            self.cell_ship[r * self.columns + c] = ship_id
+
+    def already_shot(self, row, column):
+        index = row * self.columns + column
+        return index in self.hits or index in self.misses
+
+    def is_hit(self, row, column):
+        return row * self.columns + column in self.hits
+
+    def fire(self, row, column):
+        index = row * self.columns + column
+        ship_id = self.cell_ship.get(index)
+        if not ship_id:
+            self.misses.add(index)
+            return False, False
+        self.hits.add(index)
+        self.remaining[ship_id - 1] -= 1
+        if self.remaining[ship_id - 1]:
+            return True, False
+        self.afloat -= 1
+        return True, True
+
+    def ship_cells(self, row, column):
+        return ship_span(*self.placements[self.cell_ship[row * self.columns + column] - 1])
+
+    def mark(self, row, column, hit):
+        (self.hits if hit else self.misses).add(row * self.columns + column)
+
+    def all_sunk(self):
+        return self.afloat == 0
+
+    def glyph(self, row, column):
+        index = row * self.columns + column
+        if index in self.hits:
+            return HIT
+        if index in self.misses:
+            return MISS
+        ship_id = self.cell_ship.get(index)
+        if not ship_id:
+            return WATER
+        bow_row, bow_column, size, vertical = self.placements[ship_id - 1]
+        offset = row - bow_row if vertical else column - bow_column
+        if vertical:
+            return BOW_V if offset == 0 else STERN_V if offset == size - 1 else MIDDLE_V
+        return BOW_H if offset == 0 else STERN_H if offset == size - 1 else MIDDLE_H
+
+    def render(self):
+        return [[self.glyph(row, column) for column in range(self.columns)] for row in range(self.rows)]
+
+    def marked_cells(self):
+        marked = {}
+        for index in self.cell_ship.keys() | self.hits | self.misses:
+            row, column = divmod(index, self.columns)
+            marked[format_cell(row, column)] = self.glyph(row, column)
+        return marked
@@ -0,0 +1,119 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from board import FLEET, Variant, parse_coord, parse_fleet
+import ai
+
+# Compares the bot's board backends (ai.BACKENDS): what loading one costs a process in import time and resident
+# memory, how much memory each game's bot state takes, and what one bot shot costs. Every backend is measured in
+# a fresh interpreter of its own, so one backend's imports never flatter the other's numbers.
+#
+#   python boardbench.py [-g 200] [--rows 10 --columns 10 --fleet 5:1,4:1,3:2,2:1]
+
+# bots held at once to measure per-game memory
+MEMORY_GAMES = 1000
+
+
+def play(variant, max_shots):
+    # One bot game against a random fleet; returns the shots fired and the seconds spent choosing and learning
+    board = variant.new_board()
+    for position in ai.random_fleet(variant):
+        size, orientation, start = position.split()
+        board.place_ship(*parse_coord(start), int(size), orientation == 'V')
+    bot = ai.DensityBot(variant)
+    shots = 0
+    started = time.perf_counter()
+    while not board.all_sunk() and (not max_shots or shots < max_shots):
+        row, column = bot.choose_target()
+        hit, sunk = board.fire(row, column)
+        bot.record(row, column, hit, board.ship_cells(row, column) if sunk else None)
+        shots += 1
+    return shots, time.perf_counter() - started
+
+
+def measure(name, variant, games, max_shots):
+    # Everything about one backend, in this (fresh) process
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    ai.use_backend(name)
+    import_seconds = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    bots = [ai.DensityBot(variant) for _ in range(MEMORY_GAMES)]
+    game_bytes = tracemalloc.get_traced_memory()[0] / MEMORY_GAMES
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    bots[0].choose_target()
+    move_bytes = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    del bots
+
+    shots = seconds = 0
+    for _ in range(games):
+        game_shots, game_seconds = play(variant, max_shots)
+        shots += game_shots
+        seconds += game_seconds
+    # ru_maxrss is in KB on Linux
+    return {"backend": name, "import_ms": import_seconds * 1000, "import_rss_mb": (rss_after - rss_before) / 1024,
+            "rss_mb": rss_after / 1024, "game_kb": game_bytes / 1024, "move_kb": move_bytes / 1024,
+            "shot_us": seconds / max(shots, 1) * 1e6, "shots": shots}
+
+
+def report(results, variant, games):
+    print(f"{variant.rows}x{variant.columns} board, {variant.ships} ships, {games} bot games per backend\n")
+    print(f"{'backend':<9}{'import ms':>11}{'import MB':>11}{'RSS MB':>9}{'game KB':>10}{'move KB':>10}"
+          f"{'shot us':>10}{'shots':>9}")
+    for result in results:
+        print(f"{result['backend']:<9}{result['import_ms']:>11.1f}{result['import_rss_mb']:>11.1f}"
+              f"{result['rss_mb']:>9.1f}{result['game_kb']:>10.2f}{result['move_kb']:>10.2f}"
+              f"{result['shot_us']:>10.1f}{result['shots']:>9}")
+    print("\nimport ms/MB: loading the backend; RSS MB: the whole process after it; game KB: one bot's board state;"
+          "\nmove KB: scratch memory of one move; shot us: choosing, firing and learning from one shot")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shippy bot board backend benchmark")
+    parser.add_argument('-g', '--games', type=int, default=200, help="bot games to time per backend")
+    parser.add_argument('--backends', default=",".join(ai.BACKENDS),
+                        help=f"comma-separated backends to compare (of {', '.join(ai.BACKENDS)})")
+    parser.add_argument('--rows', type=int, default=10, help="board rows")
+    parser.add_argument('--columns', type=int, default=10, help="board columns")
+    parser.add_argument('--fleet', type=parse_fleet, default=FLEET, help="ships as size:count pairs")
+    parser.add_argument('--max-shots', type=int, default=0,
+                        help="stop each game after this many shots (0: play until the fleet is sunk)")
+    # runs one backend's measurements and prints them as JSON; the parent starts one of these per backend
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        variant = Variant(args.rows, args.columns, args.fleet)
+    except ValueError as e:
+        raise SystemExit(f"Unsupported game variant: {e}")
+    if args.child:
+        print(json.dumps(measure(args.child, variant, args.games, args.max_shots)))
+        return
+
+    results = []
+    for name in args.backends.split(","):
+        if name not in ai.BACKENDS:
+            raise SystemExit(f"Unknown backend {name!r}; choose from {', '.join(ai.BACKENDS)}.")
+        output = subprocess.run([sys.executable, __file__, '--child', name, '-g', str(args.games),
+                                 '--rows', str(args.rows), '--columns', str(args.columns),
+                                 '--fleet', ",".join(f"{size}:{number}" for size, number in variant.fleet.items()),
+                                 '--max-shots', str(args.max_shots)],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+    report(results, variant, args.games)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,285 +1,299 @@
 import socket
-import json
 import threading
-import select
-import queue
-import time
+import asyncio
+import os
 import sys
+import signal
+from asyncclient import ShippyClient, ServerError
+from codec import MAX_USERNAME_LENGTH
+from board import Variant, format_cell, parse_coord
+import screen
+
+# The client runs on one asyncio event loop: the server connection and stdin are both just readers on it, so an
+# idle client sleeps in the selector until a message arrives or a line is typed.
 
-# Message Queue for storing server responses that need to be printed before asking for input
-mq = queue.Queue()
-# Thread timing event used for prompting user only after mq has had time to process all of its elements
-display_prompt = threading.Event()
-# This clients player ID
-My_Id = ""
 # Name given by user for use in print statements
 username = "x"
-# Boolean to set false when threads need to be ended due to a quit or the other player quitting
-run_threads = True
-# Thread spawned server listening event loop for processing all data that is received from the server
-def handle_server(sock):
-    global My_Id
-    sock.setblocking(False)
+# Set once the game is over for this client (a win, a quit or a lost connection)
+game_over = None
+# Pinned boards at the top of the terminal, redrawn cell by cell
+board_screen = screen.BoardScreen()
+# When spectating: player -> username of the game being watched
+watched_players = {}
+
+def start_stdin_reader(lines):
+    # Feed each line typed on stdin to the `lines` queue, and None at EOF
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    pending = bytearray()
+
+    def on_readable():
+        data = os.read(fd, 4096)
+        pending.extend(data)
+        # a paste can deliver several lines in one read
+        while b"\n" in pending:
+            line, _, rest = pending.partition(b"\n")
+            pending[:] = rest
+            lines.put_nowait(line.decode(errors='replace').rstrip("\r"))
+        if not data:
+            loop.remove_reader(fd)
+            lines.put_nowait(None)
 
     try:
-        while run_threads:
+        loop.add_reader(fd, on_readable)
+    except (NotImplementedError, PermissionError, OSError):
+        # stdin can't be polled here (Windows consoles, regular files); a thread blocks on it instead
+        def read_lines():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line.rstrip("\r\n"))
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        threading.Thread(target=read_lines, daemon=True).start()
+
+async def prompt_line(lines, prompt):
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    line = await lines.get()
+    if line is None:
+        raise EOFError
+    return line
+
+# Print every event the server pushes (opponent moves, chat, quits) until the game ends
+async def handle_server(shippy):
+    async for event in shippy.events():
+        if not show_event(shippy, event):
+            break
+
+# Await the reply to one of our own requests and show it like any other server message
+async def send_request(shippy, coroutine):
+    try:
+        show_event(shippy, await coroutine)
+    except ServerError as e:
+        show_event(shippy, e.event)
+    except ConnectionError:
+        pass  # handle_server reports the disconnect
+
+def render_boards(shippy):
+    # nothing while the client is waiting on a resync after a missed update, or if the boards are too big to draw
+    if not shippy.boards or shippy.resync_pending or shippy.variant.large:
+        return ""
+    boards = shippy.boards
+    titles = screen.TITLES
+    if shippy.spectating:
+        # each player's shots, side by side
+        boards = {'ship_positions': boards['Player 1'], 'target_positions': boards['Player 2']}
+        titles = tuple(f"{watched_players.get(player) or player}'s Shots" for player in ('Player 1', 'Player 2'))
+    if board_screen.enabled:
+        # patch the pinned boards in place; the message text scrolls below them
+        board_screen.set_titles(titles)
+        board_screen.update(boards)
+        return ""
+    return "\n" + print_boards(boards, titles)
+
+# Show one reply or event. Returns False once the message ends the game
+def show_event(shippy, event):
+    message_type = event.type
+    message_content = event.message
+
+    # Handle server response based on message type received
+    if message_type == "join_response":
+        response = f"Join response from server: {message_content}"
+    elif message_type == "queue_response":
+        response = f"Matchmaking: {message_content}"
+    elif message_type == "match_response":
+        response = f"Matchmaking: {message_content} You are {event.player}."
+    elif message_type == "sync_response":
+        response = "Boards synchronised with server." + render_boards(shippy)
+    elif message_type == "spectate_response":
+        watched_players.update(event.players)
+        response = f"Spectating: {message_content}" + render_boards(shippy)
+    elif message_type == "place_response":
+        response = f"Place response from server: {message_content}" + render_boards(shippy)
+    elif message_type == "fleet_response":
+        response = f"Fleet response from server: {message_content}" + render_boards(shippy)
+    elif message_type == "target_response":
+        response = f"Target response from server: {message_content}" + render_boards(shippy)
+        if event.won:
+            end_game(f"\nEndgame response from server: {message_content}" + render_boards(shippy))
+            return False
+    elif message_type == "chat_response":
+        response = f"{message_content}"
+    elif message_type == "quit_response":
+        end_game(f"Quit response from server: {message_content}")
+        return False
+    elif message_type == "error_response":
+        response = f"Server response: {message_content}"
+    elif message_type == "resume_response":
+        # the server restarted mid-game and the client reconnected on its own
+        response = f"Reconnected to the server. {message_content}"
+    elif message_type == "disconnect":
+        end_game(message_content)
+        return False
+    else:
+        response = f"Server response message type not recognised: {message_type}"
 
-            read, _, _, = select.select([sock], [], [], 5)
-        
-            if read:
-                data = sock.recv(4096)
-                if not data:
-                    mq.put("Server closed the connection.")
-                    break
-
-                data = json.loads(data.decode())
-                message_type = data.get("type")
-                message_content = data.get("message")
-                player_id = data.get("player")
-
-                # Handle server response based on message type received
-                if message_type == "join_response":
-                    response = f"Join response from server: {message_content}"
-                    # Should be set once and not changed after initial join
-                elif message_type == "place_response":
-                    state = data.get("boards")
-                    response = f"Place response from server: {message_content}" + "\n" + print_boards(state)
-                elif message_type == "target_response":
-                    state = data.get("boards")
-                    response = f"Target response from server: {message_content}" + "\n" + print_boards(state)
-                    if ("HAS WON" in message_content):
-                        response = f"KILL \nEndgame response from server: {message_content}" + "\n" + print_boards(state)
-                        mq.put(response)
-                        break
-                elif message_type == "chat_response":
-                    response = f"{message_content}"
-                elif message_type == "quit_response":
-                    response = f"KILL Quit response from server: {message_content}"
-                    mq.put(response)
-                    break
-                elif message_type == "error_response":
-                    response = f"Server response: {message_content}"
-                elif message_type == "third_client":
-                    response = f"KILL Server Response: {message_content}"
-                    mq.put(response)
-                    break
-                else:
-                    response = f"Server response message type not recognised: {message_type}"
-
-                mq.put(player_id + "|" + response)
-
-    except socket.error as e:
-        print("Error while recieving data from server. Bad data, or client was forcibly closed.")
-
-def colored_symbol(symbol):
-    RESET = "\033[0m"    # Reset to default color
-    RED = "\033[31m"
-    GREEN = "\033[32m"
-    YELLOW = "\033[33m"
-    BLUE = "\033[34m"
-    MAGENTA = "\033[35m"
-    CYAN = "\033[36m"
-    GREY = "\033[90m"
-
-    if symbol in ['▭', '▯', '△', '▷', '▽', '◁']:
-        return f"{YELLOW}{symbol}{RESET}"    
-    elif symbol == '*':
-        return f"{RED}{symbol}{RESET}"   # Red for hits
-    elif symbol == '~':
-        return f"{CYAN}{symbol}{RESET}"
-    elif symbol == 'o':
-        return f"{BLUE}{symbol}{RESET}"
-    return symbol  # Default color for other symbols
-
-
-def print_boards(game_state):
-    # Labels for columns and rows
-    boards = ""
-    columns = "  " + " ".join([str(i) for i in range(1, 11)])
-    rows = "ABCDEFGHIJ"  # Row labels for A-J
-
-    # Extract the two boards
-    ship_positions = game_state['ship_positions']
-    target_positions = game_state['target_positions']
-
-    # Create horizontal separator lines for the board edges
-    top_border = "┌" + "─" * 21 + "┐"
-    bottom_border = "└" + "─" * 21 + "┘"
-
-    # Start printing the boards side by side
-    boards += " " * 9 + "Your Ships" + " " * 19 + "Your Targets" + "\n"
-    boards += "   " + columns + "       " + columns + "\n"
-    boards += "   " + top_border + "      " + top_border + "\n"
-
-    # Iterate over each row and print ships and targets side by side
-    for i in range(10):
-        row_label = rows[i]  # Get row label (A-J)
-
-        # Prepare ship and target row as strings
-        ship_row = " ".join(colored_symbol(symbol) for symbol in ship_positions[i])
-        target_row = " ".join(colored_symbol(symbol) for symbol in target_positions[i])
-
-        # Print the row with borders, row label, and ship/target contents
-        boards += f" {row_label} │ {ship_row} │    {row_label} │ {target_row} │" + "\n"
-
-    # Print bottom borders for both boards
-    boards += "   " + bottom_border + "      " + bottom_border + "\n"
-    return boards
-
-
-def print_with_prompt(message, from_me):
+    print_with_prompt(response)
+    return True
+
+def end_game(message):
+    if not game_over.is_set():
+        print_with_prompt(message, prompt=False)
+        game_over.set()
+
+def print_boards(game_state, titles=screen.TITLES):
+    # Both boards side by side as text, for terminals where the pinned screen is unavailable
+    return screen.render_text(game_state, titles)
+
+
+def print_with_prompt(message, prompt=True):
     sys.stdout.write('\r' + ' ' * 80 + '\r')  # Clear line
     print(message)
-    if not from_me:
+    if prompt:
         sys.stdout.write("Enter a command: ")
-        sys.stdout.flush()
+    sys.stdout.flush()
 
 
-def handle_input():
+async def handle_input(shippy, lines):
     try:
-        while run_threads:
-            display_prompt.wait()
-            time.sleep(0.1)
-            if not run_threads:
-                break
-            command = input("Enter a command: ")
-            mq.put(f"INPUT: {command.strip()}")
-            display_prompt.clear()
-    except KeyboardInterrupt:
-        print("Input thread interrupted by Ctrl+C.")
+        while True:
+            line = await lines.get()
+            if line is None:
+                print("Input received EOF. Exiting.")
+                handle_quit(shippy)
+                return
+            command, sep, content = line.strip().partition(' ')
+            content = content.strip()
+
+            if command.lower() == "place":
+                handle_place(shippy, content.upper())
+            elif command.lower() == "fleet":
+                handle_fleet(shippy, content.upper())
+            elif command.lower() == "target":
+                handle_target(shippy, content.upper())
+            elif command.lower() == "chat":
+                handle_chat(shippy, content)
+            elif command.lower() == "help":
+                handle_help()
+            elif command.lower() == "quit":
+                handle_quit(shippy)
+                print("Closing connection...")
+                continue
+            else:
+                print(f"Unrecognized command: {command}. Try help for a list of commands.")
+            # server replies re-print the prompt themselves; this covers commands answered locally
+            sys.stdout.write("Enter a command: ")
+            sys.stdout.flush()
+    except asyncio.CancelledError:
+        pass
+
+async def play(server_ip, tcp_port, opponent=None, spectate=None):
+    global username
+    global game_over
+    game_over = asyncio.Event()
+    lines = asyncio.Queue()
+    start_stdin_reader(lines)
+
+    # Connect and read the welcome through the network client
+    try:
+        shippy = await asyncio.wait_for(ShippyClient.connect(server_ip, tcp_port, resume=True), 5)
+    except ConnectionRefusedError as e:
+        # the server is full (third_client)
+        print(e)
+        return
+    print(f"Connected to server {server_ip} on port {tcp_port}")
+    print("Welcome to Shippy!")
+    variant = shippy.variant
+    if variant.describe() != Variant().describe():
+        ships = ", ".join(f"{number} of size {size}" for size, number in sorted(variant.fleet.items(), reverse=True))
+        print(f"This server plays on {variant.rows}x{variant.columns} boards (A1 to {last_cell(variant)}) with {ships}.")
+        if variant.large:
+            print("Boards this large aren't drawn; follow the game through the server's messages.")
+
+    input_task = None
+    try:
+        if spectate is not None:
+            # watch a game instead of playing one; no name or join needed
+            server_task = asyncio.ensure_future(handle_server(shippy))
+            asyncio.ensure_future(send_request(shippy, shippy.spectate(spectate)))
+            input_task = asyncio.ensure_future(handle_input(shippy, lines))
+            await game_over.wait()
+            server_task.cancel()
+            return
+        username_blacklist = ["JOIN", "QUIT", "TARGET", "HELP", "PLACE", "FLEET", "CHAT", "KILL", "PLAYER 1", "PLAYER 2", "INPUT: ", "HAS WON", "|"]
+        while not 2 <= len(username) <= MAX_USERNAME_LENGTH:
+            username = (await prompt_line(lines, f"Enter the name you wish to be called (2 to {MAX_USERNAME_LENGTH} characters long): ")).strip()
+            if any(blacklist_item in username.upper() for blacklist_item in username_blacklist):
+                print("Error: This username is blacklisted...")
+                username = "x"
+        handle_username(shippy, username)
+
+        if board_screen.enabled and hasattr(signal, 'SIGWINCH'):
+            # the scroll region depends on the terminal height, so redraw the boards whole after a resize
+            asyncio.get_running_loop().add_signal_handler(signal.SIGWINCH, board_screen.invalidate)
+        server_task = asyncio.ensure_future(handle_server(shippy))
+        handle_join(shippy, opponent)
+        input_task = asyncio.ensure_future(handle_input(shippy, lines))
+
+        await game_over.wait()
+        server_task.cancel()
     except EOFError:
-        print("Input thread received EOF, Likely due to Ctrl+C. Exiting.")
+        print("Input received EOF. Exiting.")
+    finally:
+        if input_task:
+            input_task.cancel()
+        board_screen.close()
+        await shippy.close()
 
 # TCP communication phase
-def tcp_communication(server_ip, tcp_port=12358):
-    global username
-    global run_threads
+def tcp_communication(server_ip, tcp_port=12358, opponent=None, spectate=None):
     try:
-        # Create a TCP socket
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5)
-            s.connect((server_ip, tcp_port))
-            print(f"Connected to server {server_ip} on port {tcp_port}")
-            data = s.recv(1024)
-            data = json.loads(data.decode())
-            run_event_loop = True
-            if data.get("type") == "third_client":
-                run_event_loop = False
-                print(data.get("message"))
-                return True
-            print(data.get("message"))
-
-            My_Id = data.get("player")
-
-            threads_created = False
-            username_blacklist = ["JOIN", "QUIT", "TARGET", "HELP", "PLACE", "CHAT", "KILL", "PLAYER 1", "PLAYER 2", "INPUT: ", "HAS WON", "|"]
-            while len(username) < 2:
-                username = input("Enter the name you wish to be called (must be at least 2 characters long): ").strip()
-                if any(blacklist_item in username.upper() for blacklist_item in username_blacklist):
-                    print("Error: This username is blacklisted...")
-                    username = "x"
-            handle_username(s, username)
-
-            if run_event_loop:
-                threads_created = True
-                server_handler = threading.Thread(target=handle_server, args=(s,))
-                server_handler.start()
-
-                
-                handle_join(s)
-
-                input_handler = threading.Thread(target=handle_input)
-                input_handler.start()
-
-            from_me = True
-
-            while run_event_loop:
-
-                # Execute on user input or print server response from mq
-                while not mq.empty():
-                    message = mq.get()
-                
-                    if message.startswith("INPUT: "):
-                    # Send a message to the server
-                        mess = message[len("INPUT: "):]
-                        command, sep, content = mess.partition(' ')
-                        content = content.strip()
-
-                        if command.lower() == "place":
-                            handle_place(s, content.upper())
-                        elif command.lower() == "target":
-                            handle_target(s, content.upper())
-                        elif command.lower() == "chat":
-                            handle_chat(s, content)
-                        elif command.lower() == "help":
-                            handle_help()
-                        elif command.lower() == "quit":
-                            handle_quit(s)
-                            print("Closing connection...")
-                        else:
-                            print(f"Unrecognized command: {command}. Try help for a list of commands.")
-                    elif message.startswith("KILL"):
-                        run_threads = False  # Signal the input_handler thread to stop
-                        message = message[len("KILL "):]
-                        print_with_prompt(message, from_me=True)
-                        input_handler.join()
-                        server_handler.join()
-                        time.sleep(0.5)
-                        return True
-                    else:
-                        # Print server response
-                        sending_player, prnt = message.split('|', 1)
-                        if(sending_player == My_Id):
-                            from_me = True
-                        else:
-                            from_me = False
-                        print_with_prompt(prnt, from_me)
-                        
-                    display_prompt.set()
-
+        asyncio.run(play(server_ip, tcp_port, opponent, spectate))
     except KeyboardInterrupt:
         print("\nClient closed by keyboard interrput.")
-        return True
-    except (socket.error, socket.timeout) as e:
+    except (OSError, asyncio.TimeoutError) as e:
         print(f"Connection failed for {server_ip}. Error: {e}")
-        return True
-    finally:
-        run_threads = False
-        display_prompt.set()
-        if threads_created:
-            input_handler.join()
-            server_handler.join()
-        time.sleep(0.5)
+    return True
 
     
-def handle_place(s, place):
+def last_cell(variant):
+    return format_cell(variant.rows - 1, variant.columns - 1)
+
+def handle_place(shippy, place):
     # the ships position
     position = place
     # ensure validity of cell input
-    if not is_valid_ship(position):
-        print("That position was not recognised. Try the format '3 H A1' (ship size: [2-5], Orientation (horizontal/vertical): [H/V], Leftmost/Topmost coordinate of ship: [A1-J10])")
+    if not is_valid_ship(position, shippy.variant):
+        sizes = sorted(shippy.variant.fleet)
+        print(f"That position was not recognised. Try the format '3 H A1' (ship size: [{sizes[0]}-{sizes[-1]}], Orientation (horizontal/vertical): [H/V], Leftmost/Topmost coordinate of ship: [A1-{last_cell(shippy.variant)}])")
         return
         
-    json_place_message = json.dumps({"type": "place", "position": position})
-    s.sendall(json_place_message.encode())
+    asyncio.ensure_future(send_request(shippy, shippy.place(position)))
     
 
-def handle_target(s, target):
+def handle_fleet(shippy, fleet):
+    # several ship positions separated by commas, placed together in one request
+    positions = [position.strip() for position in fleet.split(",")]
+    # ensure validity of every position before sending any
+    for position in positions:
+        if not is_valid_ship(position, shippy.variant):
+            print(f"The position '{position}' was not recognised. Try the format 'fleet 5 H A1, 4 H B1, 3 H C1, 3 H D1, 2 H E1'")
+            return
+
+    asyncio.ensure_future(send_request(shippy, shippy.fleet(positions)))
+
+
+def handle_target(shippy, target):
     # the cell to target
     fire = target
     # ensure validity of cell input
-    if not is_valid_cell(fire):
-        print("That position was not recognised. Try the format 'B2'")
+    if not is_valid_cell(fire, shippy.variant):
+        print(f"That position was not recognised. Try the format 'B2' (A1-{last_cell(shippy.variant)})")
         return
 
-    json_q_message = json.dumps({"type": "target", "target": fire})
-    s.sendall(json_q_message.encode())
+    asyncio.ensure_future(send_request(shippy, shippy.target(fire)))
 
 
-def handle_chat(s, message):
-    # package message into json to send to server
-    json_q_message = json.dumps({"type": "chat", "message": message})
-    s.sendall(json_q_message.encode())
+def handle_chat(shippy, message):
+    asyncio.ensure_future(send_request(shippy, shippy.chat(message)))
 
 
 def handle_help():
@@ -303,17 +317,22 @@ Note: All commands are case insensitive.
    - Example: `place 4 H B3`  
      - Example responses: "Ship placed at B3", or and error message.  
 
-2. **Target [A1-J10]**  
+2. **Fleet [ship], [ship], ...**  
+   - Places several ships at once, each written like a `place` command. Either all of them are placed or none is.  
+   - Example: `fleet 5 H A1, 4 H B1, 3 H C1, 3 H D1, 2 H E1`  
+     - Example responses: "Placed 5 ships.", or and error message.  
+
+3. **Target [A1-J10]**  
    - Targets the opponent's board.  
    - Example: `target C5`  
      - Example responses: "[username] hit a ship at [target]!", "[username] missed at [target].", "[username] has sunk a battleship!", or and error message. 
 
-3. **Chat [message]**  
+4. **Chat [message]**  
    - Sends a message to the opponent.  
    - Example: `chat Hello!`  
      - Example response: "[Client Name]: Hello!"  
 
-4. **Quit**  
+5. **Quit**  
    - Exits the game and resets the state.  
    - Example: `quit`  
      - Response: "[Client Name] left the game. Closing both clients and resetting game state..."
@@ -324,30 +343,24 @@ Note: All commands are case insensitive.
 """)
 
 
-def handle_quit(s):
-    json_q_message = json.dumps({"type": "quit"})
-    s.sendall(json_q_message.encode())
+def handle_quit(shippy):
+    asyncio.ensure_future(shippy.quit())
 
-def handle_username(s, username):
-    json_u_message = json.dumps({"type": "username", "username": username})
-    s.sendall(json_u_message.encode())
+def handle_username(shippy, username):
+    shippy.set_username(username)
 
-def handle_join(s):
-    print("Joining game session...")
-    json_j_message = json.dumps({"type": "join"})
-    s.sendall(json_j_message.encode())
+def handle_join(shippy, opponent=None):
+    print("Joining game session..." if opponent != "bot" else "Joining game session against the AI...")
+    # the client asks for delta board updates and keeps its own copy of the boards
+    asyncio.ensure_future(send_request(shippy, shippy.join(opponent)))
 
 
-def is_valid_cell(fire):
-    if(len(fire) < 2):
-        return False
-    y_axis = fire[0] 
-    x_axis = fire[1:]
-    if(('a' <= y_axis.lower() <= 'j') and (x_axis.isdigit() and 1 <= int(x_axis) <= 10)):
-        return True
-    return False
+def is_valid_cell(fire, variant):
+    # a row label and a 1-based column on the server's board, e.g. B2
+    cell = parse_coord(fire)
+    return cell is not None and variant.contains(*cell)
 
-def is_valid_ship(input):
+def is_valid_ship(input, variant):
     parts = input.split()
     
     # Ensure there are exactly 3 elements (size, orientation, start position)
@@ -358,8 +371,7 @@ def is_valid_ship(input):
     ship_size, orientation, start_pos = parts
         
     # Validate size
-    size = int(ship_size)
-    if not (2 <= size <= 5):  # Adjust size range as per game rules
+    if not (ship_size.isascii() and ship_size.isdigit() and int(ship_size) in variant.fleet):  # one of the server's ship sizes
         return False
         
     # Validate orientation
@@ -367,11 +379,7 @@ def is_valid_ship(input):
         return False
         
     # Validate start position
-    row = start_pos[0]
-    if not ('A' <= row <= 'J'):  # Adjust grid row range as per game rules
-        return False
-    column = start_pos[1:]
-    if not (column.isdigit() and 1 <= int(column) <= 10):  # Adjust column range as per game rules
+    if not is_valid_cell(start_pos, variant):
         return False
         
     # All validations passed
@@ -390,8 +398,10 @@ def is_valid_ip(ip_str):
 def main():
     server_ip = None
     server_port = None
+    opponent = None
+    spectate = None
 
-    # Parse command-line arguments for flags -i and -p
+    # Parse command-line arguments for flags -i, -p, --bot and --spectate
     args = sys.argv[1:]
     for i in range(len(args)):
         if args[i] == '-i' and i + 1 < len(args):
@@ -402,9 +412,15 @@ def main():
             except ValueError:
                 print("Error: Port must be an integer.")
                 return
+        elif args[i] == '--bot':
+            # play the server's AI opponent rather than wait for another player
+            opponent = "bot"
+        elif args[i] == '--spectate':
+            # watch a game: the session id given, or else the most watched game on the server
+            spectate = int(args[i + 1]) if i + 1 < len(args) and args[i + 1].isdigit() else 0
     # Ensure both -i and -p arguments are provided
     if not server_ip or server_port is None:
-        print("Usage: python client.py -i SERVER_IP/DNS -p PORT")
+        print("Usage: python client.py -i SERVER_IP/DNS -p PORT [--bot | --spectate [SESSION]]")
         return
     # Main loop for attempting connection
     while True:
@@ -412,7 +428,7 @@ def main():
             # Step 1: Resolve the server IP (URL or IP address)
             resolved_ip = server_ip if is_valid_ip(server_ip) else socket.gethostbyname(server_ip)
             # Step 2: Try to establish TCP communication with the resolved IP
-            if tcp_communication(resolved_ip, server_port):
+            if tcp_communication(resolved_ip, server_port, opponent, spectate):
                 break
             else:
                 print("Failed to communicate with the server. Retry with the format: python client.py -i SERVER_IP/DNS -p PORT")
@@ -0,0 +1,336 @@
+import json
+import struct
+
+from framing import FrameError
+from board import ROWS, COLUMNS, WATER, HIT, MISS, SHIP_GLYPHS, is_large, format_cell, parse_coord
+
+# Payload encodings a connection can speak inside a frame (see framing.py). JSON is the default; the binary
+# codec is negotiated during the welcome handshake by replying {"type": "codec", "codec": "binary"}.
+#
+# A binary payload is a one-byte message type code followed by that type's fields. Cells are packed into one
+# byte (row * columns + column), players into one byte (1 or 2), and results and error reasons are small
+# enums instead of prose. Boards of 256 cells or more pack cells, and counts of cells, into four bytes, and
+# large boards (see board.LARGE_CELLS) send snapshots as a list of marked cells instead of full grids. Decoding yields the same dicts the JSON protocol uses, minus the prose "message"
+# (chat text excepted), so handlers never need to know which codec a connection uses. A payload that doesn't
+# decode to a message, in either codec, raises FrameError just like a malformed frame.
+
+CLIENT_TYPES = ('username', 'join', 'place', 'target', 'chat', 'quit', 'resync', 'resume', 'spectate', 'fleet')
+SERVER_TYPES = ('join_response', 'place_response', 'target_response', 'chat_response', 'quit_response',
+                'error_response', 'sync_response', 'third_client', 'resume_response', 'spectate_response',
+                'fleet_response', 'queue_response', 'match_response')
+# client messages use codes 0x01.., server messages 0x81..
+TYPE_CODES = {name: code for code, name in enumerate(CLIENT_TYPES, 0x01)}
+TYPE_CODES.update({name: code for code, name in enumerate(SERVER_TYPES, 0x81)})
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+RESULTS = ('miss', 'hit', 'sunk', 'win')
+ERROR_REASONS = ('invalid_type', 'not_joined', 'max_ships', 'ship_limit', 'no_room', 'occupied', 'no_opponent',
+                 'bad_cell', 'already_targeted', 'ships_not_placed', 'opponent_not_ready', 'not_your_turn', 'bad_resume',
+                 'no_game', 'spectating', 'rate_limited', 'bad_position', 'queued', 'bad_username')
+GLYPHS = (WATER, HIT, MISS) + SHIP_GLYPHS
+BOARDS = ('ship_positions', 'target_positions')
+# a spectator snapshot holds each player's shots (their target board), keyed by player
+PLAYERS = ('Player 1', 'Player 2')
+SPECTATOR = "Spectator"
+
+# longest username a server accepts, in characters; even at four UTF-8 bytes each, it fits a one-byte length
+MAX_USERNAME_LENGTH = 32
+
+SEQ = struct.Struct('!I')
+RATING = struct.Struct('!H')
+
+
+def pack_player(player):
+    # 0 for a spectator
+    return int(player.rsplit(' ', 1)[-1]) if player in PLAYERS else 0
+
+
+def unpack_player(value):
+    return f"Player {value}" if value else SPECTATOR
+
+
+def pack_username(username):
+    # A length-prefixed username. Names older than MAX_USERNAME_LENGTH (restored from a journal) may be longer
+    # than a length byte can say, so they are cut to fit, on a character boundary.
+    data = username.encode()[:255].decode(errors='ignore').encode()
+    return bytes((len(data),)) + data
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, payload):
+        try:
+            message = json.loads(payload)
+        except (ValueError, RecursionError) as e:
+            raise FrameError(f"Malformed JSON message: {e}") from e
+        if not isinstance(message, dict):
+            raise FrameError("A message must be a JSON object")
+        return message
+
+
+class BinaryCodec:
+    name = 'binary'
+
+    def __init__(self, rows=ROWS, columns=COLUMNS):
+        self.rows = rows
+        self.columns = columns
+        narrow = rows * columns < 256
+        self.cell = struct.Struct('!B' if narrow else '!I')
+        self.count = struct.Struct('!B' if narrow else '!I')
+        # a ship position is its size, a vertical flag and its start cell
+        self.position_size = 2 + self.cell.size
+        self.large = is_large(rows, columns)
+
+    def pack_cell(self, coord):
+        row, column = parse_coord(coord)
+        return self.cell.pack(row * self.columns + column)
+
+    def unpack_cell(self, body, offset):
+        return format_cell(*divmod(self.cell.unpack_from(body, offset)[0], self.columns))
+
+    def pack_position(self, position):
+        # "3 V B2" -> ship size, vertical flag and start cell
+        size, orientation, start = position.upper().split()
+        return bytes((int(size), orientation == 'V')) + self.pack_cell(start)
+
+    def unpack_position(self, body, offset):
+        return f"{body[offset]} {'V' if body[offset + 1] else 'H'} {self.unpack_cell(body, offset + 2)}"
+
+    def encode(self, message):
+        message_type = message['type']
+        out = bytearray((TYPE_CODES[message_type],))
+
+        if message_type in ('username', 'chat'):
+            out += message.get('username' if message_type == 'username' else 'message', '').encode()
+        elif message_type == 'join':
+            # bit 0: delta board updates, bit 1: play the server's AI opponent
+            out.append((1 if message.get('delta') else 0) | (2 if message.get('opponent') == 'bot' else 0))
+        elif message_type == 'place':
+            out += self.pack_position(message['position'])
+        elif message_type == 'fleet':
+            # a count, then one position per ship
+            out.append(len(message['positions']))
+            for position in message['positions']:
+                out += self.pack_position(position)
+        elif message_type == 'target':
+            out += self.pack_cell(message['target'])
+        elif message_type == 'resume':
+            out += SEQ.pack(message['session'])
+            out += message['token'].encode()
+        elif message_type == 'resume_response':
+            out.append(pack_player(message['player']))
+            out += SEQ.pack(message['session'])
+            out += message.get('username', '').encode()
+        elif message_type == 'queue_response':
+            out.append(pack_player(message['player']))
+            out += RATING.pack(message['rating'])
+        elif message_type == 'match_response':
+            # our seat and rating, then the opponent's username
+            out.append(pack_player(message['player']))
+            out += SEQ.pack(message['session']) + RATING.pack(message['rating'])
+            out += message.get('username', '').encode()
+        elif message_type == 'spectate':
+            out += SEQ.pack(message.get('session') or 0)
+        elif message_type == 'spectate_response':
+            # session, seq, then for each player a length-prefixed username and their target board
+            out += SEQ.pack(message['session']) + SEQ.pack(message['seq'])
+            for player in PLAYERS:
+                out += pack_username(message['players'].get(player, ''))
+                if self.large:
+                    self.encode_cells(out, message['cells'][player])
+                else:
+                    self.encode_grid(out, message['boards'][player])
+        elif message_type in ('join_response', 'quit_response'):
+            out.append(pack_player(message['player']))
+            out += message.get('username', '').encode()
+        elif message_type == 'chat_response':
+            out.append(pack_player(message['player']))
+            out += message['message'].encode()
+        elif message_type == 'error_response':
+            out += bytes((pack_player(message['player']), ERROR_REASONS.index(message['reason'])))
+        elif message_type == 'place_response':
+            out.append(pack_player(message['player']))
+            out += self.pack_position(message['position'])
+            self.encode_board_update(out, message)
+        elif message_type == 'fleet_response':
+            out += bytes((pack_player(message['player']), len(message['positions'])))
+            for position in message['positions']:
+                out += self.pack_position(position)
+            self.encode_board_update(out, message)
+        elif message_type == 'target_response':
+            out.append(pack_player(message['player']))
+            out += self.pack_cell(message['target'])
+            out.append(RESULTS.index(message['result']))
+            self.encode_board_update(out, message)
+        elif message_type == 'sync_response':
+            out += SEQ.pack(message['seq'])
+            self.encode_boards(out, message)
+        return bytes(out)
+
+    def encode_grid(self, out, rows):
+        for row in rows:
+            out += bytes(GLYPHS.index(glyph) for glyph in row)
+
+    def encode_cells(self, out, cells):
+        # a count, then each marked cell and its glyph
+        out += self.count.pack(len(cells))
+        for coord, glyph in cells.items():
+            out += self.pack_cell(coord)
+            out.append(GLYPHS.index(glyph))
+
+    def encode_boards(self, out, message):
+        # both of a player's boards: full grids, or the marked cells of a large board
+        for name in BOARDS:
+            if self.large:
+                self.encode_cells(out, message['cells'][name])
+            else:
+                self.encode_grid(out, message['boards'][name])
+
+    def encode_board_update(self, out, message):
+        # 0 + both full boards for full-board clients, 1 + seq + changed cells for delta clients
+        if 'changes' not in message:
+            out.append(0)
+            self.encode_boards(out, message)
+            return
+        out.append(1)
+        out += SEQ.pack(message['seq'])
+        cells = [(board, coord, glyph) for board, changes in message['changes'].items() for coord, glyph in changes.items()]
+        out += self.count.pack(len(cells))
+        for board, coord, glyph in cells:
+            out += self.pack_cell(coord)
+            out.append(BOARDS.index(board) << 4 | GLYPHS.index(glyph))
+
+    def decode(self, payload):
+        # truncated fields, unknown codes and bad UTF-8 all mean the payload isn't a message
+        try:
+            return self.decode_fields(payload)
+        except (LookupError, ValueError, struct.error) as e:
+            raise FrameError(f"Malformed binary message: {e!r}") from e
+
+    def decode_fields(self, payload):
+        message_type = TYPE_NAMES[payload[0]]
+        message = {'type': message_type}
+        body = payload[1:]
+
+        if message_type == 'username':
+            message['username'] = body.decode()
+        elif message_type == 'chat':
+            message['message'] = body.decode()
+        elif message_type == 'join':
+            message['delta'] = bool(body[0] & 1)
+            if body[0] & 2:
+                message['opponent'] = 'bot'
+        elif message_type == 'place':
+            message['position'] = self.unpack_position(body, 0)
+        elif message_type == 'fleet':
+            message['positions'] = [self.unpack_position(body, 1 + self.position_size * i) for i in range(body[0])]
+        elif message_type == 'target':
+            message['target'] = self.unpack_cell(body, 0)
+        elif message_type == 'resume':
+            (message['session'],) = SEQ.unpack_from(body, 0)
+            message['token'] = body[SEQ.size:].decode()
+        elif message_type == 'resume_response':
+            message['player'] = unpack_player(body[0])
+            (message['session'],) = SEQ.unpack_from(body, 1)
+            message['username'] = body[1 + SEQ.size:].decode()
+        elif message_type == 'queue_response':
+            message['player'] = unpack_player(body[0])
+            (message['rating'],) = RATING.unpack_from(body, 1)
+        elif message_type == 'match_response':
+            message['player'] = unpack_player(body[0])
+            (message['session'],) = SEQ.unpack_from(body, 1)
+            (message['rating'],) = RATING.unpack_from(body, 1 + SEQ.size)
+            message['username'] = body[1 + SEQ.size + RATING.size:].decode()
+        elif message_type == 'spectate':
+            (message['session'],) = SEQ.unpack_from(body, 0)
+        elif message_type == 'spectate_response':
+            message['player'] = SPECTATOR
+            (message['session'],) = SEQ.unpack_from(body, 0)
+            (message['seq'],) = SEQ.unpack_from(body, SEQ.size)
+            message['players'], boards = {}, {}
+            offset = 2 * SEQ.size
+            for player in PLAYERS:
+                length = body[offset]
+                message['players'][player] = body[offset + 1:offset + 1 + length].decode()
+                offset += 1 + length
+                boards[player], offset = self.decode_board(body, offset)
+            message['cells' if self.large else 'boards'] = boards
+        elif message_type in ('join_response', 'quit_response'):
+            message['player'] = unpack_player(body[0])
+            message['username'] = body[1:].decode()
+        elif message_type == 'chat_response':
+            message['player'] = unpack_player(body[0])
+            message['message'] = body[1:].decode()
+        elif message_type == 'error_response':
+            message['player'] = unpack_player(body[0])
+            message['reason'] = ERROR_REASONS[body[1]]
+        elif message_type == 'place_response':
+            message['player'] = unpack_player(body[0])
+            message['position'] = self.unpack_position(body, 1)
+            self.decode_board_update(message, body, 1 + self.position_size)
+        elif message_type == 'fleet_response':
+            message['player'] = unpack_player(body[0])
+            message['positions'] = [self.unpack_position(body, 2 + self.position_size * i) for i in range(body[1])]
+            self.decode_board_update(message, body, 2 + self.position_size * body[1])
+        elif message_type == 'target_response':
+            message['player'] = unpack_player(body[0])
+            message['target'] = self.unpack_cell(body, 1)
+            message['result'] = RESULTS[body[1 + self.cell.size]]
+            self.decode_board_update(message, body, 2 + self.cell.size)
+        elif message_type == 'sync_response':
+            (message['seq'],) = SEQ.unpack_from(body, 0)
+            self.decode_boards(message, body, SEQ.size)
+        return message
+
+    def decode_board(self, body, offset):
+        # One board and the offset just past it: rows of glyphs, or {cell: glyph} for a large board
+        if self.large:
+            (count,) = self.count.unpack_from(body, offset)
+            offset += self.count.size
+            cells = {}
+            for _ in range(count):
+                cells[self.unpack_cell(body, offset)] = GLYPHS[body[offset + self.cell.size]]
+                offset += self.cell.size + 1
+            return cells, offset
+        rows = []
+        for _ in range(self.rows):
+            rows.append([GLYPHS[code] for code in body[offset:offset + self.columns]])
+            offset += self.columns
+        return rows, offset
+
+    def decode_boards(self, message, body, offset):
+        boards = {}
+        for name in BOARDS:
+            boards[name], offset = self.decode_board(body, offset)
+        message['cells' if self.large else 'boards'] = boards
+
+    def decode_board_update(self, message, body, offset):
+        if body[offset] == 0:
+            self.decode_boards(message, body, offset + 1)
+            return
+        (message['seq'],) = SEQ.unpack_from(body, offset + 1)
+        offset += 1 + SEQ.size
+        (count,) = self.count.unpack_from(body, offset)
+        offset += self.count.size
+        changes = {}
+        for _ in range(count):
+            cell, packed = self.unpack_cell(body, offset), body[offset + self.cell.size]
+            changes.setdefault(BOARDS[packed >> 4], {})[cell] = GLYPHS[packed & 0x0F]
+            offset += self.cell.size + 1
+        message['changes'] = changes
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {codec.name: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+
+
+def codecs_for(rows, columns):
+    # The codecs a server hosting boards of this size offers (by name)
+    if (rows, columns) == (ROWS, COLUMNS):
+        return CODECS
+    return {codec.name: codec for codec in (JSON_CODEC, BinaryCodec(rows, columns))}
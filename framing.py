@@ -0,0 +1,51 @@
+import struct
+
+# Every message on the wire is a 4-byte big-endian payload length followed by the payload itself,
+# so a reader can split a TCP stream back into whole messages no matter how it was segmented.
+HEADER = struct.Struct('!I')
+
+# how much to ask the socket for per read; one read can carry many frames
+RECV_SIZE = 65536
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    # Incremental decoder: feed it whatever recv() returned and it hands back every frame completed so far,
+    # holding on to any trailing partial frame until the rest of it arrives. A frame longer than
+    # `max_frame_size` raises FrameError before it is buffered, since a sane peer never sends one.
+    # With a `limiter` (see admission.py) each completed frame is charged to it first; frames it refuses are
+    # skipped without being copied or decoded and only counted in `rejected`, for the caller to act on.
+    def __init__(self, max_frame_size, limiter=None):
+        self.max_frame_size = max_frame_size
+        self.limiter = limiter
+        self.rejected = 0
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        start = 0
+        while len(buffer) - start >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer, start)
+            if length > self.max_frame_size:
+                raise FrameError(f"Frame of {length} bytes exceeds the {self.max_frame_size} byte limit")
+            end = start + HEADER.size + length
+            if len(buffer) < end:
+                break
+            if self.limiter is None or self.limiter.allow():
+                frames.append(bytes(buffer[start + HEADER.size:end]))
+            else:
+                self.rejected += 1
+            start = end
+        # drop consumed bytes in one go instead of once per frame
+        if start:
+            del buffer[:start]
+        return frames
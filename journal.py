@@ -0,0 +1,181 @@
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+# Durable game journal. Every state change the server makes (a player joining, naming themselves, placing a ship,
+# firing, a session ending) is appended as one JSON line to journal-NNNNNN.log in the journal directory. Handlers
+# only put the event on a queue; a single writer thread writes whatever has queued up and fsyncs once per batch
+# (group commit), at most once every `sync_interval` seconds, so a busy server pays for one fsync per batch of
+# moves rather than one per move. A crash loses at most the events of the batch being written.
+#
+# The writer also folds each event into a compact summary of the live sessions (players, their fleets and their
+# shots), and every `snapshot_every` events writes that summary to snapshot-NNNNNN.json and starts a new journal
+# segment, deleting the old ones. Recovery reads the newest snapshot and replays the segments after it, so replay
+# time stays bounded by the snapshot interval rather than by the server's uptime.
+#
+# Events: {"e": "join", "s": session, "p": player, "token": ..., "username": ..., "delta": ..., "bot": ...}
+#         {"e": "name", "s", "p", "username"}   {"e": "place", "s", "p", "position"}
+#         {"e": "shot", "s", "p", "target"}     {"e": "end", "s"}
+
+SNAPSHOT_EVERY = 10000
+SYNC_INTERVAL = 0.01
+
+
+def segment_path(directory, kind, index):
+    extension = "json" if kind == "snapshot" else "log"
+    return os.path.join(directory, f"{kind}-{index:06d}.{extension}")
+
+
+def segment_indexes(directory, kind):
+    indexes = []
+    for path in glob.glob(os.path.join(directory, f"{kind}-*")):
+        name = os.path.basename(path).split('-', 1)[1].split('.', 1)[0]
+        if name.isdigit():
+            indexes.append(int(name))
+    return sorted(indexes)
+
+
+def apply(state, event):
+    # Fold one event into the sessions summary: session id (str) -> player id -> seat
+    kind = event['e']
+    session_id = str(event['s'])
+    if kind == 'end':
+        state.pop(session_id, None)
+        return
+    players = state.setdefault(session_id, {})
+    if kind == 'join':
+        players[event['p']] = {'token': event['token'], 'username': event['username'], 'delta': event['delta'],
+                               'bot': event.get('bot', False), 'positions': [], 'targets': []}
+        return
+    seat = players.get(event['p'])
+    if seat is None:
+        return  # an event for a seat whose join never made it to disk
+    if kind == 'name':
+        seat['username'] = event['username']
+    elif kind == 'place':
+        seat['positions'].append(event['position'])
+    elif kind == 'shot':
+        seat['targets'].append(event['target'])
+
+
+def load(directory):
+    # Rebuild the sessions summary from the newest snapshot and every journal segment written after it.
+    # Returns (sessions, index of the last segment read).
+    snapshots = segment_indexes(directory, "snapshot")
+    state = {}
+    first = 0
+    if snapshots:
+        first = snapshots[-1]
+        with open(segment_path(directory, "snapshot", first), encoding='utf-8') as f:
+            state = json.load(f)['sessions']
+
+    last = first
+    for index in segment_indexes(directory, "journal"):
+        if index < first:
+            continue
+        last = index
+        with open(segment_path(directory, "journal", index), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # a torn write at the end of a segment from a crash mid-batch; nothing after it was committed
+                    logging.warning("Ignoring a partial journal record in segment %d.", index)
+                    break
+                apply(state, event)
+    return state, last
+
+
+class Journal(threading.Thread):
+    def __init__(self, directory, sessions, last_index, snapshot_every=SNAPSHOT_EVERY, sync_interval=SYNC_INTERVAL):
+        super().__init__(name="journal", daemon=True)
+        self.directory = directory
+        self.sessions = sessions  # the writer's own summary; game threads never touch it
+        self.index = last_index
+        self.snapshot_every = snapshot_every
+        self.sync_interval = sync_interval
+        self.events = queue.Queue()
+        self.since_snapshot = 0
+        self.file = None
+        self.closed = False
+        # everything recovered at startup goes into a fresh snapshot, so the segments it came from can go
+        self.snapshot()
+
+    def append(self, event):
+        if not self.closed:
+            self.events.put_nowait(event)
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.events.get(timeout=0.2)]
+            except queue.Empty:
+                if self.closed:
+                    break
+                continue
+            while True:
+                try:
+                    batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                self.commit(batch)
+                break
+            self.commit(batch)
+            if self.since_snapshot >= self.snapshot_every:
+                self.snapshot()
+            # cap the fsync rate; anything arriving meanwhile joins the next batch
+            time.sleep(self.sync_interval)
+        self.file.close()
+
+    def commit(self, batch):
+        if not batch:
+            return
+        self.file.write("".join(json.dumps(event, separators=(',', ':')) + "\n" for event in batch))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        for event in batch:
+            apply(self.sessions, event)
+        self.since_snapshot += len(batch)
+
+    def snapshot(self):
+        # write the summary atomically, then switch to a new segment and drop everything the snapshot covers
+        self.index += 1
+        path = segment_path(self.directory, "snapshot", self.index)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({'segment': self.index, 'sessions': self.sessions}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        if self.file:
+            self.file.close()
+        self.file = open(segment_path(self.directory, "journal", self.index), 'a', encoding='utf-8')
+        for kind in ("snapshot", "journal"):
+            for index in segment_indexes(self.directory, kind):
+                if index < self.index:
+                    os.remove(segment_path(self.directory, kind, index))
+        self.since_snapshot = 0
+
+    def close(self):
+        # commit what has been queued so far and ignore anything appended afterwards
+        if self.closed:
+            return
+        self.closed = True
+        self.events.put_nowait(None)
+        self.join()
+
+
+def open_journal(directory, snapshot_every=SNAPSHOT_EVERY, sync_interval=SYNC_INTERVAL):
+    # Recover the journal in `directory` (creating it if needed) and start its writer thread.
+    # Returns (journal, recovered sessions summary).
+    os.makedirs(directory, exist_ok=True)
+    sessions, last_index = load(directory)
+    recovered = json.loads(json.dumps(sessions))  # the server's copy; the writer keeps folding into its own
+    journal = Journal(directory, sessions, last_index, snapshot_every, sync_interval)
+    journal.start()
+    return journal, recovered
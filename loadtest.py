@@ -0,0 +1,252 @@
+import asyncio
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+from asyncclient import ShippyClient, ServerError, TargetEvent, QuitEvent, QueueEvent, MatchEvent, DisconnectEvent
+from board import format_cell, ship_span
+
+# Headless load generator: plays many complete games between scripted bot pairs against a running server
+# (or one it starts itself) and reports throughput, round-trip latency percentiles per message type,
+# connection setup cost and error counts.
+#
+#   python loadtest.py -p 12358 -g 1000 -c 30 [--binary] [--spawn-server asyncio]
+#
+# Bots play whatever variant the server announces in its welcome (board size and fleet).
+
+# how long a bot waits for any single response before counting a timeout
+RESPONSE_TIMEOUT = 10
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # message type -> round trip seconds
+        self.errors = Counter()  # error_response reason / failure kind -> count
+        self.connect_times = []
+        self.moves = 0
+        self.games = 0
+
+    def record(self, message_type, started):
+        self.latencies[message_type].append(time.perf_counter() - started)
+
+
+class Bot:
+    # A ShippyClient plus latency bookkeeping for every request it makes
+    def __init__(self, client, stats):
+        self.client = client
+        self.stats = stats
+
+    async def request(self, message_type, coroutine):
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(coroutine, RESPONSE_TIMEOUT)
+        except ServerError as e:
+            self.stats.errors[e.reason or "error_response"] += 1
+            return e.event
+        finally:
+            self.stats.record(message_type, started)
+
+    async def next_event(self, *event_classes):
+        event = await asyncio.wait_for(self.client.next_event(*event_classes), RESPONSE_TIMEOUT)
+        if isinstance(event, DisconnectEvent):
+            raise ConnectionError("connection closed by server")
+        return event
+
+
+async def connect_bot(host, port, stats, args, name):
+    started = time.perf_counter()
+    client = await ShippyClient.connect(host, port, username=name, codec="binary" if args.binary else "json",
+                                        delta=not args.full_boards)
+    stats.connect_times.append(time.perf_counter() - started)
+    return Bot(client, stats)
+
+
+def random_fleet(variant):
+    # a random legal layout as "size orientation start" position strings
+    rows, columns = variant.rows, variant.columns
+    occupied = set()
+    positions = []
+    for size in sorted((size for size, number in variant.fleet.items() for _ in range(number)), reverse=True):
+        while True:
+            vertical = random.random() < 0.5 if size <= min(rows, columns) else size <= rows
+            row = random.randrange(rows - size + 1 if vertical else rows)
+            column = random.randrange(columns if vertical else columns - size + 1)
+            cells = set(ship_span(row, column, size, vertical))
+            if not cells & occupied:
+                occupied |= cells
+                positions.append(f"{size} {'V' if vertical else 'H'} {format_cell(row, column)}")
+                break
+    return positions
+
+
+def random_shots(variant, args):
+    # every cell of the board in random order, or the first --max-shots of them
+    cells = variant.rows * variant.columns
+    order = random.sample(range(cells), min(cells, args.max_shots or cells))
+    return [format_cell(*divmod(cell, variant.columns)) for cell in order]
+
+
+async def place_fleet(bot, args):
+    # one fleet request per player, or a place request per ship with --place-each
+    if args.place_each:
+        for position in random_fleet(bot.client.variant):
+            await bot.request("place", bot.client.place(position))
+    else:
+        await bot.request("fleet", bot.client.fleet(random_fleet(bot.client.variant)))
+
+
+async def play_game(host, port, stats, args, seating):
+    players = []
+    try:
+        # the server matches players by rating; both bots of a game play unrated (no username) and join back to back,
+        # the first waiting to be matched when the second joins, so they are matched with each other
+        replies = []
+        async with seating:
+            for i in range(2):
+                players.append(await connect_bot(host, port, stats, args, None))
+            for bot in players:
+                replies.append(await bot.request("join", bot.client.join()))
+        if isinstance(replies[0], QueueEvent):
+            await players[0].next_event(MatchEvent)
+        if players[0].client.session != players[1].client.session:
+            raise ConnectionError("bots were not matched with each other")
+        for bot in players:
+            await place_fleet(bot, args)
+
+        # Player 1 always fires first; the game ends on the first "win"
+        shots = [random_shots(bot.client.variant, args) for bot in players]
+        turn = 0
+        while True:
+            shooter, other = players[turn], players[1 - turn]
+            response = await shooter.request("target", shooter.client.target(shots[turn].pop()))
+            if not isinstance(response, TargetEvent):
+                break
+            await other.next_event(TargetEvent)
+            stats.moves += 1
+            if args.chat_every and stats.moves % args.chat_every == 0:
+                await shooter.request("chat", shooter.client.chat("gg"))
+            if response.won or not shots[turn]:
+                break
+            turn = 1 - turn
+        stats.games += 1
+        await players[0].client.quit()
+        await players[1].next_event(QuitEvent)
+    except asyncio.TimeoutError:
+        stats.errors["timeout"] += 1
+    except (ConnectionError, OSError) as e:
+        stats.errors[f"connection: {e}"] += 1
+    finally:
+        for bot in players:
+            await bot.client.close()
+
+
+async def play_bot_game(host, port, stats, args, seating):
+    # one connection per game against the server's AI opponent, which answers each shot with its own
+    bot = None
+    try:
+        # the AI only takes a seat nobody else has, so don't let the next connection arrive before it does
+        async with seating:
+            bot = await connect_bot(host, port, stats, args, "solo")
+            await bot.request("join", bot.client.join(opponent="bot"))
+        await place_fleet(bot, args)
+
+        shots = random_shots(bot.client.variant, args)
+        while shots:
+            response = await bot.request("target", bot.client.target(shots.pop()))
+            if not isinstance(response, TargetEvent) or response.won:
+                break
+            stats.moves += 1
+            reply = await bot.next_event(TargetEvent)
+            stats.moves += 1
+            if reply.won:
+                break
+        stats.games += 1
+        await bot.client.quit()
+    except asyncio.TimeoutError:
+        stats.errors["timeout"] += 1
+    except (ConnectionError, OSError) as e:
+        stats.errors[f"connection: {e}"] += 1
+    finally:
+        if bot:
+            await bot.client.close()
+
+
+async def run_load(args):
+    stats = Stats()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    seating = asyncio.Lock()
+
+    async def limited_game():
+        async with semaphore:
+            if args.vs_bot:
+                await play_bot_game(args.ip, args.port, stats, args, seating)
+            else:
+                await play_game(args.ip, args.port, stats, args, seating)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(limited_game() for _ in range(args.games)))
+    return stats, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(stats, elapsed):
+    print(f"\n{stats.games} games, {stats.moves} moves in {elapsed:.2f}s "
+          f"({stats.moves / elapsed:.0f} moves/sec, {stats.games / elapsed:.1f} games/sec)")
+    print(f"\n{'message':<10}{'count':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = sorted(stats.latencies.items())
+    if stats.connect_times:
+        rows.insert(0, ("connect", stats.connect_times))
+    for name, values in rows:
+        print(f"{name:<10}{len(values):>9}" + "".join(f"{percentile(values, p) * 1000:>10.2f}" for p in (0.5, 0.95, 0.99))
+              + f"{max(values) * 1000:>10.2f}")
+    print("\nerrors:" + ("".join(f"\n  {reason}: {count}" for reason, count in stats.errors.most_common()) or " none"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shippy load generator")
+    parser.add_argument('-i', '--ip', default="127.0.0.1", help="server address")
+    parser.add_argument('-p', '--port', type=int, required=True, help="server port")
+    parser.add_argument('-g', '--games', type=int, default=100, help="total games to play")
+    parser.add_argument('-c', '--concurrency', type=int, default=50, help="games in flight at once")
+    parser.add_argument('--binary', action='store_true', help="negotiate the binary codec")
+    parser.add_argument('--full-boards', action='store_true', help="ask for full boards instead of delta updates")
+    parser.add_argument('--vs-bot', action='store_true', help="play every game as one connection against the server's AI")
+    parser.add_argument('--place-each', action='store_true', help="place ships one request at a time instead of as one fleet")
+    parser.add_argument('--max-shots', type=int, default=0,
+                        help="end each game after this many shots per player (0: play until someone wins); random shots take long to win on large boards")
+    parser.add_argument('--chat-every', type=int, default=0, help="send a chat every N moves (0 to disable)")
+    parser.add_argument('--spawn-server', choices=['threaded', 'asyncio'],
+                        help="start a local server.py in this mode for the duration of the run")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = None
+    if args.spawn_server:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"), "-p", str(args.port), "--mode", args.spawn_server,
+                                   # measure raw capacity: every load-test connection comes from this one address
+                                   "--rate-limit", "0", "--address-rate-limit", "0", "--max-connections-per-address", "0"],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(1)
+    try:
+        stats, elapsed = asyncio.run(run_load(args))
+        report(stats, elapsed)
+    except KeyboardInterrupt:
+        print("\nLoad test interrupted.")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import bisect
+import threading
+import time
+from collections import deque
+
+# Rated matchmaking. A player who joins without an opponent waits in a MatchQueue until someone with a close
+# enough rating joins too. Waiting players are kept in buckets of BUCKET_WIDTH rating points, oldest first, and
+# the buckets that hold anyone are kept in a sorted list. Matching a newcomer looks up its own bucket with a
+# bisect and then walks outward to the nearest buckets, comparing it only with the player who has waited
+# longest in each; the walk ends at MAX_WINDOW points away, so it visits at most a few dozen buckets however
+# many players are waiting.
+#
+# What counts as close enough widens the longer a player waits: BASE_WINDOW points at first, WIDEN_RATE more for
+# every second spent waiting, up to MAX_WINDOW. Newcomers are matched on arrival; sweep() pairs up players
+# who were too far apart when they arrived but whose windows have since grown to cover each other.
+#
+# Ratings are Elo ratings kept per username for as long as the process runs. Players without a username are
+# unrated: they wait at DEFAULT_RATING and their games don't change anyone's rating.
+
+DEFAULT_RATING = 1200
+# Elo K-factor: the most one game can move a rating
+K_FACTOR = 32
+
+BUCKET_WIDTH = 50
+# rating points a waiting player will accept at first, how many more per second waited, and the widest it gets;
+# BASE_WINDOW is at least BUCKET_WIDTH, so players in the same bucket are always matched on arrival
+BASE_WINDOW = 100
+WIDEN_RATE = 10
+MAX_WINDOW = 1000
+# seconds between sweeps for players whose windows have grown to cover each other
+SWEEP_INTERVAL = 1
+
+
+class Ratings:
+    # Elo ratings by username; shared by every game in the process, so guarded by a lock of its own
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ratings = {}
+
+    def rating(self, username):
+        with self.lock:
+            return self.ratings.get(username, DEFAULT_RATING)
+
+    def record_win(self, winner, loser):
+        # Update both players' ratings after `winner` beat `loser`; returns their new ratings, or None when
+        # either is unrated
+        if not winner or not loser or winner == loser:
+            return None
+        with self.lock:
+            winner_rating = self.ratings.get(winner, DEFAULT_RATING)
+            loser_rating = self.ratings.get(loser, DEFAULT_RATING)
+            expected = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
+            change = K_FACTOR * (1 - expected)
+            self.ratings[winner] = winner_rating + change
+            self.ratings[loser] = loser_rating - change
+            return self.ratings[winner], self.ratings[loser]
+
+
+class Ticket:
+    # One waiting player. Tickets are left in their bucket when the player leaves and skipped once they reach
+    # its head, so leaving the queue never searches a bucket.
+    __slots__ = ('player', 'rating', 'since', 'live')
+
+    def __init__(self, player, rating, since):
+        self.player = player
+        self.rating = rating
+        self.since = since
+        self.live = True
+
+    def window(self, now):
+        return min(BASE_WINDOW + WIDEN_RATE * (now - self.since), MAX_WINDOW)
+
+
+class MatchQueue:
+    # Players waiting for an opponent, indexed by rating bucket and arrival time. `player` may be any hashable
+    # object; the server queues its client dicts by id().
+    def __init__(self):
+        self.buckets = {}  # bucket -> deque of tickets, oldest first
+        self.keys = []  # buckets holding anyone, ascending; each has a live ticket at its head
+        self.tickets = {}  # id(player) -> live ticket
+        self.next_sweep = 0
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, player):
+        return id(player) in self.tickets
+
+    def add(self, player, rating, now=None):
+        # Match a newcomer with the closest waiting player whose window covers it and return that player, or
+        # queue the newcomer and return None
+        now = time.monotonic() if now is None else now
+        ticket = self.find(rating, now)
+        if ticket is not None:
+            self.discard(ticket)
+            return ticket.player
+        ticket = Ticket(player, rating, now)
+        self.tickets[id(player)] = ticket
+        bucket = self.bucket(rating)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = deque()
+            bisect.insort(self.keys, bucket)
+        self.buckets[bucket].append(ticket)
+        return None
+
+    def remove(self, player):
+        ticket = self.tickets.get(id(player))
+        if ticket is not None:
+            self.discard(ticket)
+
+    def sweep(self, now=None):
+        # Pair up waiting players whose windows have widened to cover each other, at most once per
+        # SWEEP_INTERVAL. Returns (older, newer) pairs.
+        now = time.monotonic() if now is None else now
+        if now < self.next_sweep or len(self.keys) < 2:
+            return []
+        self.next_sweep = now + SWEEP_INTERVAL
+        pairs = []
+        # only bucket heads need trying: players in the same bucket never wait on each other
+        for bucket in list(self.keys):
+            head = self.head(bucket)
+            if head is None:
+                continue
+            other = self.find(head.rating, now, head)
+            if other is None:
+                continue
+            self.discard(head)
+            self.discard(other)
+            pairs.append((head.player, other.player) if head.since <= other.since else (other.player, head.player))
+        return pairs
+
+    def find(self, rating, now, exclude=None):
+        # The head of the nearest bucket whose window (or `exclude`'s, when sweeping for it) covers `rating`
+        bucket = self.bucket(rating)
+        keys = self.keys
+        above = bisect.bisect_left(keys, bucket)
+        below = above - 1
+        reach = MAX_WINDOW // BUCKET_WIDTH + 1
+        while below >= 0 or above < len(keys):
+            # step to whichever of the two next buckets is nearer, the older head first on a tie
+            if above >= len(keys) or (below >= 0 and bucket - keys[below] < keys[above] - bucket):
+                key, below = keys[below], below - 1
+            elif below < 0 or keys[above] - bucket < bucket - keys[below]:
+                key, above = keys[above], above + 1
+            elif self.head(keys[below]).since <= self.head(keys[above]).since:
+                key, below = keys[below], below - 1
+            else:
+                key, above = keys[above], above + 1
+            if abs(key - bucket) > reach:
+                break
+            ticket = self.head(key)
+            if ticket is exclude:
+                continue
+            window = max(ticket.window(now), exclude.window(now) if exclude else 0)
+            if abs(ticket.rating - rating) <= window:
+                return ticket
+        return None
+
+    def head(self, bucket):
+        # the oldest live ticket in a bucket, dropping any left behind by players who have gone
+        tickets = self.buckets.get(bucket)
+        while tickets and not tickets[0].live:
+            tickets.popleft()
+        return tickets[0] if tickets else None
+
+    def discard(self, ticket):
+        ticket.live = False
+        del self.tickets[id(ticket.player)]
+        bucket = self.bucket(ticket.rating)
+        if self.head(bucket) is None:
+            del self.buckets[bucket]
+            self.keys.pop(bisect.bisect_left(self.keys, bucket))
+
+    @staticmethod
+    def bucket(rating):
+        return int(rating // BUCKET_WIDTH)
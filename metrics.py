@@ -0,0 +1,131 @@
+import bisect
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process server metrics, served in the Prometheus text exposition format from a small HTTP listener
+# (start_http_server) on a thread of its own, so scrapes never wait on the game loop:
+#
+#   curl http://127.0.0.1:9100/metrics
+#
+# Counters and histograms are updated inline on the request path and only cost a dict lookup and an add under
+# a lock. Gauges that describe current state (connections, games, send queues) are read from callbacks when
+# the endpoint is scraped.
+
+# handler latency buckets in seconds, from 10µs to 1s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0)
+
+lock = threading.Lock()
+# metric name -> (type, help)
+descriptions = {}
+# metric name -> {labels tuple: value}
+counters = defaultdict(lambda: defaultdict(float))
+# metric name -> {labels tuple: [bucket counts..., sum, count]}
+histograms = defaultdict(dict)
+# metric name -> callable returning {labels tuple: value}
+gauges = {}
+
+
+def describe(name, metric_type, help_text):
+    descriptions[name] = (metric_type, help_text)
+
+
+describe('shippy_handler_latency_seconds', 'histogram', "Time spent handling one client message, by message type.")
+describe('shippy_messages_received_total', 'counter', "Messages received from clients, by message type.")
+describe('shippy_messages_sent_total', 'counter', "Messages sent to clients, by message type.")
+describe('shippy_bytes_received_total', 'counter', "Bytes read from client connections, framing included.")
+describe('shippy_bytes_sent_total', 'counter', "Bytes written to client connections, framing included.")
+describe('shippy_error_responses_total', 'counter', "error_response messages sent, by reason.")
+describe('shippy_connections_total', 'counter', "Connections accepted, by outcome (seated, rejected when the server is full, or limited when their address is at its connection cap).")
+describe('shippy_spectator_skips_total', 'counter', "Events not sent to a spectator because it was too far behind.")
+describe('shippy_spectators_dropped_total', 'counter', "Spectators disconnected for staying too far behind.")
+describe('shippy_rate_limited_total', 'counter', "Messages dropped unread for exceeding a connection's or address's rate limit.")
+describe('shippy_rate_limit_disconnects_total', 'counter', "Connections closed for repeatedly exceeding their rate limit.")
+describe('shippy_matches_total', 'counter', "Pairs of waiting players matched into a game.")
+describe('shippy_send_queue_overflows_total', 'counter', "Messages not queued because a connection's outbound queue was full, by policy.")
+
+
+def inc(name, labels=(), amount=1):
+    with lock:
+        counters[name][labels] += amount
+
+
+def observe(name, labels, value, buckets=LATENCY_BUCKETS):
+    with lock:
+        series = histograms[name].get(labels)
+        if series is None:
+            series = histograms[name][labels] = [0] * (len(buckets) + 3)
+        # one count per bucket plus +Inf, then sum and count; made cumulative at scrape time
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+def gauge(name, help_text, read):
+    # read() returns {labels tuple: value}; label tuples are ((label, value), ...) like everywhere else
+    describe(name, 'gauge', help_text)
+    gauges[name] = read
+
+
+def format_labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def format_value(value):
+    # exact integers for counts (":g" would round big counters), full precision otherwise
+    return str(int(value)) if value == int(value) else repr(float(value))
+
+
+def render():
+    # the whole registry in Prometheus text format
+    with lock:
+        counter_values = {name: dict(series) for name, series in counters.items()}
+        histogram_values = {name: {labels: list(values) for labels, values in series.items()}
+                            for name, series in histograms.items()}
+    lines = []
+    for name, (metric_type, help_text) in descriptions.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == 'counter':
+            for labels, value in counter_values.get(name, {}).items():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        elif metric_type == 'histogram':
+            for labels, values in histogram_values.get(name, {}).items():
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(values[-2])}")
+                lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+        elif metric_type == 'gauge':
+            for labels, value in gauges[name]().items():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would otherwise flood stderr
+
+
+def start_http_server(port, address="127.0.0.1"):
+    # Serve /metrics from a daemon thread; returns the server so callers can read the bound port
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,91 @@
+import numpy as np
+
+from ai import HIT_WEIGHT
+
+# NumPy board backend for the bot's targeting (ai.py, --bot-backend numpy). The bot's view of the opponent's
+# board is three boolean masks, and the placement counting is a handful of prefix-sum (sliding-window) operations
+# over them per ship size, so on a 10x10 board a move costs tens of microseconds. The cost grows with the board's
+# area: on the largest boards a bot move takes tens of milliseconds. density() also scores whole stacks of boards
+# at once for simulate.py.
+
+
+def prefix_sums(lines):
+    # Running totals along the last axis with a leading zero, so any window's sum is one subtraction
+    prefix = np.zeros(lines.shape[:-1] + (lines.shape[-1] + 1,), dtype=np.int32)
+    np.cumsum(lines, axis=-1, dtype=np.int32, out=prefix[..., 1:])
+    return prefix
+
+
+def density(hits, misses, sunk, remaining):
+    # hits/misses/sunk: rows x columns boolean masks (sunk marks the cells of ships already sunk), or stacks of
+    # them (batch x rows x columns) to score many games at once. remaining: {ship size: how many of that size
+    # are still afloat}, as numbers or as one number per game. Returns the placement-count grid(s).
+    # On a square board rows and columns are stacked into one array of lines so both orientations are counted
+    # in one pass; otherwise each orientation gets a pass of its own.
+    blocked = misses | sunk
+    unsunk_hits = hits & ~sunk
+    rows = hits.shape[-2]
+    if rows == hits.shape[-1]:
+        lines = line_counts(np.concatenate((blocked, np.swapaxes(blocked, -1, -2)), axis=-2),
+                            np.concatenate((unsunk_hits, np.swapaxes(unsunk_hits, -1, -2)), axis=-2), remaining)
+        counts = lines[..., :rows, :] + np.swapaxes(lines[..., rows:, :], -1, -2)
+    else:
+        counts = line_counts(blocked, unsunk_hits, remaining)
+        counts += np.swapaxes(line_counts(np.swapaxes(blocked, -1, -2), np.swapaxes(unsunk_hits, -1, -2), remaining), -1, -2)
+
+    # never fire at a cell twice
+    counts[hits | misses] = 0
+    return counts
+
+
+def line_counts(blocked, unsunk_hits, remaining):
+    # For each cell of a stack of lines, the weighted number of placements along its line that cover it
+    blocked_prefix = prefix_sums(blocked)
+    hit_prefix = prefix_sums(unsunk_hits)
+
+    # placements are spread over the cells they cover through a difference array: +weight where a placement
+    # starts, -weight just past where it ends, and one running sum at the end
+    length = blocked.shape[-1]
+    spread = np.zeros(blocked_prefix.shape, dtype=np.int32)
+    for size, number in remaining.items():
+        number = np.asarray(number, dtype=np.int32)
+        if size > length or not number.any():
+            continue
+        # a placement starting at [line, c] covers c..c+size-1 and fits when no blocked cell is under it;
+        # each unsunk hit it covers makes it far more likely
+        weight = hit_prefix[..., size:] - hit_prefix[..., :-size]
+        weight *= HIT_WEIGHT
+        weight += 1
+        weight *= blocked_prefix[..., size:] == blocked_prefix[..., :-size]
+        weight *= number[..., None, None]
+        spread[..., :length - size + 1] += weight
+        spread[..., size:] -= weight
+    return np.cumsum(spread[..., :length], axis=-1, dtype=np.int32)
+
+
+class TargetBoard:
+    # What the bot has seen of the opponent's board: its hits, its misses and the cells of the ships it has sunk
+    __slots__ = ('hits', 'misses', 'sunk')
+
+    def __init__(self, rows, columns):
+        self.hits = np.zeros((rows, columns), dtype=bool)
+        self.misses = np.zeros((rows, columns), dtype=bool)
+        self.sunk = np.zeros((rows, columns), dtype=bool)
+
+    def miss(self, row, column):
+        self.misses[row, column] = True
+
+    def hit(self, row, column):
+        self.hits[row, column] = True
+
+    def sink(self, cells):
+        for row, column in cells:
+            self.sunk[row, column] = True
+
+    def densest(self, remaining):
+        # flat indexes of the unshot cells the most placements cover
+        counts = density(self.hits, self.misses, self.sunk, remaining)
+        if counts.max() == 0:
+            # nothing consistent is left (only possible against an inconsistent board); take any unshot cell
+            return np.flatnonzero(~(self.hits | self.misses))
+        return np.flatnonzero(counts == counts.max())
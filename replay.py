@@ -0,0 +1,305 @@
+import argparse
+import glob
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+from board import ROWS, COLUMNS, FLEET, Variant, format_cell, parse_fleet
+
+# Binary archive of finished games, for analytics and dispute review. Each game is one fixed-width header
+# followed by one record per move, in the order the server accepted them, and the server's recorder
+# thread appends whole games to segment files (replay-NNNNNN.bin, or replay-wN-NNNNNN.bin per --workers worker).
+# Nothing in a segment is text: the loader memory-maps it and hops from header to header, so scanning millions
+# of games or seeking to one by id never parses anything but the records it is asked for.
+#
+# Game header (little-endian, 74 bytes):
+#   magic "SHPG", format version, winner (0: none, 1: Player 1, 2: Player 2), number of moves,
+#   game id, session id, start and end time (Unix seconds), both players' usernames (UTF-8, zero-padded),
+#   board rows and columns
+# Move record (4 bytes, or 6 with two-byte row and column on boards over 256 rows or columns):
+#   kind << 4 | player (1 or 2), row, column, then
+#   for a placement: ship size, | 0x80 if vertical
+#   for a shot: the result the server sent (MISS, HIT, SUNK or WIN)
+#
+# A crash can leave the last game of a segment cut short; the loader stops at it, and the recorder never appends
+# to a segment it didn't create.
+
+MAGIC = b"SHPG"
+VERSION = 1
+GAME = struct.Struct('<4sBBIQIdd16s16sHH')
+MOVE = struct.Struct('<BBBB')
+WIDE_MOVE = struct.Struct('<BHHB')
+
+PLACE = 1
+SHOT = 2
+VERTICAL = 0x80
+MISS, HIT, SUNK, WIN = range(4)
+RESULTS = ("miss", "hit", "sunk", "win")
+
+# start a new segment once the current one reaches this size
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+def move_format(rows, columns):
+    return MOVE if rows <= 256 and columns <= 256 else WIDE_MOVE
+
+
+def pack_place(player, row, column, size, vertical, move=MOVE):
+    return move.pack(PLACE << 4 | player, row, column, size | (VERTICAL if vertical else 0))
+
+
+def pack_shot(player, row, column, result, move=MOVE):
+    return move.pack(SHOT << 4 | player, row, column, RESULTS.index(result))
+
+
+def pack_game(game_id, session_id, winner, started, ended, usernames, moves, rows=ROWS, columns=COLUMNS):
+    # One archived game: its header and the move records packed by pack_place/pack_shot
+    names = [name.encode('utf-8')[:16] for name in usernames]
+    count = len(moves) // move_format(rows, columns).size
+    header = GAME.pack(MAGIC, VERSION, winner, count, game_id, session_id, started, ended, *names, rows, columns)
+    return header + bytes(moves)
+
+
+def segment_path(directory, prefix, index):
+    return os.path.join(directory, f"{prefix}-{index:06d}.bin")
+
+
+class Recorder(threading.Thread):
+    # Appends the games of one server process, all played on rows x columns boards
+    def __init__(self, directory, prefix="replay", segment_bytes=SEGMENT_BYTES, rows=ROWS, columns=COLUMNS):
+        super().__init__(name="replay", daemon=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.rows = rows
+        self.columns = columns
+        self.move = move_format(rows, columns)
+        self.games = queue.Queue()
+        self.closed = False
+        # carry on numbering after the segments already there
+        indexes = [int(path[-10:-4]) for path in glob.glob(os.path.join(directory, f"{prefix}-[0-9]*.bin"))]
+        self.index = max(indexes, default=0)
+        self.file = None
+        self.next_segment()
+
+    def next_segment(self):
+        if self.file:
+            self.file.close()
+        self.index += 1
+        self.file = open(segment_path(self.directory, self.prefix, self.index), 'ab')
+
+    def pack_place(self, player, row, column, size, vertical):
+        return pack_place(player, row, column, size, vertical, self.move)
+
+    def pack_shot(self, player, row, column, result):
+        return pack_shot(player, row, column, result, self.move)
+
+    def pack_game(self, game_id, session_id, winner, started, ended, usernames, moves):
+        return pack_game(game_id, session_id, winner, started, ended, usernames, moves, self.rows, self.columns)
+
+    def append(self, game):
+        if not self.closed:
+            self.games.put_nowait(game)
+
+    def run(self):
+        while True:
+            batch = [self.games.get()]
+            while True:
+                try:
+                    batch.append(self.games.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in batch
+            if done:
+                batch = batch[:batch.index(None)]
+            self.file.write(b"".join(batch))
+            self.file.flush()
+            if done:
+                break
+            if self.file.tell() >= self.segment_bytes:
+                self.next_segment()
+        self.file.close()
+
+    def close(self):
+        # write out the games queued so far and ignore anything appended afterwards
+        if self.closed:
+            return
+        self.closed = True
+        self.games.put_nowait(None)
+        self.join()
+
+
+def open_recorder(directory, prefix="replay", segment_bytes=SEGMENT_BYTES, rows=ROWS, columns=COLUMNS):
+    os.makedirs(directory, exist_ok=True)
+    recorder = Recorder(directory, prefix, segment_bytes, rows, columns)
+    recorder.start()
+    return recorder
+
+
+class Game:
+    # One archived game, read straight out of a mapped segment; moves() decodes its records on demand
+    __slots__ = ('game_id', 'session', 'winner', 'started', 'ended', 'usernames', 'rows', 'columns', 'move',
+                 'data', 'start', 'offset', 'count')
+
+    def __init__(self, data, offset):
+        fields = GAME.unpack_from(data, offset)
+        _, _, self.winner, self.count, self.game_id, self.session, self.started, self.ended = fields[:8]
+        self.usernames = tuple(name.rstrip(b"\0").decode('utf-8', 'replace') for name in fields[8:10])
+        self.rows, self.columns = fields[10:]
+        self.move = move_format(self.rows, self.columns)
+        self.data = data
+        self.start = offset
+        self.offset = offset + GAME.size
+
+    def end(self):
+        return self.offset + self.count * self.move.size
+
+    def moves(self):
+        # (kind, player, row, column, value) for every move, value being the ship's size and orientation bit
+        # for a placement and the result code for a shot
+        for code, row, column, value in self.move.iter_unpack(self.data[self.offset:self.end()]):
+            yield code >> 4, code & 0x0f, row, column, value
+
+
+class ReplayArchive:
+    # Read-only view of every segment in a replay directory
+    def __init__(self, directory):
+        self.maps = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.bin"))):
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self.index = None
+
+    def games(self):
+        for data in self.maps:
+            offset = 0
+            while offset + GAME.size <= len(data):
+                magic, version = struct.unpack_from('<4sB', data, offset)
+                if magic != MAGIC or version != VERSION:
+                    break  # a game cut short by a crash, or not one this loader knows; nothing after it is read
+                game = Game(data, offset)
+                if game.end() > len(data):
+                    break
+                yield game
+                offset = game.end()
+
+    def game(self, game_id):
+        # The archived game with this id, or None; the first lookup indexes every segment
+        if self.index is None:
+            self.index = {game.game_id: (game.data, game.start) for game in self.games()}
+        location = self.index.get(game_id)
+        return Game(*location) if location else None
+
+    def close(self):
+        for data in self.maps:
+            data.close()
+        self.maps = []
+
+
+def verify(game, fleet=FLEET):
+    # Replay a game through the server's board and win logic, with the fleet the server was run with. Returns
+    # None when every placement was legal and every shot's recorded result and the recorded winner agree with
+    # it, or else what went wrong.
+    try:
+        variant = Variant(game.rows, game.columns, fleet)
+    except ValueError as e:
+        return f"not a game of this fleet on a {game.rows}x{game.columns} board: {e}"
+    boards = {1: variant.new_board(), 2: variant.new_board()}
+    placed = {1: [], 2: []}
+    shots = {1: 0, 2: 0}
+    winner = 0
+    for number, (kind, player, row, column, value) in enumerate(game.moves(), 1):
+        if winner:
+            return f"move {number}: the game was already won"
+        if player not in boards:
+            return f"move {number}: unknown player {player}"
+        if kind == PLACE:
+            size, vertical = value & ~VERTICAL, bool(value & VERTICAL)
+            sizes = placed[player]
+            if len(sizes) >= variant.ships or sizes.count(size) >= variant.fleet.get(size, 0):
+                return f"move {number}: Player {player} placed one ship too many of size {size}"
+            if not variant.fits(row, column, size, vertical):
+                return f"move {number}: Player {player}'s ship leaves the board"
+            if not boards[player].is_free(row, column, size, vertical):
+                return f"move {number}: Player {player}'s ship overlaps another"
+            boards[player].place_ship(row, column, size, vertical)
+            sizes.append(size)
+        elif kind == SHOT:
+            other = 3 - player
+            target = boards[other]
+            if len(placed[1]) != variant.ships or len(placed[2]) != variant.ships:
+                return f"move {number}: Player {player} fired before both fleets were placed"
+            # Player 1 fires first, then the players alternate
+            if shots[player] != shots[other] - (player == 2):
+                return f"move {number}: Player {player} fired out of turn"
+            if not variant.contains(row, column) or target.already_shot(row, column):
+                return f"move {number}: Player {player} fired at a cell it can't target"
+            hit, sunk = target.fire(row, column)
+            shots[player] += 1
+            result = WIN if target.all_sunk() else SUNK if sunk else HIT if hit else MISS
+            if result != value:
+                return f"move {number}: recorded {RESULTS[value] if value < len(RESULTS) else value}, replayed {RESULTS[result]}"
+            if result == WIN:
+                winner = player
+        else:
+            return f"move {number}: unknown move kind {kind}"
+    if winner != game.winner:
+        return f"recorded winner {game.winner}, replayed {winner}"
+    return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shippy replay archive reader")
+    parser.add_argument('directory', help="the server's --replays directory")
+    parser.add_argument('--game', type=int, help="print the moves of the game with this id")
+    parser.add_argument('--verify', action='store_true', help="re-verify every game through the server's board logic")
+    parser.add_argument('--fleet', type=parse_fleet, default=FLEET,
+                        help="the fleet the server played with (its --fleet), for verifying games")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    archive = ReplayArchive(args.directory)
+    if args.game is not None:
+        game = archive.game(args.game)
+        if game is None:
+            raise SystemExit(f"No game {args.game} in {args.directory}.")
+        print(f"game {game.game_id}, session {game.session}: {game.usernames[0]} vs {game.usernames[1]} "
+              f"on {game.rows}x{game.columns}, {time.ctime(game.started)} to {time.ctime(game.ended)}, "
+              f"winner: {game.winner or 'none'}")
+        for kind, player, row, column, value in game.moves():
+            cell = format_cell(row, column)
+            if kind == PLACE:
+                print(f"  Player {player} placed {value & ~VERTICAL} {'V' if value & VERTICAL else 'H'} {cell}")
+            else:
+                print(f"  Player {player} fired at {cell}: {RESULTS[value]}")
+        problem = verify(game, args.fleet)
+        print(f"verified: {problem or 'ok'}")
+        return
+
+    started = time.perf_counter()
+    games = moves = failed = 0
+    wins = {0: 0, 1: 0, 2: 0}
+    for game in archive.games():
+        games += 1
+        moves += game.count
+        wins[game.winner] = wins.get(game.winner, 0) + 1
+        if args.verify:
+            problem = verify(game, args.fleet)
+            if problem:
+                failed += 1
+                print(f"game {game.game_id} (session {game.session}): {problem}")
+    elapsed = time.perf_counter() - started
+    print(f"{games} games, {moves} moves in {elapsed:.2f}s")
+    print(f"won by Player 1: {wins[1]}, by Player 2: {wins[2]}, unfinished: {wins[0]}")
+    if args.verify:
+        print(f"verified: {games - failed} ok, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import shutil
+import sys
+
+from board import row_label, WATER, HIT, MISS, SHIP_GLYPHS
+
+# Incremental board renderer for the terminal client. The two boards are drawn once at the top of the screen
+# and pinned there with a scroll region, so chat and server messages scroll underneath them. After that only
+# the cells that differ from the last drawn frame are rewritten in place with cursor-positioning escapes,
+# which keeps terminal output to a few bytes per move however fast updates arrive.
+#
+# Everything here writes to stdout and must be called from the one thread that owns the terminal.
+
+RESET = "\033[0m"
+RED = "\033[31m"
+YELLOW = "\033[33m"
+BLUE = "\033[34m"
+CYAN = "\033[36m"
+
+GLYPH_COLORS = {HIT: RED, WATER: CYAN, MISS: BLUE}
+GLYPH_COLORS.update({glyph: YELLOW for glyph in SHIP_GLYPHS})
+
+# colored strings for every glyph seen so far; there are only a handful, so build each one once
+colored_glyphs = {}
+
+BOARDS = ('ship_positions', 'target_positions')
+TITLES = ("Your Ships", "Your Targets")
+# screen lines above the first board row (title, column numbers, top border), rows, then the bottom border
+HEADER_LINES = 3
+
+
+def colored(glyph):
+    text = colored_glyphs.get(glyph)
+    if text is None:
+        color = GLYPH_COLORS.get(glyph)
+        text = colored_glyphs[glyph] = f"{color}{glyph}{RESET}" if color else glyph
+    return text
+
+
+class Layout:
+    # Where everything goes for two boards of rows x columns. Row labels are label_width wide, and every cell
+    # takes cell_width screen columns: its glyph, then padding wide enough for the column numbers above it.
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.labels = [row_label(row) for row in range(rows)]
+        self.label_width = len(self.labels[-1])
+        self.cell_width = 2 if columns <= 10 else len(str(columns)) + 1
+        # screen columns from a board's first glyph to its last
+        self.row_width = self.cell_width * columns - (self.cell_width - 1)
+        # 1-based screen column of cell 0 on each board
+        self.board_columns = {'ship_positions': self.label_width + 5,
+                              'target_positions': 2 * self.label_width + self.row_width + 14}
+        self.lines = HEADER_LINES + rows + 1
+
+
+def layout_for(boards):
+    rows = boards['ship_positions']
+    return Layout(len(rows), len(rows[0]))
+
+
+def render_text(boards, titles=TITLES, layout=None):
+    # Both boards side by side as plain lines; the full-frame fallback when stdout is not a terminal
+    layout = layout or layout_for(boards)
+    label_width, cell_width, row_width = layout.label_width, layout.cell_width, layout.row_width
+    numbers = "".join(str(i).ljust(cell_width) for i in range(1, layout.columns + 1)).rstrip()
+    margin = " " * (label_width + 2)
+    top_border = "┌" + "─" * (row_width + 2) + "┐"
+    bottom_border = "└" + "─" * (row_width + 2) + "┘"
+    gap = " " * (label_width + 5)
+    lines = [
+        (" " * (label_width + 1) + titles[0].center(row_width + 4) + " " * (label_width + 6)
+         + titles[1].center(row_width + 4)).rstrip(),
+        (margin + "  " + numbers).ljust(layout.board_columns['target_positions'] - 1) + numbers,
+        margin + top_border + gap + top_border,
+    ]
+    padding = " " * (cell_width - 1)
+    for i, label in enumerate(layout.labels):
+        label = label.rjust(label_width)
+        ship_row = padding.join(map(colored, boards['ship_positions'][i]))
+        target_row = padding.join(map(colored, boards['target_positions'][i]))
+        lines.append(f" {label} │ {ship_row} │    {label} │ {target_row} │")
+    lines.append(margin + bottom_border + gap + bottom_border)
+    return "\n".join(lines) + "\n"
+
+
+class BoardScreen:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        # pinned, in-place drawing only makes sense on a real terminal
+        self.enabled = out.isatty()
+        # the frame currently on screen: board name -> rows of glyphs, or None before the first draw
+        self.frame = None
+        self.titles = TITLES
+        self.layout = None
+
+    def invalidate(self):
+        # redraw everything on the next update (e.g. after the terminal was resized)
+        self.frame = None
+
+    def set_titles(self, titles):
+        if titles != self.titles:
+            self.titles = titles
+            self.invalidate()
+
+    def update(self, boards):
+        layout = layout_for(boards)
+        if self.layout is None or (layout.rows, layout.columns) != (self.layout.rows, self.layout.columns):
+            self.layout = layout
+            self.invalidate()
+        if self.frame is None:
+            self.out.write(self.full_redraw(boards))
+        else:
+            changes = self.changed_cells(boards)
+            if not changes:
+                return
+            # save the cursor (the prompt and whatever the user has typed), patch the cells, put it back
+            self.out.write("\0337" + changes + "\0338")
+        self.out.flush()
+        self.frame = {name: [list(row) for row in boards[name]] for name in BOARDS}
+
+    def changed_cells(self, boards):
+        out = []
+        cell_width = self.layout.cell_width
+        for name in BOARDS:
+            first_column = self.layout.board_columns[name]
+            for i, (old_row, new_row) in enumerate(zip(self.frame[name], boards[name])):
+                if old_row == new_row:
+                    continue
+                for j, glyph in enumerate(new_row):
+                    if glyph != old_row[j]:
+                        out.append(f"\033[{HEADER_LINES + i + 1};{first_column + cell_width * j}H{colored(glyph)}")
+        return "".join(out)
+
+    def full_redraw(self, boards):
+        # clear the screen, draw the boards at the top and let everything else scroll below them
+        height = shutil.get_terminal_size().lines
+        return ("\033[r\033[2J\033[H" + render_text(boards, self.titles, self.layout).replace("\n", "\033[K\n")
+                + f"\033[{self.layout.lines + 2};{height}r\033[{height};1H")
+
+    def close(self):
+        # give the whole screen back to normal scrolling
+        if self.frame is not None:
+            height = shutil.get_terminal_size().lines
+            self.out.write(f"\033[r\033[{height};1H\n")
+            self.out.flush()
+            self.frame = None
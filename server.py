@@ -1,334 +1,1398 @@
 import socket
 import threading
-import json
-import numpy
-import sys
+import asyncio
+import argparse
+import itertools
+import os
+import time
+import hmac
+import secrets
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from board import Variant, MAX_ROWS, MAX_COLUMNS, format_cell, parse_coord, parse_fleet, ship_span
 import logging
-from datetime import datetime
+from framing import FrameDecoder, FrameError, encode_frame, HEADER, RECV_SIZE
+from codec import JSON_CODEC, CODECS, PLAYERS, SPECTATOR, MAX_USERNAME_LENGTH, codecs_for
+import workers
+import serverlog
+import metrics
+import ai
+import journal
+import admission
+import replay
+import matchmaking
 
-# Set up logging
-log_filename = datetime.now().strftime("server_%Y%m%d_%H%M%S.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),  # Logs to the terminal
-        logging.FileHandler(log_filename)  # Logs to a file
-    ]
-)
 
-# maintaining clients and connections/states
-clients = {}
+# Concurrency model. In threaded mode every connection has a thread of its own, so each GameSession has a lock
+# that serializes everything done to that game: a connection's messages are handled under the lock of the game
+# it is in, and different games run in parallel without sharing any lock. Anything that moves connections
+# between games (seating, resuming, spectating, leaving) also takes seating_lock, always before any game's lock.
+# The sessions registry below is only changed under seating_lock; readers elsewhere (metrics, spectate lookups)
+# take lock-free snapshots of it with list(...). In asyncio mode the locks are never contended.
+seating_lock = threading.RLock()
 
-# setting max amount of ships
-MAX_SHIPS = 5
+# game sessions hosted by this server, keyed by session id
+sessions = {}
+session_ids = itertools.count(1)
+# players who have joined and are waiting to be matched with an opponent (see matchmaking.py); each one waits
+# alone in the session it was seated in on arrival, and is moved into its opponent's when they are matched
+match_queue = matchmaking.MatchQueue()
+# Elo rating of every named player, updated after each win
+ratings = matchmaking.Ratings()
+# seated players who aren't in a game yet; in --workers mode the matchmaker keeps this even in every worker, so
+# that everyone waiting has someone in their own process to be matched with
+unmatched_players = 0
+# sessions that lost a player to a resume and are looking for a replacement, oldest first
+reopened_sessions = deque()
+# upper bound on concurrently hosted sessions (0 for no limit)
+max_sessions = 0
+
+# the game this server hosts: board size and fleet (--rows, --columns, --fleet)
+variant = Variant()
+# codecs a connection may switch to, by name; the binary codec packs cells for the variant's board size
+codecs = CODECS
+
+# name the server-side AI opponent plays under
+BOT_USERNAME = "Shippy Bot"
+
+# durable record of every game's moves (see journal.py); None unless --journal is given
+event_journal = None
+# seconds a game restored from the journal waits for its players to resume before it is ended
+resume_timeout = 300
+# session id -> monotonic deadline for restored sessions that still have a detached player
+resume_deadlines = {}
+next_expiry_check = 0
+
+# archive of every finished game's moves (see replay.py); None unless --replays is given
+replay_recorder = None
+
+# a spectator with more than this many bytes still unsent is skipped rather than queued more, and sent the latest
+# snapshot once it has caught up; one that stays that far behind for SPECTATOR_LAG_TIMEOUT seconds is dropped
+SPECTATOR_MAX_BUFFER = 64 * 1024
+SPECTATOR_LAG_TIMEOUT = 10
+
+# high-water mark for each connection's outbound queue, in bytes (0 for none), and what happens to a connection
+# that reaches it (see queue_overflow); set from --send-queue-limit and --send-queue-policy
+send_queue_limit = 1024 * 1024
+send_queue_policy = 'coalesce'
+
+# largest frame a client may send, in bytes; set from --max-frame-size
+max_frame_size = 64 * 1024
+
+# listen backlog for the asyncio server
+ASYNC_BACKLOG = 4096
+
+# message types with a handler; anything else is counted as 'invalid' so bad clients can't mint metric labels
+MESSAGE_TYPES = ('join', 'place', 'fleet', 'target', 'chat', 'codec', 'resync', 'username', 'quit', 'resume', 'spectate')
+# messages whose handlers may seat or unseat connections, so they are handled under seating_lock as well
+SEATING_MESSAGE_TYPES = ('join', 'resume', 'spectate')
+# what a player waiting to be matched may not send yet
+GAME_MESSAGE_TYPES = ('place', 'fleet', 'target')
+# what a spectator may still send
+SPECTATOR_MESSAGE_TYPES = ('codec', 'resync', 'username', 'quit')
 
 # To be set false when server is forcibly closed as to not leave any hanging threads
 run_thread = True
+# asyncio mode's task that pairs waiting players as their match windows widen; started with the first connection
+match_sweeper = None
+
+class GameSession:
+    # One game between two players; owns both players' connection and game state
+    def __init__(self, session_id):
+        self.id = session_id
+        self.players = {}  # client_id -> client data
+        self.spectators = []  # client data of every connection watching this game
+        self.spectator_seq = 0  # revisions of the spectators' view, for their delta updates
+        self.lock = threading.RLock()  # held while anything reads or changes this game (see seating_lock)
+        self.started = time.time()
+        self.moves = bytearray()  # every placement and shot so far as replay records, when games are archived
+
+    def opponent_of(self, client):
+        for other in self.players.values():
+            if other is not client:
+                return other
+        return None
+
+def new_client(send, close, client_address, buffered=lambda: 0, drained=lambda callback: callback(), abort=None):
+    # client data shared by the threaded and asyncio transports. `send` queues raw bytes for the peer without
+    # blocking, `buffered` reports how many are still queued, `drained(callback)` calls back once the queue has
+    # emptied, `close` closes after the queue is written and `abort` closes at once, dropping the queue.
+    return {'send': send, 'close': close, 'buffered': buffered, 'drained': drained, 'abort': abort or close, 'stalled': False, 'address': client_address, 'client_id': None, 'username': "", 'session': None, 'game_state': None, 'delta': False, 'codec': JSON_CODEC, 'bot': None, 'token': None, 'detached': False, 'spectating': None, 'lagging': None, 'queued': False}
+
+class QueuedSender:
+    # Outbound queue for a threaded-mode connection: any thread can queue frames, and only this connection's
+    # own writer thread writes them, so one slow peer never blocks another player's thread and frames queued
+    # by different threads are never interleaved on the socket
+    def __init__(self, sendall, close):
+        self.sendall = sendall
+        self.close_connection = close
+        self.frames = deque()
+        self.pending = 0  # bytes queued but not yet written
+        self.closing = False
+        self.drained_callback = None
+        self.ready = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, frame):
+        with self.ready:
+            if self.closing:
+                return
+            self.frames.append(frame)
+            self.pending += len(frame)
+            self.ready.notify()
+
+    def buffered(self):
+        return self.pending
+
+    def run(self):
+        while True:
+            with self.ready:
+                while not self.frames and not self.closing:
+                    self.ready.wait()
+                if not self.frames:
+                    break
+                # everything queued so far goes out in one write
+                data = b"".join(self.frames)
+                self.frames.clear()
+            try:
+                self.sendall(data)
+            except OSError:
+                break
+            callback = None
+            with self.ready:
+                self.pending = max(self.pending - len(data), 0)  # abort() may have reset it meanwhile
+                if not self.frames:
+                    callback, self.drained_callback = self.drained_callback, None
+            if callback:
+                callback()
+        with self.ready:
+            self.closing = True
+            self.frames.clear()
+            self.pending = 0
+        self.close_connection()
+
+    def when_drained(self, callback):
+        with self.ready:
+            if self.frames:
+                self.drained_callback = callback
+                return
+        callback()
+
+    def close(self):
+        # write out what is queued, then close the connection
+        with self.ready:
+            self.closing = True
+            self.ready.notify()
+
+    def abort(self):
+        # drop whatever is queued and close the connection now; a write stuck on the socket fails with it
+        with self.ready:
+            self.closing = True
+            self.frames.clear()
+            self.pending = 0
+            self.ready.notify()
+        self.close_connection()
+
+def send_message(client, message):
+    if client['bot'] or client['detached']:
+        return  # bots read the game state directly, and restored seats have no connection until they resume
+    frame = encode_frame(client['codec'].encode(message))
+    if client['stalled'] or (send_queue_limit and client['buffered']() + len(frame) > send_queue_limit):
+        queue_overflow(client)
+        return
+    metrics.inc('shippy_messages_sent_total', (('type', message.get('type', 'welcome')),))
+    metrics.inc('shippy_bytes_sent_total', amount=len(frame))
+    client['send'](frame)
+
+def queue_overflow(client):
+    # A frame would take the connection's outbound queue past the high-water mark, or the connection is already
+    # stalled on an earlier overflow. Per --send-queue-policy the frame is dropped (drop), dropped along with
+    # everything else until the queue drains and the client is sent a snapshot of its boards instead (coalesce),
+    # or the connection is closed (disconnect).
+    metrics.inc('shippy_send_queue_overflows_total', (('policy', send_queue_policy),))
+    if client['stalled'] or send_queue_policy == 'drop':
+        return
+    client['stalled'] = True
+    logging.warning(f"Outbound queue for {client['address']} ({client['client_id']}) is full; policy: {send_queue_policy}.")
+    if send_queue_policy == 'disconnect':
+        client['abort']()
+    else:
+        client['drained'](lambda: catch_up(client))
+
+def catch_up(client):
+    # A coalescing connection's queue has drained: one snapshot replaces everything it missed
+    with game_locks(client):
+        client['stalled'] = False
+        if client['spectating']:
+            send_spectator_snapshot(client, client['spectating'])
+        elif client['game_state']:
+            handle_resync(client)
+
+def send_error(client, reason, text):
+    # `reason` is the machine-readable code (see codec.ERROR_REASONS), `text` the prose shown to players
+    metrics.inc('shippy_error_responses_total', (('reason', reason),))
+    send_message(client, {"type": "error_response", "player": f"{client['client_id']}", "reason": reason, "message": text})
+
+def seat_client(client):
+    # Seat a new connection: in a session that lost a player to a resume, or else alone in a new session of its
+    # own, where it waits to be matched once it joins. Returns False when the server is full.
+    global unmatched_players
+    with seating_lock:
+        expire_restored_sessions()
+        sweep_matches()
+        while reopened_sessions:
+            session = reopened_sessions.popleft()
+            if sessions.get(session.id) is session and len(session.players) == 1:
+                break
+        else:
+            if max_sessions and len(sessions) >= max_sessions:
+                return False
+            session = GameSession(next(session_ids))
+            sessions[session.id] = session
+
+        with session.lock:
+            take_seat(client, session)
+            unmatched_players += 1
+            # proves ownership of the seat when reconnecting to it after a server restart
+            client['token'] = secrets.token_hex(16)
+        return True
+
+def take_seat(client, session):
+    client['client_id'] = getClientID(session)
+    client['session'] = session
+    session.players[client['client_id']] = client
+
+@contextmanager
+def game_locks(client, seating=False):
+    # Hold the lock of the game this connection plays or watches, after seating_lock if asked for. A player
+    # waiting to be matched can be moved into another session by a sweep (see sweep_matches), so the game is
+    # looked up again once its lock is held.
+    with seating_lock if seating else nullcontext():
+        while True:
+            game = client['session'] or client['spectating']
+            with game.lock if game else nullcontext():
+                if game is (client['session'] or client['spectating']):
+                    yield
+                    return
+
+def unseat_client(client):
+    # Undo seat_client for a connection that is taking over a restored seat or watching a game instead
+    leave_match_queue(client)
+    count_matched(client)
+    session = client['session']
+    session.players.pop(client['client_id'], None)
+    if not session.players:
+        sessions.pop(session.id, None)
+    else:
+        reopened_sessions.append(session)
+
+def leave_match_queue(client):
+    if client['queued']:
+        client['queued'] = False
+        match_queue.remove(client)
+
+def count_matched(client):
+    # A seated player is starting a game or leaving without one, so no longer waits for an opponent
+    global unmatched_players
+    if client['game_state'] is None and not client['bot']:
+        unmatched_players -= 1
+        workers.report(workers.UNPAIRED if unmatched_players % 2 else workers.CANCELLED)
+
+def record(event):
+    if event_journal:
+        event_journal.append(event)
+
+def record_place(session, client, y_coord, x_coord, ship_size, orientation):
+    if replay_recorder:
+        session.moves += replay_recorder.pack_place(player_number(client), y_coord, x_coord, ship_size, orientation == 'V')
+
+def record_shot(session, client, y_coord, x_coord, result):
+    if replay_recorder:
+        session.moves += replay_recorder.pack_shot(player_number(client), y_coord, x_coord, result)
+
+def player_number(client):
+    return PLAYERS.index(client['client_id']) + 1
+
+def archive_game(session):
+    # Hand an ended session's moves to the replay recorder; the winner is whoever sank the other's whole fleet
+    if not replay_recorder or not session.moves:
+        return
+    winner = 0
+    for client in session.players.values():
+        other = session.opponent_of(client)
+        other_state = other['game_state'] if other else None
+        if other_state and len(other_state['ships']) == variant.ships and other_state['ship_board'].all_sunk():
+            winner = player_number(client)
+    game_id = secrets.randbits(63)
+    usernames = [session.players[player_id]['username'] if player_id in session.players else "" for player_id in PLAYERS]
+    replay_recorder.append(replay_recorder.pack_game(game_id, session.id, winner, session.started, time.time(), usernames, session.moves))
+    logging.info("Archived session %d as game %d.", session.id, game_id,
+                 extra={'fields': {'event': 'archive', 'session': session.id, 'game': game_id}})
+
+def dispatch_message(client, message):
+    # Route one decoded message to its handler. Returns False once the client asked to quit.
+    message_type = message.get("type")
+
+    if client['spectating'] and message_type not in SPECTATOR_MESSAGE_TYPES:
+        send_error(client, "spectating", "Spectators can only watch.")
+    elif client['queued'] and message_type in GAME_MESSAGE_TYPES:
+        send_error(client, "queued", "Wait to be matched with an opponent.")
+    elif message_type == "join":
+        handle_join(client, message)
+    elif message_type == "place":
+        handle_place(client, message)
+    elif message_type == "fleet":
+        handle_fleet(client, message)
+    elif message_type == "target":
+        handle_target(client, message)
+    elif message_type == "chat":
+        handle_chat(client, message)
+    elif message_type == "codec":
+        handle_codec(client, message)
+    elif message_type == "resync":
+        handle_resync(client)
+    elif message_type == "resume":
+        handle_resume(client, message)
+    elif message_type == "spectate":
+        handle_spectate(client, message)
+    elif message_type == "username":
+        handle_username(client, message)
+    elif message_type == "quit":
+        return False
+    else:
+        send_error(client, "invalid_type", "Invalid message type.")
+    return True
+
+def dispatch_frames(client, frames):
+    # decode each frame with the connection's current codec, which may change part way through a read
+    for frame in frames:
+        started = time.perf_counter()
+        message = client['codec'].decode(frame)
+        with game_locks(client, seating=message.get("type") in SEATING_MESSAGE_TYPES):
+            keep_going = dispatch_message(client, message)
+        # per-type latency covers decoding, the handler and encoding/queueing its replies
+        message_type = message.get("type")
+        labels = (('type', message_type if message_type in MESSAGE_TYPES else 'invalid'),)
+        metrics.observe('shippy_handler_latency_seconds', labels, time.perf_counter() - started)
+        metrics.inc('shippy_messages_received_total', labels)
+        metrics.inc('shippy_bytes_received_total', amount=HEADER.size + len(frame))
+        if not keep_going:
+            return False
+    return True
+
+def handle_username(client, message):
+    # A username is shown to other players and keys the player's rating, so it must be short, non-blank text
+    username = message.get("username")
+    if not isinstance(username, str) or not username.strip() or len(username) > MAX_USERNAME_LENGTH:
+        send_error(client, "bad_username", f"A username must be 1 to {MAX_USERNAME_LENGTH} characters long.")
+        return
+    client['username'] = username
+    if client['game_state']:
+        record({'e': 'name', 's': client['session'].id, 'p': client['client_id'], 'username': client['username']})
+    logging.info(f"{client['client_id']} has named themselves: {client['username']}.")
+
+def handle_codec(client, message):
+    # Switch this connection to another payload encoding for everything after this message
+    name = message.get("codec")
+    codec = codecs.get(name) if isinstance(name, str) else None
+    if codec is None:
+        send_error(client, "invalid_type", "Unknown codec.")
+        return
+    client['codec'] = codec
+    logging.info(f"{client['client_id']} switched to the {codec.name} codec.")
+
+def welcome_client(client):
+    logging.info(f"New connection from {client['address']} ({client['client_id']}) in session {client['session'].id}")
+    # the welcome is always JSON; it lists the codecs the client may switch to and describes the variant played
+    # the session id and token let the client resume this seat if the server restarts mid-game (see --journal)
+    send_message(client, {"player": f"{client['client_id']}", "message": f"Welcome to Shippy!", "codecs": list(codecs),
+                          "session": client['session'].id, "token": client['token'], **variant.describe()})
+
+def disconnect_client(client):
+    with game_locks(client, seating=True):
+        if client['spectating']:
+            stop_spectating(client)
+            logging.info(f"Closed connection to spectator {client['address']}...")
+            return
+        handle_quit(client)
+        remove_client(client)
+    logging.info(f"Closed connection to client {client['address']}...")
+
+def reject_excess(client, decoder):
+    # The decoder dropped frames over the connection's rate budget unread. Answer them with one cheap error, and
+    # return False to disconnect a client that keeps it up.
+    rejected, decoder.rejected = decoder.rejected, 0
+    metrics.inc('shippy_rate_limited_total', amount=rejected)
+    if not decoder.limiter.strike(rejected):
+        metrics.inc('shippy_rate_limit_disconnects_total')
+        logging.warning(f"Disconnecting {client['address']} ({client['client_id']}): too many messages.")
+        return False
+    send_error(client, "rate_limited", "Too many messages; slow down.")
+    return True
+
+def refuse_connection(client_address):
+    # the address is at its connection cap; closed without a reply so refusing costs next to nothing
+    metrics.inc('shippy_connections_total', (('outcome', 'limited'),))
+    logging.debug(f"Refused a connection from {client_address}: too many connections from that address.")
 
 # initial server setup
-def handle_client(client_socket, client_address):
+def handle_client(client_socket, client_address, limiter=None):
+    try:
+        serve_client(client_socket, client_address, limiter)
+    finally:
+        admission.disconnect(client_address[0])
+
+def serve_client(client_socket, client_address, limiter):
+    # replies are written from the connection's writer thread as soon as they are queued, so don't let Nagle's
+    # algorithm hold them back waiting on an ACK (asyncio transports set this by default)
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sender = QueuedSender(client_socket.sendall, lambda: shutdown_socket(client_socket))
+    client = new_client(sender.send, sender.close, client_address, sender.buffered, sender.when_drained, sender.abort)
     # Give player id to 1st or 2nd player to join
-    client_id = getClientID()
-    username = ""
-    logging.info(f"New connection from {client_address} ({client_id})")
-    client_socket.sendall(json.dumps({"player": f"{client_id}", "message": f"Welcome to Shippy!"}).encode())
-    
-    while run_thread:
-        try:
-            # receive data from client
-            message = client_socket.recv(1024)
-            if not message:
+    if not seat_client(client):
+        metrics.inc('shippy_connections_total', (('outcome', 'rejected'),))
+        reject_client(client)
+        client['close']()
+        return
+    metrics.inc('shippy_connections_total', (('outcome', 'seated'),))
+    try:
+        welcome_client(client)
+        decoder = FrameDecoder(max_frame_size, limiter)
+
+        while run_thread:
+            try:
+                # receive data from client; one read may carry several messages or only part of one
+                data = client_socket.recv(RECV_SIZE)
+                if not data:
+                    break
+
+                frames = decoder.feed(data)
+                if decoder.rejected and not reject_excess(client, decoder):
+                    break
+                if not dispatch_frames(client, frames):
+                    break
+
+            except (socket.error, socket.timeout) as e:
+                logging.error(f"Error with client {client_address}: {e}")
                 break
-            
-            message = json.loads(message.decode())
-            message_type = message.get("type")
-
-            if message_type == "join":
-                handle_join(client_socket, client_address, client_id, username)
-            elif message_type == "place":
-                handle_place(client_socket, client_address, message, client_id, username)
-            elif message_type == "target":
-                handle_target(client_socket, client_address, message, client_id, username)
-            elif message_type == "chat":
-                handle_chat(client_address, message, client_id, username)
-            elif message_type == "username":
-                username = message.get("username")
-                logging.info(f"{client_id} has named themselves: {username}.")
-            elif message_type == "quit":
+            except FrameError as e:
+                logging.error(f"Bad frame from client {client_address}: {e}")
                 break
-            else:
-                client_socket.sendall(b"Invalid message type")
-
-        except (socket.error, socket.timeout) as e:
-            logging.error(f"Error with client {client_address}: {e}")
-            break
+    finally:
+        # even if a handler raised, give up the seat or queue ticket and close the socket
+        disconnect_client(client)
+        client['close']()
 
-    # disconnect
-    handle_quit(client_socket, client_address, client_id, username)
+def shutdown_socket(client_socket):
+    # shutting down first wakes the connection's thread if it is blocked reading
+    try:
+        client_socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
     client_socket.close()
-    remove_client(client_address)
-    logging.info(f"Closed connection to client {client_address}...")
 
-def handle_join(client_socket, client_address, client_id, username):
-    # game state dictionary
-    game_state = {
+async def handle_connection(reader, writer):
+    # asyncio counterpart of handle_client; one coroutine per connection instead of one thread
+    global match_sweeper
+    if match_sweeper is None:
+        match_sweeper = asyncio.ensure_future(sweep_matches_forever())
+    client_address = writer.get_extra_info('peername')
+    if client_address is None:
+        # the peer reset the connection before it could be served
+        workers.report(workers.REJECTED)
+        writer.transport.abort()
+        return
+    limiter = admission.connect(client_address[0])
+    if limiter is None:
+        refuse_connection(client_address)
+        workers.report(workers.REJECTED)
+        writer.transport.abort()
+        return
+    try:
+        await serve_connection(reader, writer, client_address, limiter)
+    finally:
+        admission.disconnect(client_address[0])
+
+async def serve_connection(reader, writer, client_address, limiter):
+    def when_drained(callback):
+        async def wait():
+            try:
+                await writer.drain()
+            except ConnectionError:
+                return
+            callback()
+        asyncio.ensure_future(wait())
+
+    client = new_client(writer.write, writer.close, client_address, writer.transport.get_write_buffer_size,
+                        when_drained, writer.transport.abort)
+    if not seat_client(client):
+        metrics.inc('shippy_connections_total', (('outcome', 'rejected'),))
+        workers.report(workers.REJECTED)
+        reject_client(client)
+        client['close']()
+        return
+    # in --workers mode the matchmaker routes the next connection here while a player here has nobody to be matched with
+    workers.report(workers.SEATED_WAITING if unmatched_players % 2 else workers.SEATED_FULL)
+    metrics.inc('shippy_connections_total', (('outcome', 'seated'),))
+    welcome_client(client)
+    decoder = FrameDecoder(max_frame_size, limiter)
+
+    try:
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                break
+
+            frames = decoder.feed(data)
+            if decoder.rejected and not reject_excess(client, decoder):
+                break
+            if not dispatch_frames(client, frames):
+                break
+            await writer.drain()
+
+    except (ConnectionError, socket.error) as e:
+        logging.error(f"Error with client {client_address}: {e}")
+    except FrameError as e:
+        logging.error(f"Bad frame from client {client_address}: {e}")
+    finally:
+        disconnect_client(client)
+        client['close']()
+
+def new_game_state():
+    # game state dictionary; 'seq' counts revisions of this player's boards for delta updates
+    return {
         'ships': [],
-        'targets': [],
-        'ship_positions': numpy.full((10, 10), '~', dtype=object),
-        'target_positions': numpy.full((10, 10), '~', dtype=object)
+        'shots': 0,  # number of shots this player has fired
+        'ship_board': variant.new_board(),  # own fleet and the opponent's shots at it
+        'target_board': variant.new_board(),  # this player's shots at the opponent
+        'seq': 0
     }
+
+def handle_join(client, message):
+    if client['queued'] and message.get("opponent") != "bot":
+        send_error(client, "queued", "Wait to be matched with an opponent.")
+        return
+    leave_match_queue(client)
+    # clients that ask for delta mode get one full snapshot now and only changed cells afterwards; boards of a
+    # large variant are never sent whole, so everyone gets delta updates there
+    client['delta'] = bool(message.get("delta")) or variant.large
+    session = client['session']
+    if len(session.players) == 2:
+        # seated opposite a player already, in a session that lost one to a resume
+        join_game(client)
+    elif message.get("opponent") == "bot":
+        # a player with nobody to play, or tired of waiting for a match, may take on the AI instead
+        join_game(client)
+        seat_bot(session)
+    else:
+        queue_for_match(client)
+
+def join_game(client):
     # add client to the game
-    clients[client_address] = {'socket': client_socket, 'address': client_address, 'game_state': game_state, 'client_id': client_id, 'username': username}
-    broadcast_message({"type": "join_response", "player": f"{client_id}", "message": f"{username} ({client_id}) joined the game."})
+    count_matched(client)
+    client['game_state'] = new_game_state()
+    record({'e': 'join', 's': client['session'].id, 'p': client['client_id'], 'token': client['token'],
+            'username': client['username'], 'delta': client['delta'], 'bot': bool(client['bot'])})
+    broadcast_message(client['session'], {"type": "join_response", "player": f"{client['client_id']}", "username": client['username'], "message": f"{client['username']} ({client['client_id']}) joined the game."})
+    if client['delta']:
+        handle_resync(client)
 
-def handle_place(client_socket, client_address, message, client_id, username):
-    # ensure client has joined the game (sanity check lol)
-    client_data = clients.get(client_address)
-    if not client_data:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "You must join first."}).encode())
+def queue_for_match(client):
+    # Pair the player with the closest rated player waiting for a game, or have them wait for one
+    sweep_matches()
+    rating = ratings.rating(client['username'])
+    opponent = match_queue.add(client, rating)
+    if opponent is None:
+        client['queued'] = True
+        send_message(client, {"type": "queue_response", "player": f"{client['client_id']}", "rating": shown_rating(client),
+                              "message": f"Waiting for an opponent rated near {shown_rating(client)}..."})
         return
+    opponent['queued'] = False
+    pair_players(opponent, client)
 
-    ships = client_data['game_state']['ships']
-    if len(ships) >= MAX_SHIPS:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "Maximum ships placed."}).encode())
+def pair_players(host, guest):
+    # Start a game between two matched players, in the session of the one who waited (`host`). The guest leaves
+    # the session it was seated in on arrival; it keeps its token, and learns its new seat from the match_response.
+    session = host['session']
+    arrival = guest['session']
+    with arrival.lock, session.lock:
+        arrival.players.pop(guest['client_id'], None)
+        sessions.pop(arrival.id, None)
+        for spectator in list(arrival.spectators):
+            spectator['close']()
+        take_seat(guest, session)
+        metrics.inc('shippy_matches_total')
+        logging.info("Matched %s and %s in session %d.", host['username'] or host['address'], guest['username'] or guest['address'], session.id,
+                     extra={'fields': {'event': 'match', 'session': session.id}})
+        for client in (host, guest):
+            other = session.opponent_of(client)
+            send_message(client, {"type": "match_response", "player": f"{client['client_id']}", "session": session.id,
+                                  "rating": shown_rating(client), "username": other['username'],
+                                  "message": f"Matched with {other['username'] or 'an unnamed player'} (rated {shown_rating(other)})."})
+        join_game(host)
+        join_game(guest)
+
+def sweep_matches():
+    # Pair up waiting players whose match windows have widened to cover each other (see matchmaking.py)
+    with seating_lock:
+        for host, guest in match_queue.sweep():
+            host['queued'] = guest['queued'] = False
+            pair_players(host, guest)
+
+def sweep_matches_periodically():
+    # threaded mode: sweep even while nobody connects or joins
+    while run_thread:
+        time.sleep(matchmaking.SWEEP_INTERVAL)
+        sweep_matches()
+
+async def sweep_matches_forever():
+    while True:
+        await asyncio.sleep(matchmaking.SWEEP_INTERVAL)
+        sweep_matches()
+
+def shown_rating(client):
+    # a player's rating as sent to clients: a whole number, and never negative
+    return max(round(ratings.rating(client['username'])), 0)
+
+def update_ratings(winner, loser):
+    # Elo update after a win; games against the AI and unnamed players aren't rated. Returns a line for the
+    # win message, or "".
+    if winner['bot'] or loser['bot']:
+        return ""
+    updated = ratings.record_win(winner['username'], loser['username'])
+    if updated is None:
+        return ""
+    winner_rating, loser_rating = updated
+    logging.info("Ratings: %s %d, %s %d.", winner['username'], winner_rating, loser['username'], loser_rating,
+                 extra={'fields': {'event': 'rating', 'session': winner['session'].id, 'winner': round(winner_rating), 'loser': round(loser_rating)}})
+    return f"\nRatings: {winner['username']} {shown_rating(winner)}, {loser['username']} {shown_rating(loser)}."
+
+def seat_bot(session):
+    # Fill the session's second seat with a server-side AI player that joins and places its fleet at once
+    bot = new_client(lambda data: None, lambda: None, "bot")
+    bot['bot'] = ai.DensityBot(variant)
+    bot['username'] = BOT_USERNAME
+    take_seat(bot, session)
+    bot['token'] = secrets.token_hex(16)
+    bot['delta'] = True
+    join_game(bot)
+    handle_fleet(bot, {"positions": ai.random_fleet(variant)})
+
+def bot_turn(bot):
+    # The bot's reply to its opponent's shot, played through the same checks and responses as a player's
+    row, column = bot['bot'].choose_target()
+    handle_target(bot, {"target": format_cell(row, column)})
+    bot_learn(bot, row, column)
+
+def bot_learn(bot, row, column):
+    # Tell the bot's targeting what its shot at (row, column) found
+    hit = bot['game_state']['target_board'].is_hit(row, column)
+    sunk_cells = None
+    if hit:
+        opponent_board = bot['session'].opponent_of(bot)['game_state']['ship_board']
+        ship = opponent_board.ship_cells(row, column)
+        # like a player told "you sank my cruiser", the bot learns which ship went down once all of it is hit
+        if all(opponent_board.already_shot(*cell) for cell in ship):
+            sunk_cells = ship
+    bot['bot'].record(row, column, hit, sunk_cells)
+
+def handle_resync(client):
+    if client['spectating']:
+        send_spectator_snapshot(client, client['spectating'])
+        return
+    if not client['game_state']:
+        send_error(client, "not_joined", "You must join first.")
         return
+    state = client['game_state']
+    key, boards = board_snapshot({'ship_positions': state['ship_board'], 'target_positions': state['target_board']})
+    send_message(client, {
+        "type": "sync_response",
+        "player": f"{client['client_id']}",
+        "seq": state['seq'],
+        key: boards
+    })
 
-    # extract ship placement from message
-    ship_position = message.get("position").upper()
-    ship_size, orientation, start_pos = ship_position.split()
-    ship_size = int(ship_size)
+def handle_resume(client, message):
+    # Move this connection into a seat restored from the journal, proven by the session id and token from its welcome
+    session = find_session(message.get("session"))
+    # compared as bytes: compare_digest refuses str with non-ASCII characters
+    token = str(message.get("token", "")).encode()
+    seat = None
+    if session and not client['game_state']:
+        for other in session.players.values():
+            if other['detached'] and hmac.compare_digest(other['token'].encode(), token):
+                seat = other
+    if seat is None:
+        send_error(client, "bad_resume", "There is no game to resume with that token.")
+        logging.warning(f"{client['address']} failed to resume a game in session {message.get('session')}.")
+        return
 
-    # parse coordinates
-    x_coord = int(start_pos[1:]) - 1  # numerical axis
-    y_coord = ord(start_pos[0].upper()) - ord('A')  # alphabetical axis converted from A-J to 1-10 for indexing
+    # give up the seat this connection was handed on arrival and take over the restored one
+    unseat_client(client)
+    with session.lock:
+        for key in ('client_id', 'username', 'session', 'game_state', 'delta', 'token'):
+            client[key] = seat[key]
+        session.players[client['client_id']] = client
+        if not any(other['detached'] for other in session.players.values()):
+            resume_deadlines.pop(session.id, None)
+        logging.info(f"{client['username']} ({client['client_id']}) resumed their game in session {session.id} from {client['address']}.")
+        send_message(client, {
+            "type": "resume_response",
+            "player": f"{client['client_id']}",
+            "session": session.id,
+            "username": client['username'],
+            "message": f"Resumed your game as {client['client_id']}."
+        })
+        handle_resync(client)
 
-    allowed_ships = {2: 1, 3: 2, 4: 1, 5: 1}
-    if not can_place_ship(ship_size, ships, allowed_ships):
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": f"You have already placed the maximum number of size-{ship_size} ships."}).encode())
+def handle_spectate(client, message):
+    # Turn this connection into a watcher of a game: the one asked for, or else the most watched game in progress
+    if client['game_state']:
+        send_error(client, "invalid_type", "Players can't spectate.")
+        return
+    if message.get("session"):
+        session = find_session(message.get("session"))
+    else:
+        playing = [other for other in list(sessions.values()) if len(other.players) == 2]
+        session = max(playing, key=lambda other: len(other.spectators), default=None)
+    if session is None or session is client['session']:
+        send_error(client, "no_game", "There is no game to watch with that id.")
         return
 
-    if (orientation == 'H' and x_coord + ship_size > 10) or (orientation == 'V' and y_coord + ship_size > 10):  # Ensure there's room for the ship
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "Not enough room for ship."}).encode())
+    # give up the seat this connection was handed on arrival
+    unseat_client(client)
+    client['client_id'] = SPECTATOR
+    client['session'] = None
+    with session.lock:
+        client['spectating'] = session
+        session.spectators.append(client)
+        logging.info(f"{client['address']} is spectating session {session.id} ({len(session.spectators)} watching).")
+        send_spectator_snapshot(client, session)
+
+def find_session(session_id):
+    # the session a client asked for by id, or None; ids from the wire may be of any JSON type
+    return sessions.get(session_id) if isinstance(session_id, int) else None
+
+def send_spectator_snapshot(client, session):
+    # Both players' shots so far; spectators never see where the ships are
+    players = {}
+    boards = {}
+    for player_id in PLAYERS:
+        player = session.players.get(player_id)
+        players[player_id] = player['username'] if player else ""
+        state = player['game_state'] if player else None
+        boards[player_id] = state['target_board'] if state else variant.new_board()
+    key, boards = board_snapshot(boards)
+    send_message(client, {
+        "type": "spectate_response",
+        "player": SPECTATOR,
+        "session": session.id,
+        "seq": session.spectator_seq,
+        "players": players,
+        key: boards,
+        "message": f"Watching game {session.id}."
+    })
+
+def fan_out(session, message):
+    # Send one event to every spectator of a session. It is encoded once per codec in use and never waits on a
+    # spectator: ones too far behind are skipped, then sent the latest snapshot in place of what they missed.
+    if not session.spectators:
         return
+    frames = {}
+    now = time.monotonic()
+    for spectator in list(session.spectators):
+        if spectator['buffered']() > SPECTATOR_MAX_BUFFER:
+            if spectator['lagging'] is None:
+                spectator['lagging'] = now
+            elif now - spectator['lagging'] > SPECTATOR_LAG_TIMEOUT:
+                logging.info(f"Dropping spectator {spectator['address']}: too far behind.")
+                metrics.inc('shippy_spectators_dropped_total')
+                stop_spectating(spectator)
+                spectator['abort']()
+                continue
+            metrics.inc('shippy_spectator_skips_total')
+            continue
+        if spectator['lagging'] is not None:
+            spectator['lagging'] = None
+            send_spectator_snapshot(spectator, session)
+            continue
+        codec = spectator['codec']
+        frame = frames.get(codec.name)
+        if frame is None:
+            frame = frames[codec.name] = encode_frame(codec.encode(message))
+        spectator['send'](frame)
+        metrics.inc('shippy_messages_sent_total', (('type', message['type']),))
+        metrics.inc('shippy_bytes_sent_total', amount=len(frame))
 
-    # ensure the cells are not already occupied
-    ship_matrix = client_data['game_state']['ship_positions']
-    if orientation == 'H' and any(ship_matrix[y_coord, x] != '~' for x in range(x_coord, x_coord + ship_size)):
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "A ship already exists in this location."}).encode())
+def stop_spectating(client):
+    session = client['spectating']
+    if client in session.spectators:
+        session.spectators.remove(client)
+
+def send_board_update(client, message, changes):
+    # Full boards for legacy clients; delta clients get only the changed cells (board -> {cell: glyph}) and a sequence number
+    state = client['game_state']
+    state['seq'] += 1
+    if client['delta']:
+        message['seq'] = state['seq']
+        message['changes'] = changes
+    else:
+        message['boards'] = convert_boards(state)
+    send_message(client, message)
+
+def handle_place(client, message):
+    # ensure client has joined the game (sanity check lol)
+    if not client['game_state']:
+        send_error(client, "not_joined", "You must join first.")
         return
-    if orientation == 'V' and any(ship_matrix[y, x_coord] != '~' for y in range(y_coord, y_coord + ship_size)):
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "A ship already exists in this location."}).encode())
+
+    username = client['username']
+    ships = client['game_state']['ships']
+    if len(ships) >= variant.ships:
+        send_error(client, "max_ships", "Maximum ships placed.")
         return
 
-    # add ship to client's list of ship positions
-    ship_coords = []
-    for i in range(ship_size):
-        if orientation == "H":
-            # Increment column, keep row the same
-            new_row = y_coord
-            new_col = x_coord + i
-        elif orientation == "V":
-            # Increment row, keep column the same
-            new_row = y_coord + i
-            new_col = x_coord
-        
-        # Convert back to "A1" format
-        coord = f"{chr(ord('A') + new_row)}{new_col + 1}"  # Convert row to letter, col to 1-based number
-        ship_coords.append(coord)
+    # extract ship placement from message
+    parsed = parse_position(message.get("position"))
+    if parsed is None:
+        send_error(client, "bad_position", f"The position {message.get('position')} was not recognised.")
+        return
+    ship_size, orientation, y_coord, x_coord = parsed
+    start_pos = format_cell(y_coord, x_coord)
+    ship_position = f"{ship_size} {orientation} {start_pos}"
 
-    # Append the ship's coordinates to the list of ships
-    ships.append(ship_coords)    
-
-    # add ship to client's ship matrix
-    if(orientation == 'V'):
-        ship_matrix[y_coord, x_coord] = '△'
-        ship_matrix[y_coord + ship_size-1, x_coord] = '▽'
-        for i in range(1, ship_size-1):
-            ship_matrix[y_coord + i, x_coord] = '▯'
-    if(orientation == 'H'):
-        ship_matrix[y_coord, x_coord] = '◁'
-        ship_matrix[y_coord, x_coord + ship_size-1] = '▷'
-        for i in range(1, ship_size-1):
-            ship_matrix[y_coord, x_coord + i] = '▭'
+    if not can_place_ship(ship_size, ships, variant.fleet):
+        send_error(client, "ship_limit", f"You have already placed the maximum number of size-{ship_size} ships.")
+        return
+
+    if not variant.fits(y_coord, x_coord, ship_size, orientation == 'V'):  # Ensure there's room for the ship
+        send_error(client, "no_room", "Not enough room for ship.")
+        return
+
+    # ensure the cells are not already occupied
+    ship_board = client['game_state']['ship_board']
+    if not ship_board.is_free(y_coord, x_coord, ship_size, orientation == 'V'):
+        send_error(client, "occupied", "A ship already exists in this location.")
+        return
+
+    ship_coords = add_ship(client['game_state'], ship_size, orientation, y_coord, x_coord)
+    record({'e': 'place', 's': client['session'].id, 'p': client['client_id'], 'position': ship_position})
+    record_place(client['session'], client, y_coord, x_coord, ship_size, orientation)
 
     # output to server where the ship was placed
-    logging.info(f"{username} placed a ship at {ship_position}. Total ships for this player: {len(ships)}")
+    logging.info("%s placed a ship at %s. Total ships for this player: %d", username, ship_position, len(ships),
+                 extra={'fields': {'event': 'place', 'session': client['session'].id, 'player': client['client_id'], 'position': ship_position}})
     
 
-    # '▭', '▯', '△', '▷', '▽', '◁'
     # send confirmation back to the client
-    client_socket.sendall(json.dumps({
+    changes = {coord: ship_board.glyph(*cell_index(coord)) for coord in ship_coords}
+    send_board_update(client, {
         "type": "place_response",
-        "player": f"{client_id}",
-        "message": f"Ship placed starting at {start_pos}.",
-        "boards": convert_boards(client_data['game_state'])
-    }).encode())
+        "player": f"{client['client_id']}",
+        "position": ship_position,
+        "message": f"Ship placed starting at {start_pos}."
+    }, {'ship_positions': changes})
+
+def handle_fleet(client, message):
+    # Place several ships in one request, normally the whole fleet. The layout is checked as a whole, together
+    # with any ships already placed: every ship must be in the variant's fleet, fit on the board and overlap no other.
+    # Either all of them are placed, with a single reply, or none is.
+    if not client['game_state']:
+        send_error(client, "not_joined", "You must join first.")
+        return
+
+    ships = client['game_state']['ships']
+    positions = message.get("positions")
+    if not isinstance(positions, list) or not positions:
+        send_error(client, "bad_position", "A fleet is a list of positions like '3 H A1'.")
+        return
+    if len(ships) + len(positions) > variant.ships:
+        send_error(client, "max_ships", "That is more ships than a fleet has.")
+        return
+
+    counts = {}
+    for ship in ships:
+        counts[len(ship)] = counts.get(len(ship), 0) + 1
+    ship_board = client['game_state']['ship_board']
+    # cells taken by the ships of this request so far
+    claimed = set()
+    layout = []
+    for position in positions:
+        parsed = parse_position(position)
+        if parsed is None:
+            send_error(client, "bad_position", f"The position {position} was not recognised.")
+            return
+        ship_size, orientation, y_coord, x_coord = parsed
+        counts[ship_size] = counts.get(ship_size, 0) + 1
+        if counts[ship_size] > variant.fleet.get(ship_size, 0):
+            send_error(client, "ship_limit", f"A fleet has only {variant.fleet.get(ship_size, 0)} size-{ship_size} ships.")
+            return
+        if not variant.fits(y_coord, x_coord, ship_size, orientation == 'V'):
+            send_error(client, "no_room", f"Not enough room for the ship at {position}.")
+            return
+        cells = ship_span(y_coord, x_coord, ship_size, orientation == 'V')
+        if not ship_board.is_free(y_coord, x_coord, ship_size, orientation == 'V') or claimed.intersection(cells):
+            send_error(client, "occupied", f"The ship at {position} overlaps another.")
+            return
+        claimed.update(cells)
+        layout.append(parsed)
+
+    session = client['session']
+    changes = {}
+    placed = []
+    for ship_size, orientation, y_coord, x_coord in layout:
+        ship_coords = add_ship(client['game_state'], ship_size, orientation, y_coord, x_coord)
+        position = f"{ship_size} {orientation} {ship_coords[0]}"
+        placed.append(position)
+        record({'e': 'place', 's': session.id, 'p': client['client_id'], 'position': position})
+        record_place(session, client, y_coord, x_coord, ship_size, orientation)
+        for coord in ship_coords:
+            changes[coord] = ship_board.glyph(*cell_index(coord))
+
+    logging.info("%s placed %d ships: %s. Total ships for this player: %d", client['username'], len(placed), ", ".join(placed),
+                 len(ships), extra={'fields': {'event': 'fleet', 'session': session.id, 'player': client['client_id'], 'positions': placed}})
+    send_board_update(client, {
+        "type": "fleet_response",
+        "player": f"{client['client_id']}",
+        "positions": placed,
+        "message": f"Placed {len(placed)} ships."
+    }, {'ship_positions': changes})
+
+def parse_position(position):
+    # "3 H A1" -> (size, orientation, row, column), or None for anything that isn't a ship position on the board
+    parts = position.upper().split() if isinstance(position, str) else ()
+    # isdigit() alone would let through digits like '²' that int() can't parse, and a size may have no more digits
+    # than the variant's largest ship, or int() could be handed thousands of them
+    if (len(parts) != 3 or not (parts[0].isascii() and parts[0].isdigit()) or len(parts[0]) > len(str(max(variant.fleet)))
+            or parts[1] not in ('H', 'V')):
+        return None
+    cell = parse_cell(parts[2])
+    if cell is None:
+        return None
+    return int(parts[0]), parts[1], cell[0], cell[1]
+
+def add_ship(game_state, ship_size, orientation, y_coord, x_coord):
+    # Put an already validated ship on the board; returns its cells in "A1" format
+    # add ship to client's list of ship positions
+    ship_coords = [format_cell(row, column) for row, column in ship_span(y_coord, x_coord, ship_size, orientation == 'V')]
+
+    # Append the ship's coordinates to the list of ships
+    game_state['ships'].append(ship_coords)
+
+    # add ship to client's ship board
+    game_state['ship_board'].place_ship(y_coord, x_coord, ship_size, orientation == 'V')
+    return ship_coords
 
 def can_place_ship(ship_size, ships, allowed_ships):
     current_count = sum(1 for ship in ships if len(ship) == ship_size)
     return current_count < allowed_ships.get(ship_size, 0)
 
-def handle_target(client_socket, client_address, message, client_id, username):
+def handle_target(client, message):
+    client_id = client['client_id']
+    username = client['username']
     # ensure client has joined the game (sanity check lol)
-    client_data = clients.get(client_address)
-    if not client_data:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "You must join first."}).encode())
-        logging.warning(f"{username} attempted to target but has not joined.")
+    if not client['game_state']:
+        send_error(client, "not_joined", "You must join first.")
+        logging.warning("%s attempted to target but has not joined.", username)
         return
     
-    # ensure 2 clients are present before targeting
-    if len(clients) < 2:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "Wait for another player to join."}).encode())
-        logging.warning(f"{username} attempted to target but there are not enough players.")
+    # ensure both players of this session are present before targeting
+    other_client_data = client['session'].opponent_of(client)
+    if not other_client_data or not other_client_data['game_state']:
+        send_error(client, "no_opponent", "Wait for another player to join.")
+        logging.warning("%s attempted to target but there are not enough players.", username)
         return 
 
-    other_client_data = [c for c in clients.values() if c != client_data][0]
-    others_ships_matrix = other_client_data['game_state']['ship_positions']
+    others_ship_board = other_client_data['game_state']['ship_board']
+
+    cell = parse_cell(message.get("target"))
+    if cell is None:
+        send_error(client, "bad_cell", "That position was not recognised.")
+        return
+    y_coord, x_coord = cell
+    target = format_cell(y_coord, x_coord)
 
     # ensure targeted space has not been targeted prior
-    target = message.get("target").upper()
-    targets = client_data['game_state']['targets']
-    if target in targets:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "You have already targeted this location."}).encode())
-        logging.info(f"{username} attempted to target {target} but had already targeted this location.")
+    if client['game_state']['target_board'].already_shot(y_coord, x_coord):
+        send_error(client, "already_targeted", "You have already targeted this location.")
+        logging.info("%s attempted to target %s but had already targeted this location.", username, target)
         return
 
     # ensure all ships are placed
-    if len(client_data['game_state']['ships']) != MAX_SHIPS:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "You must place all of your ships first."}).encode())
-        logging.warning(f"{username} attempted to target before placing all ships.")
+    if len(client['game_state']['ships']) != variant.ships:
+        send_error(client, "ships_not_placed", "You must place all of your ships first.")
+        logging.warning("%s attempted to target before placing all ships.", username)
         return
     # ensure opponent has placed all ships
-    if len(other_client_data['game_state']['ships']) != MAX_SHIPS:
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "Wait for your opponent to place all of their ships."}).encode())
-        logging.warning(f"{username} attempted to target before opponent placed all ships.")
+    if len(other_client_data['game_state']['ships']) != variant.ships:
+        send_error(client, "opponent_not_ready", "Wait for your opponent to place all of their ships.")
+        logging.warning("%s attempted to target before opponent placed all ships.", username)
         return
 
     # ensure turn-based
-    other_targets = other_client_data['game_state']['targets']
-    if (client_id == "Player 1" and len(targets) > len(other_targets)) or (client_id == "Player 2" and len(targets) == len(other_targets)):
-        client_socket.sendall(json.dumps({"type": "error_response", "player": f"{client_id}", "message": "Wait for your opponent to make a move."}).encode())
-        logging.info(f"{username} attempted to target out of turn.")
+    shots = client['game_state']['shots']
+    other_shots = other_client_data['game_state']['shots']
+    if (client_id == "Player 1" and shots > other_shots) or (client_id == "Player 2" and shots == other_shots):
+        send_error(client, "not_your_turn", "Wait for your opponent to make a move.")
+        logging.info("%s attempted to target out of turn.", username)
         return
 
-    x_coord = int(target[1:]) - 1
-    y_coord = ord(target[0].upper()) - ord('A')
-
-    if others_ships_matrix[y_coord, x_coord] in {'▭', '▯', '△', '▷', '▽', '◁'}:
-        client_data['game_state']['target_positions'][y_coord, x_coord] = '*'
-        others_ships_matrix[y_coord, x_coord] = '*'
+    hit, sunk = fire_shot(client['game_state'], other_client_data['game_state'], y_coord, x_coord)
+    record({'e': 'shot', 's': client['session'].id, 'p': client_id, 'target': target})
+    result = "miss"
+    if hit:
+        result = "hit"
         result_message = f"{username} hit a ship at {target}!"
-        logging.info(result_message)
-        if check_sunk_ships(other_client_data['game_state']['ships'], target, targets):
+        if sunk:
+            result = "sunk"
             result_message += f"\n{username} has sunk a battleship!"
-            logging.info(f"{username} has sunk a battleship!")
     else:
-        client_data['game_state']['target_positions'][y_coord, x_coord] = 'o'
-        others_ships_matrix[y_coord, x_coord] = 'o'
         result_message = f"{username} missed at {target}."
-        logging.info(result_message)
-
-    # update list of targets this client has targeted
-    targets.append(target)
 
     # Check for win condition
-    if numpy.all(~numpy.isin(others_ships_matrix, ['▭', '▯', '△', '▷', '▽', '◁'])):
+    if others_ship_board.all_sunk():
+        result = "win"
         result_message = f"{username} hit a ship at {target}! {username} HAS WON!!! Closing both clients and resetting game state..."
-        logging.info(f"{username} ({client_id}) has won.")
+        result_message += update_ratings(client, other_client_data)
+    record_shot(client['session'], client, y_coord, x_coord, result)
+
+    # one structured record per shot; the writer thread turns it into text
+    logging.info("%s fired at %s: %s", username, target, result,
+                 extra={'fields': {'event': 'shot', 'session': client['session'].id, 'player': client_id, 'target': target, 'result': result}})
 
     # send confirmation back to the client
-    client_socket.sendall(json.dumps({
+    marker = client['game_state']['target_board'].glyph(y_coord, x_coord)
+    send_board_update(client, {
         "type": "target_response",
         "player": f"{client_id}",
-        "boards": convert_boards(client_data['game_state']),
+        "target": target,
+        "result": result,
         "message": result_message
-    }).encode())
+    }, {'target_positions': {target: marker}})
 
     # send response to the other client as well
-    other_client_data['socket'].sendall(json.dumps({
+    send_board_update(other_client_data, {
         "type": "target_response",
         "player": f"{client_id}",
-        "boards": convert_boards(other_client_data['game_state']),
+        "target": target,
+        "result": result,
         "message": result_message
-    }).encode())
+    }, {'ship_positions': {target: marker}})
+
+    # spectators see the shot land on the shooter's target board
+    session = client['session']
+    session.spectator_seq += 1
+    fan_out(session, {
+        "type": "target_response",
+        "player": f"{client_id}",
+        "target": target,
+        "result": result,
+        "message": result_message,
+        "seq": session.spectator_seq,
+        "changes": {'target_positions': {target: marker}}
+    })
 
+    if other_client_data['bot'] and result != "win":
+        bot_turn(other_client_data)
 
-def check_sunk_ships(ships, current_target, targets):
-    for ship in ships:
-        # Track which coordinates of the ship have been hit
-        hit_coords = [coord for coord in ship if coord in targets]
-
-        # Check if the ship is one hit away from being fully sunk
-        if len(hit_coords) == len(ship) - 1:
-            # Identify the remaining (un-hit) coordinate of the ship
-            remaining_coord = [coord for coord in ship if coord not in hit_coords][0]
-            
-            # Only consider the ship as sunk if the current target is the remaining coordinate
-            if remaining_coord == current_target:
-                return True
-    
-    return False
+
+def fire_shot(game_state, other_game_state, y_coord, x_coord):
+    # Apply an already validated shot to both players' boards; returns (hit, sunk)
+    hit, sunk = other_game_state['ship_board'].fire(y_coord, x_coord)
+    game_state['target_board'].mark(y_coord, x_coord, hit)
+    game_state['shots'] += 1
+    return hit, sunk
+
+def cell_index(coord):
+    # "F7" -> (row, column) matrix index
+    return parse_coord(coord)
+
+def parse_cell(coord):
+    # Like cell_index, but None for anything that isn't a cell on the board
+    cell = parse_coord(coord)
+    if cell and variant.contains(*cell):
+        return cell
+    return None
 
 def convert_boards(state):
     boards = {
-        'ship_positions': state['ship_positions'].tolist(),
-        'target_positions': state['target_positions'].tolist()
+        'ship_positions': state['ship_board'].render(),
+        'target_positions': state['target_board'].render()
     }
     return boards
 
-def handle_chat(client_address, message, client_id, username):
-    # Broadcast the chat message to all clients
-    broadcast_message({
+def board_snapshot(boards):
+    # Boards (name -> Board) for a sync or spectate response: ('boards', full glyph grids), or on a large variant
+    # ('cells', each board's marked cells), which grows with the ships and shots rather than the board's area
+    if variant.large:
+        return 'cells', {name: board.marked_cells() for name, board in boards.items()}
+    return 'boards', {name: board.render() for name, board in boards.items()}
+
+def handle_chat(client, message):
+    username = client['username']
+    text = message.get("message")
+    if not isinstance(text, str):
+        send_error(client, "invalid_type", "A chat message must be text.")
+        return
+    # Broadcast the chat message to both players of the session
+    broadcast_message(client['session'], {
         "type": "chat_response",
-        "player": f"{client_id}",
-        "message": f"{username}: " + message.get("message")
+        "player": f"{client['client_id']}",
+        "message": f"{username}: " + text
     })
     # Log the chat message
-    logging.info(f"{username} sent a chat: {message.get('message')}")
+    logging.info("%s sent a chat: %s", username, text,
+                 extra={'fields': {'event': 'chat', 'session': client['session'].id, 'player': client['client_id']}})
 
-def handle_quit(client_socket, client_address, client_id, username):
+def handle_quit(client):
+    username = client['username']
+    client_id = client['client_id']
     # Broadcast that the client has quit
-    broadcast_message({
+    broadcast_message(client['session'], {
         "type": "quit_response",
         "player": f"{client_id}",
+        "username": username,
         "message": f"{username} ({client_id}) left. Closing both clients and resetting game state..."
     })
     # Log the client disconnect
-    logging.info(f"{username} ({client_id}) left the game. Address: {client_address}")
+    logging.info(f"{username} ({client_id}) left the game. Address: {client['address']}")
+
+def reject_client(client):
+    send_message(client, {"type": "third_client", "message": "The maximum number of players has been reached. Please wait for current players to leave their session..."})
 
-def broadcast_message(message):
-    for client in clients.values():
+def broadcast_message(session, message):
+    for client in list(session.players.values()):
         try:
-            client['socket'].sendall(json.dumps(message).encode())
+            send_message(client, message)
         except socket.error as e:
             print(f"Failed to send to client: {e}")
+    fan_out(session, message)
 
-def remove_client(client_address):
-    if client_address in clients:
-        del clients[client_address]
+def remove_client(client):
+    # A session ends as soon as either player leaves; the remaining player is told to close by handle_quit
+    leave_match_queue(client)
+    count_matched(client)
+    session = client['session']
+    if sessions.pop(session.id, None) is not None:
+        record({'e': 'end', 's': session.id})
+        archive_game(session)
+        # the game is over for its spectators too; they have been sent the quit by now
+        for spectator in list(session.spectators):
+            spectator['close']()
+    session.players.pop(client['client_id'], None)
+    resume_deadlines.pop(session.id, None)
 
-def getClientID():
-    return "Player 2" if len(clients) > 0 else "Player 1"
+def getClientID(session):
+    # Player 1 is whoever was seated first: the one who waited to be matched, or the player still seated in a
+    # session reopened by a resume, which may have lost its Player 1 rather than its Player 2
+    return "Player 2" if "Player 1" in session.players else "Player 1"
+
+def restore_sessions(saved):
+    # Rebuild the sessions recovered from the journal. Their players stay detached (seated, but with no
+    # connection) until they reconnect and resume; bots are rebuilt whole and play on as before.
+    global session_ids
+    for session_id, seats in saved.items():
+        session = GameSession(int(session_id))
+        for client_id, seat in sorted(seats.items()):
+            client = new_client(lambda data: None, lambda: None, "bot" if seat['bot'] else "restored")
+            client.update(client_id=client_id, session=session, username=seat['username'], token=seat['token'],
+                          delta=seat['delta'], game_state=new_game_state(), detached=not seat['bot'])
+            if seat['bot']:
+                client['bot'] = ai.DensityBot(variant)
+            for position in seat['positions']:
+                ship_size, orientation, start_pos = position.split()
+                y_coord, x_coord = cell_index(start_pos)
+                add_ship(client['game_state'], int(ship_size), orientation, y_coord, x_coord)
+                record_place(session, client, y_coord, x_coord, int(ship_size), orientation)
+            session.players[client_id] = client
+        # shots need both fleets in place; they are replayed in turn order, Player 1 first, as they were played
+        for turn in range(max((len(seat['targets']) for seat in seats.values()), default=0)):
+            for client_id in PLAYERS:
+                targets = seats[client_id]['targets'] if client_id in seats else ()
+                if turn >= len(targets):
+                    continue
+                client = session.players[client_id]
+                other = session.opponent_of(client)
+                y_coord, x_coord = cell_index(targets[turn])
+                hit, sunk = fire_shot(client['game_state'], other['game_state'], y_coord, x_coord)
+                result = "win" if other['game_state']['ship_board'].all_sunk() else "sunk" if sunk else "hit" if hit else "miss"
+                record_shot(session, client, y_coord, x_coord, result)
+                if client['bot']:
+                    bot_learn(client, y_coord, x_coord)
+        sessions[session.id] = session
+        # a crash between a player's shot and the bot's reply leaves the bot owing a turn
+        for client in session.players.values():
+            other = session.opponent_of(client)
+            if client['bot'] and other and other['game_state']['shots'] > client['game_state']['shots']:
+                bot_turn(client)
+        if len(session.players) == 1:
+            reopened_sessions.append(session)
+        if any(client['detached'] for client in session.players.values()):
+            resume_deadlines[session.id] = time.monotonic() + resume_timeout
+    session_ids = itertools.count(max(map(int, saved), default=0) + 1)
+    if saved:
+        logging.info("Restored %d sessions from the journal.", len(saved))
+
+def expire_restored_sessions():
+    # End restored games whose players haven't resumed in time; checked at most once a second from seat_client
+    global next_expiry_check
+    now = time.monotonic()
+    if not resume_deadlines or now < next_expiry_check:
+        return
+    next_expiry_check = now + 1
+    for session_id, deadline in list(resume_deadlines.items()):
+        if now < deadline:
+            continue
+        session = sessions.get(session_id)
+        for client in list(session.players.values()) if session else ():
+            if client['detached']:
+                logging.info(f"{client['username']} ({client['client_id']}) did not resume session {session_id} in time.")
+                disconnect_client(client)
+                break
+        resume_deadlines.pop(session_id, None)
+
+def connected_clients():
+    return [client for session in list(sessions.values()) for client in list(session.players.values())]
+
+# gauges are read when the metrics endpoint is scraped, from its own thread
+def game_counts():
+    playing = sum(len(session.players) == 2 for session in list(sessions.values()))
+    return {(('state', 'playing'),): playing, (('state', 'waiting'),): len(sessions) - playing}
+
+def send_queue_depths():
+    depths = [client['buffered']() for client in connected_clients()]
+    return {(('stat', 'total'),): sum(depths), (('stat', 'max'),): max(depths, default=0)}
+
+metrics.gauge('shippy_active_connections', "Connections currently seated in a session.",
+              lambda: {(): len(connected_clients())})
+metrics.gauge('shippy_active_games', "Sessions, by whether both players are seated or one is waiting.", game_counts)
+metrics.gauge('shippy_match_queue_players', "Players waiting to be matched with an opponent.",
+              lambda: {(): len(match_queue)})
+metrics.gauge('shippy_active_spectators', "Connections currently watching a game.",
+              lambda: {(): sum(len(session.spectators) for session in list(sessions.values()))})
+metrics.gauge('shippy_send_queue_bytes', "Bytes written to client connections but not yet sent, in total and for the worst connection.",
+              send_queue_depths)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shippy game server")
+    parser.add_argument('-p', '--port', type=int, required=True, help="port to listen on")
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded',
+                        help="one thread per connection, or a single asyncio event loop hosting every session")
+    parser.add_argument('--max-sessions', type=int, default=0, help="maximum concurrent game sessions (0 for no limit)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="fork this many asyncio worker processes behind a matchmaker (Unix only); both players of a game share a worker, "
+                             "and players are only matched with others in their own worker")
+    parser.add_argument('--log-level', default="INFO", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'])
+    parser.add_argument('--log-file', default=serverlog.DEFAULT_LOG_FILE,
+                        help="JSON-lines log file (per-worker files get a -wN suffix); empty to disable")
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024, help="rotate the log file at this size (0 to disable)")
+    parser.add_argument('--log-rotate-seconds', type=int, default=86400, help="rotate the log file at this age (0 to disable)")
+    parser.add_argument('--log-backups', type=int, default=5, help="rotated log files to keep")
+    parser.add_argument('--quiet', action='store_true', help="don't echo log records to the terminal")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve Prometheus metrics on this local port (worker N of --workers uses port + N); 0 to disable")
+    parser.add_argument('--metrics-address', default="127.0.0.1", help="address the metrics endpoint binds to")
+    parser.add_argument('--send-queue-limit', type=int, default=1024 * 1024,
+                        help="high-water mark in bytes for each connection's outbound queue (0 for none)")
+    parser.add_argument('--send-queue-policy', choices=['drop', 'coalesce', 'disconnect'], default='coalesce',
+                        help="what happens to a connection whose outbound queue is full: drop the message, drop messages until it drains and then send a board snapshot, or disconnect it")
+    parser.add_argument('--rate-limit', type=float, default=admission.RATE,
+                        help="messages per second each connection may send (0 for no limit); excess messages are rejected unread")
+    parser.add_argument('--rate-burst', type=int, default=admission.BURST, help="messages a connection may send at once on top of --rate-limit")
+    parser.add_argument('--address-rate-limit', type=float, default=admission.ADDRESS_RATE,
+                        help="messages per second all connections from one address may send together (0 for no limit)")
+    parser.add_argument('--address-burst', type=int, default=admission.ADDRESS_BURST, help="burst allowance on top of --address-rate-limit")
+    parser.add_argument('--max-connections-per-address', type=int, default=admission.MAX_CONNECTIONS_PER_ADDRESS,
+                        help="concurrent connections allowed from one address (0 for no limit)")
+    parser.add_argument('--max-frame-size', type=int, default=64 * 1024,
+                        help="largest message a client may send, in bytes; a bigger one disconnects it")
+    parser.add_argument('--journal', default="",
+                        help="directory for a durable journal of every game; after a crash or restart games are restored from it and players can resume")
+    parser.add_argument('--journal-sync-ms', type=float, default=journal.SYNC_INTERVAL * 1000,
+                        help="group-commit window: the journal fsyncs at most once per this many milliseconds")
+    parser.add_argument('--snapshot-every', type=int, default=journal.SNAPSHOT_EVERY,
+                        help="snapshot the journal and start a new segment after this many events")
+    parser.add_argument('--replays', default="",
+                        help="directory to archive every finished game's moves to, in the binary replay format (see replay.py)")
+    parser.add_argument('--rows', type=int, default=variant.rows, help=f"board rows, up to {MAX_ROWS}")
+    parser.add_argument('--columns', type=int, default=variant.columns, help=f"board columns, up to {MAX_COLUMNS}")
+    parser.add_argument('--fleet', type=parse_fleet, default=variant.fleet,
+                        help="ships each player places, as size:count pairs (default 5:1,4:1,3:2,2:1)")
+    parser.add_argument('--bot-backend', choices=list(ai.BACKENDS), default=ai.DEFAULT_BACKEND,
+                        help="how the AI opponent stores and scores its view of the board; stdlib doesn't load NumPy, "
+                             "for faster startup and smaller processes (see ai.py)")
+    parser.add_argument('--resume-timeout', type=int, default=300,
+                        help="seconds a restored game waits for its players to reconnect before it is ended")
+    return parser.parse_args()
 
 def start_server():
     global run_thread
-    tcp_port = None
+    global max_sessions
+    global event_journal
+    global resume_timeout
+    global send_queue_limit
+    global send_queue_policy
+    global max_frame_size
+    global variant
+    global codecs
+    args = parse_args()
+    try:
+        variant = Variant(args.rows, args.columns, args.fleet)
+    except ValueError as e:
+        raise SystemExit(f"Unsupported game variant: {e}")
+    codecs = codecs_for(variant.rows, variant.columns)
+    # loaded before any --workers fork, so the workers share it
+    ai.use_backend(args.bot_backend)
+    tcp_port = args.port
+    max_sessions = args.max_sessions
+    resume_timeout = args.resume_timeout
+    send_queue_limit = args.send_queue_limit
+    send_queue_policy = args.send_queue_policy
+    max_frame_size = args.max_frame_size
+    admission.configure(args.rate_limit, args.rate_burst, args.address_rate_limit, args.address_burst,
+                        args.max_connections_per_address)
 
-    # Parse command-line arguments for the `-p` flag
-    args = sys.argv[1:]
-    for i in range(len(args)):
-        if args[i] == '-p' and i + 1 < len(args):
-            try:
-                tcp_port = int(args[i + 1])
-            except ValueError:
-                print("Error: Port must be an integer.")
-                sys.exit(1)
+    def setup_process(worker_index=None):
+        # each process gets its own writer thread and file; threads and file positions don't survive a fork
+        path = args.log_file
+        if path and worker_index is not None:
+            root, extension = os.path.splitext(path)
+            path = f"{root}-w{worker_index}{extension}"
+        writer = serverlog.setup_logging(args.log_level, path, args.log_max_bytes, args.log_rotate_seconds,
+                                         args.log_backups, console=not args.quiet)
+        # game metrics live in whichever process hosts the games; the matchmaker parent serves none
+        if args.metrics_port and (worker_index is not None or args.workers <= 1):
+            metrics.start_http_server(args.metrics_port + (worker_index or 0), args.metrics_address)
+        if not args.replays or (worker_index is None and args.workers > 1):
+            return writer.stop
+        # so are games; every worker appends to segments of its own
+        global replay_recorder
+        replay_recorder = replay.open_recorder(args.replays, "replay" if worker_index is None else f"replay-w{worker_index}",
+                                               rows=variant.rows, columns=variant.columns)
 
-    # Check if the port was provided
-    if tcp_port is None:
-        print("Usage: python server.py -p PORT")
-        sys.exit(1)
+        def stop():
+            replay_recorder.close()
+            writer.stop()
+        return stop
+
+    if args.workers > 1:
+        if args.journal:
+            # a reconnecting player could land on any worker, not the one that restored their game
+            raise SystemExit("--journal can't be combined with --workers")
+        workers.start_workers(tcp_port, args.workers, handle_connection, ASYNC_BACKLOG, setup_process)
+        return
+
+    setup_process()
+    if args.journal:
+        event_journal, saved = journal.open_journal(args.journal, args.snapshot_every, args.journal_sync_ms / 1000)
+        restore_sessions(saved)
+
+    if args.mode == 'asyncio':
+        try:
+            asyncio.run(start_async_server(tcp_port))
+        except KeyboardInterrupt:
+            print("\nServer is shutting down...")
+        return
 
     server_ip = "0.0.0.0"
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -338,27 +1402,53 @@ def start_server():
     
     assigned_port = server_socket.getsockname()[1]
     print(f"Server started on {server_ip}:{assigned_port}")
+    # waiting players are paired as their match windows widen, even while nobody new connects or joins
+    threading.Thread(target=sweep_matches_periodically, daemon=True).start()
 
     try:
         while True:
             # accept new client connections
             client_socket, client_address = server_socket.accept()
-
-            if len(clients) < 2:
-                print(f"Accepted connection from {client_address}")
-                client_handler = threading.Thread(target=handle_client, args=(client_socket, client_address))
-                client_handler.start()
-            else:
-                client_socket.sendall(json.dumps({"type": "third_client", "message": "The maximum number of players has been reached. Please wait for current players to leave their session..."}).encode())
+            # turned away here, before a thread is spent on it, if the address is at its connection cap
+            limiter = admission.connect(client_address[0])
+            if limiter is None:
+                refuse_connection(client_address)
+                client_socket.close()
+                continue
+            print(f"Accepted connection from {client_address}")
+            client_handler = threading.Thread(target=handle_client, args=(client_socket, client_address, limiter))
+            client_handler.start()
 
     except KeyboardInterrupt:
         run_thread = False
         print("\nServer is shutting down...")
     finally:
         # clean up
-        for client in clients.values():
+        close_all_clients()
+
+async def start_async_server(tcp_port):
+    server_ip = "0.0.0.0"
+    # a large backlog so bursts of thousands of connects aren't refused by the kernel
+    server = await asyncio.start_server(handle_connection, server_ip, tcp_port, reuse_address=True, backlog=ASYNC_BACKLOG)
+    assigned_port = server.sockets[0].getsockname()[1]
+    print(f"Server started on {server_ip}:{assigned_port} (asyncio)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        close_all_clients()
+
+def close_all_clients():
+    # stop journaling first: the games in progress should survive the restart, not be recorded as ended
+    if event_journal:
+        event_journal.close()
+    # likewise, only games that have ended are archived
+    if replay_recorder:
+        replay_recorder.close()
+    for session in list(sessions.values()):
+        for client in list(session.players.values()) + session.spectators:
             try:
-                client['socket'].close()
+                client['close']()
             except Exception as e:
                 print(f"Error closing socket for client {client['address']}: {e}")
 
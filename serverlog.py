@@ -0,0 +1,134 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Asynchronous logging for the server. Handlers on the request path only put the LogRecord on a queue;
+# a single background thread formats records, writes them in batches as JSON lines (one object per event)
+# to a file that rotates by size and age, and echoes them as plain text to the terminal if asked to.
+#
+# Structured fields ride along with a record through `extra`:
+#   logging.info("%s missed at %s.", username, target, extra={'fields': {'event': 'shot', 'result': 'miss'}})
+
+DEFAULT_LOG_FILE = "server.log"
+# write at most this many records per batch, and wait at most FLUSH_INTERVAL for a batch to fill
+BATCH_SIZE = 512
+FLUSH_INTERVAL = 0.2
+
+CONSOLE_FORMAT = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+
+
+class DeferredQueueHandler(logging.Handler):
+    # Like logging.handlers.QueueHandler, but leaves all message formatting to the writer thread
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            pass  # never block a game on logging; the record is dropped
+
+
+def format_json(record):
+    entry = {
+        "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+        "level": record.levelname,
+        "message": record.getMessage(),
+    }
+    fields = getattr(record, 'fields', None)
+    if fields:
+        entry.update(fields)
+    if record.exc_info:
+        entry["exception"] = logging.Formatter().formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+
+class LogWriter(threading.Thread):
+    def __init__(self, records, path, max_bytes, rotate_seconds, backups, console):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.console = console
+        self.file = None
+        self.stopping = False
+
+    def open(self):
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        self.opened = time.monotonic()
+
+    def rotate(self):
+        # server.log -> server.log.1 -> ... -> server.log.N
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def run(self):
+        if self.path:
+            self.open()
+        while True:
+            try:
+                batch = [self.records.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                if self.stopping:
+                    break
+                continue
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+        if self.file:
+            self.file.close()
+
+    def write(self, batch):
+        if self.file:
+            lines = "".join(format_json(record) + "\n" for record in batch)
+            self.file.write(lines)
+            self.file.flush()
+            self.size += len(lines)
+            if (self.max_bytes and self.size >= self.max_bytes) or \
+                    (self.rotate_seconds and time.monotonic() - self.opened >= self.rotate_seconds):
+                self.rotate()
+        if self.console:
+            sys.stderr.write("".join(CONSOLE_FORMAT.format(record) + "\n" for record in batch))
+            sys.stderr.flush()
+
+    def stop(self):
+        self.stopping = True
+        self.join()
+
+
+def setup_logging(level="INFO", path=DEFAULT_LOG_FILE, max_bytes=10 * 1024 * 1024, rotate_seconds=86400,
+                  backups=5, console=True, queue_size=100000):
+    # Route every log record through the background writer. Call once per process (after forking).
+    records = queue.Queue(queue_size)
+    writer = LogWriter(records, path, max_bytes, rotate_seconds, backups, console)
+    writer.start()
+    atexit.register(writer.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+    return writer
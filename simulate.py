@@ -0,0 +1,250 @@
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from board import ROWS, COLUMNS, FLEET, Board
+import numpyboard
+
+# Offline Monte Carlo simulator for strategy and balance analysis. Games are played without the server, thousands
+# at a time, as stacks of NumPy arrays (batch x ROWS x COLUMNS): every game in a batch places its fleets and fires
+# its next shot in the same few array operations. The rules are the server's: fleets follow board.FLEET and may
+# not overlap or leave the board, a shot hits when it lands on a ship cell, a ship sinks when all of its cells are
+# hit, and a player wins by sinking the whole enemy fleet, with Player 1 firing first.
+#
+#   python simulate.py -g 1000000 --p1 density --p2 hunt [-j 8] [--check 5]
+#
+# A player's shots never depend on what the opponent does, so each side's shots-to-win is simulated on its own
+# and the two are combined: Player 1 wins when it needs no more shots than Player 2.
+
+# every ship of the fleet, largest first (placement order); ship ids on a board are 1 + the index into this list
+SHIP_SIZES = sorted((size for size, number in FLEET.items() for _ in range(number)), reverse=True)
+CELLS = ROWS * COLUMNS
+# ship id -> size
+SIZE_OF_SHIP = np.array([0] + SHIP_SIZES)
+# the cells a checkerboard hunt fires at first; every ship covers at least one of them
+PARITY = np.add.outer(np.arange(ROWS), np.arange(COLUMNS)) % 2 == 0
+
+
+def place_fleets(batch, rng, placement='random'):
+    # One fleet per game: ship ids (0 for water) as a batch x ROWS x COLUMNS array, plus each ship's
+    # (row, column, vertical) start for replays. Ships are placed by rejection sampling, all games at once.
+    ships = np.zeros((batch, ROWS, COLUMNS), dtype=np.int8)
+    starts = np.zeros((batch, len(SHIP_SIZES), 3), dtype=np.int16)
+    for ship, size in enumerate(SHIP_SIZES):
+        pending = np.arange(batch)
+        offsets = np.arange(size)
+        while len(pending):
+            vertical = rng.random(len(pending)) < 0.5
+            row = rng.integers(0, np.where(vertical, ROWS - size + 1, ROWS))
+            column = rng.integers(0, np.where(vertical, COLUMNS, COLUMNS - size + 1))
+            rows = row[:, None] + offsets * vertical[:, None]
+            columns = column[:, None] + offsets * ~vertical[:, None]
+            # the same checks as handle_place: on the board (by construction) and clear of every other ship
+            fits = (ships[pending[:, None], rows, columns] == 0).all(axis=1)
+            if placement == 'edges':
+                # a common human habit: every ship touches the border
+                fits &= (rows.min(1) == 0) | (columns.min(1) == 0) | (rows.max(1) == ROWS - 1) | (columns.max(1) == COLUMNS - 1)
+            placed = pending[fits]
+            ships[placed[:, None], rows[fits], columns[fits]] = ship + 1
+            starts[placed, ship] = np.stack((row[fits], column[fits], vertical[fits]), axis=1)
+            pending = pending[~fits]
+    return ships, starts
+
+
+class Shooter:
+    # One side's view of a batch of games it is firing into; arrays only cover games still being played
+    def __init__(self, ships, rng):
+        batch = len(ships)
+        self.rng = rng
+        self.ids = np.arange(batch)  # original game index of each row
+        self.ships = ships
+        self.hits = np.zeros((batch, ROWS, COLUMNS), dtype=bool)
+        self.misses = np.zeros((batch, ROWS, COLUMNS), dtype=bool)
+        self.sunk = np.zeros((batch, ROWS, COLUMNS), dtype=bool)
+        self.unhit = np.tile(np.array(SHIP_SIZES, dtype=np.int8), (batch, 1))
+        self.afloat = np.full(batch, len(SHIP_SIZES))
+        self.remaining = {size: np.full(batch, number) for size, number in FLEET.items()}
+        # a random firing order per game for the random and hunt strategies
+        self.order = rng.random((batch, CELLS)).argsort(axis=1)
+
+    def keep(self, rows):
+        for name in ('ids', 'ships', 'hits', 'misses', 'sunk', 'unhit', 'afloat', 'order'):
+            setattr(self, name, getattr(self, name)[rows])
+        self.remaining = {size: number[rows] for size, number in self.remaining.items()}
+
+    def shot(self):
+        return self.hits | self.misses
+
+
+def target_random(shooter, turn):
+    return shooter.order[:, turn]
+
+
+def target_hunt(shooter, turn):
+    # fire next to unsunk hits while there are any, otherwise at random on a checkerboard
+    unsunk = shooter.hits & ~shooter.sunk
+    near = np.zeros_like(unsunk)
+    near[:, 1:, :] |= unsunk[:, :-1, :]
+    near[:, :-1, :] |= unsunk[:, 1:, :]
+    near[:, :, 1:] |= unsunk[:, :, :-1]
+    near[:, :, :-1] |= unsunk[:, :, 1:]
+    score = near * 4.0 + PARITY * 2.0 + shooter.rng.random(unsunk.shape)
+    score[shooter.shot()] = -1
+    return score.reshape(len(score), CELLS).argmax(axis=1)
+
+
+def target_density(shooter, turn):
+    # numpyboard.density over the whole batch; the random fraction only breaks ties between equally dense cells
+    counts = numpyboard.density(shooter.hits, shooter.misses, shooter.sunk, shooter.remaining).astype(np.float64)
+    counts += shooter.rng.random(counts.shape) * 0.5
+    counts[shooter.shot()] = -1
+    return counts.reshape(len(counts), CELLS).argmax(axis=1)
+
+
+TARGETING = {'random': target_random, 'hunt': target_hunt, 'density': target_density}
+PLACEMENTS = ('random', 'edges')
+
+
+def shots_to_win(ships, targeting, rng, record=0):
+    # Shots each game needs to sink the whole fleet in `ships`. With record > 0, also returns every shot fired in
+    # the first `record` games as (game, cell, hit, sunk) rows for replaying through board.Board.
+    shooter = Shooter(ships, rng)
+    needed = np.zeros(len(ships), dtype=np.int16)
+    log = []
+    choose = TARGETING[targeting]
+    for turn in range(CELLS):
+        cells = choose(shooter, turn)
+        games = np.arange(len(cells))
+        row, column = np.divmod(cells, COLUMNS)
+        ship = shooter.ships[games, row, column].astype(np.intp)
+        hit = ship > 0
+        shooter.hits[games, row, column] |= hit
+        shooter.misses[games, row, column] |= ~hit
+
+        # each game hits at most one ship per turn, so plain fancy indexing is enough
+        shooter.unhit[games[hit], ship[hit] - 1] -= 1
+        sunk = np.zeros_like(hit)
+        sunk[hit] = shooter.unhit[games[hit], ship[hit] - 1] == 0
+        if sunk.any():
+            sunk_games = games[sunk]
+            shooter.afloat[sunk_games] -= 1
+            shooter.sunk[sunk_games] |= shooter.ships[sunk_games] == ship[sunk][:, None, None]
+            sunk_sizes = SIZE_OF_SHIP[ship[sunk]]
+            for size in FLEET:
+                shooter.remaining[size][sunk_games[sunk_sizes == size]] -= 1
+
+        if record:
+            logged = shooter.ids < record
+            log.append(np.stack((shooter.ids[logged], cells[logged], hit[logged], sunk[logged]), axis=1))
+
+        won = shooter.afloat == 0
+        if won.any():
+            needed[shooter.ids[won]] = turn + 1
+            if won.all():
+                break
+            shooter.keep(~won)
+    if record:
+        return needed, np.concatenate(log)
+    return needed
+
+
+def check_with_board(starts, log):
+    # Replay recorded games through the server's Board and make sure every hit, sink and win agrees
+    for game in np.unique(log[:, 0]):
+        board = Board()
+        for (row, column, vertical), size in zip(starts[game].tolist(), SHIP_SIZES):
+            assert board.is_free(row, column, size, bool(vertical)), "overlapping fleet"
+            board.place_ship(row, column, size, bool(vertical))
+        shots = log[log[:, 0] == game]
+        for _, cell, hit, sunk in shots:
+            assert (bool(hit), bool(sunk)) == board.fire(*divmod(int(cell), COLUMNS)), f"game {game} disagrees at cell {cell}"
+        assert board.all_sunk(), f"game {game} ended before the fleet was sunk"
+
+
+def run_batch(job):
+    # One batch of complete games in a pool worker; returns only histograms so results are cheap to send back
+    seed, batch, config = job
+    rng = np.random.default_rng(seed)
+    fleets = {player: place_fleets(batch, rng, config[f'{player}_placement']) for player in ('p1', 'p2')}
+    # Player 1 fires at Player 2's fleet and vice versa
+    p1_shots = shots_to_win(fleets['p2'][0], config['p1'], rng, config['check'])
+    p2_shots = shots_to_win(fleets['p1'][0], config['p2'], rng, config['check'])
+    if config['check']:
+        (p1_shots, p1_log), (p2_shots, p2_log) = p1_shots, p2_shots
+        check_with_board(fleets['p2'][1], p1_log)
+        check_with_board(fleets['p1'][1], p2_log)
+
+    p1_wins = p1_shots <= p2_shots
+    length = np.where(p1_wins, 2 * p1_shots - 1, 2 * p2_shots)
+    return {
+        'games': batch,
+        'p1_wins': int(p1_wins.sum()),
+        'length': np.bincount(length, minlength=2 * CELLS + 1),
+        'p1_shots': np.bincount(p1_shots, minlength=CELLS + 1),
+        'p2_shots': np.bincount(p2_shots, minlength=CELLS + 1),
+    }
+
+
+def summarize(histogram):
+    # mean, p5, p50 and p95 of a bincount
+    values = np.arange(len(histogram))
+    total = histogram.sum()
+    cumulative = np.cumsum(histogram) / total
+    percentiles = [int(np.searchsorted(cumulative, p)) for p in (0.05, 0.5, 0.95)]
+    return (values * histogram).sum() / total, *percentiles
+
+
+def report(results, config, elapsed):
+    games = results['games']
+    print(f"\n{games} games in {elapsed:.2f}s ({games / elapsed:.0f} games/sec)")
+    print(f"Player 1 ({config['p1']}, {config['p1_placement']} fleet) wins {results['p1_wins'] / games:.2%}")
+    print(f"Player 2 ({config['p2']}, {config['p2_placement']} fleet) wins {1 - results['p1_wins'] / games:.2%}")
+    print(f"\n{'':<20}{'mean':>8}{'p5':>6}{'p50':>6}{'p95':>6}")
+    for name, key in (("game length (moves)", 'length'), ("P1 shots to win", 'p1_shots'), ("P2 shots to win", 'p2_shots')):
+        mean, p5, p50, p95 = summarize(results[key])
+        print(f"{name:<20}{mean:>8.1f}{p5:>6}{p50:>6}{p95:>6}")
+
+    print("\ngame length distribution")
+    buckets = np.add.reduceat(results['length'], np.arange(0, len(results['length']), 10))
+    peak = buckets.max()
+    for start, count in enumerate(buckets):
+        if count:
+            print(f"{start * 10:>4}-{start * 10 + 9:<4}{count / games:>7.2%} {'#' * int(40 * count / peak)}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shippy batched Monte Carlo simulator")
+    parser.add_argument('-g', '--games', type=int, default=100000, help="total games to simulate")
+    parser.add_argument('-b', '--batch', type=int, default=4096, help="games per array batch")
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help="worker processes")
+    parser.add_argument('--p1', choices=TARGETING, default='density', help="Player 1 targeting strategy")
+    parser.add_argument('--p2', choices=TARGETING, default='hunt', help="Player 2 targeting strategy")
+    parser.add_argument('--p1-placement', choices=PLACEMENTS, default='random', help="Player 1 fleet placement")
+    parser.add_argument('--p2-placement', choices=PLACEMENTS, default='random', help="Player 2 fleet placement")
+    parser.add_argument('--seed', type=int, default=None, help="seed for reproducible runs")
+    parser.add_argument('--check', type=int, default=0,
+                        help="replay the first N games of every batch through board.Board to cross-check the rules")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = {'p1': args.p1, 'p2': args.p2, 'p1_placement': args.p1_placement, 'p2_placement': args.p2_placement,
+              'check': args.check}
+    sizes = [args.batch] * (args.games // args.batch) + ([args.games % args.batch] if args.games % args.batch else [])
+    seeds = np.random.SeedSequence(args.seed).spawn(len(sizes))
+    jobs = [(seed, size, config) for seed, size in zip(seeds, sizes)]
+
+    results = {'games': 0, 'p1_wins': 0, 'length': 0, 'p1_shots': 0, 'p2_shots': 0}
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.jobs) as pool:
+        for batch in pool.imap_unordered(run_batch, jobs):
+            for key in results:
+                results[key] = results[key] + batch[key]
+    report(results, config, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+
+# Multi-process server mode (--workers N). The parent process only accepts connections and plays matchmaker:
+# each accepted socket is passed down to one of N forked worker processes over a Unix socketpair, and every
+# game session lives entirely inside one worker. Players are matched by rating among those waiting in the same
+# worker (see matchmaking.py), so while a worker holds an odd number of players who aren't in a game yet, the
+# next connection is handed to that same worker: every player has someone in their own process to be matched
+# with, and both players of a game always share a process while the game logic of different games runs on
+# different cores. The parent doesn't wait for a worker to seat one connection before handing on the next; it
+# counts the handoffs each worker hasn't reported on yet and routes by the parity the worker will have once it
+# has seated them.
+#
+# Routing only looks at that count, never at ratings: the parent doesn't know a player's rating when it hands
+# the connection on (it comes with the join), and each worker keeps ratings of its own. So every worker matches
+# from an isolated pool. Two players waiting in one worker more than matchmaking.MAX_WINDOW apart make the count
+# even and are never matched, while players who would suit them may land in other workers.
+#
+# Workers report on their control socket exactly once for each handed-down connection, once it is seated:
+#   W  seated, and an odd number of players here are waiting for an opponent
+#   F  seated, and the players waiting here can all pair up
+#   R  not seated: the worker is at --max-sessions, the connection is refused or already gone, or serving it failed
+# and, at any time, as players start games (with each other or the AI) or leave before they do,
+#   O  an odd number of players here are waiting for an opponent again
+#   C  the players waiting here can all pair up again
+
+SEATED_WAITING = b'W'
+SEATED_FULL = b'F'
+REJECTED = b'R'
+UNPAIRED = b'O'
+CANCELLED = b'C'
+
+SEATING = (SEATED_WAITING, SEATED_FULL, REJECTED)
+
+# most connections accepted in one go before the matchmaker reads workers' reports again
+ACCEPT_BATCH = 64
+
+# the worker side's end of its control socket; None in the parent and in single-process modes
+control_socket = None
+# whether the connection served by the current task has yet to report how it was seated
+unreported = contextvars.ContextVar('unreported', default=False)
+
+
+def report(status):
+    # Tell the matchmaker about a seating change; a no-op outside worker processes. Only the first seating
+    # status for a handed-down connection is sent, so any path may report one.
+    if control_socket is None:
+        return
+    if status in SEATING:
+        if not unreported.get():
+            return
+        unreported.set(False)
+    control_socket.send(status)
+
+
+def start_workers(tcp_port, count, handle_connection, backlog, setup_process):
+    # setup_process(worker_index) runs in each worker (and with None in the parent) right after forking;
+    # it may return a callable to run when that process shuts down
+    if not hasattr(os, 'fork') or not hasattr(socket, 'send_fds'):
+        raise SystemExit("--workers needs a Unix platform with os.fork and socket.send_fds.")
+
+    server_ip = "0.0.0.0"
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((server_ip, tcp_port))
+    listener.listen(backlog)
+
+    workers = []
+    for index in range(count):
+        parent_end, child_end = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            listener.close()
+            parent_end.close()
+            for worker in workers:
+                worker['control'].close()
+            shutdown = setup_process(index)
+            try:
+                run_worker(child_end, handle_connection)
+            finally:
+                if shutdown:
+                    shutdown()
+                os._exit(0)
+        child_end.close()
+        # odd: the worker last reported an odd number of players waiting for an opponent; pending: connections
+        # handed to it that it hasn't reported seating yet
+        workers.append({'index': index, 'pid': pid, 'control': parent_end, 'odd': False, 'pending': 0})
+    setup_process(None)
+
+    print(f"Server started on {server_ip}:{listener.getsockname()[1]} ({count} workers)")
+    try:
+        matchmake(listener, workers)
+    except KeyboardInterrupt:
+        print("\nServer is shutting down...")
+    finally:
+        listener.close()
+        for worker in workers:
+            try:
+                os.kill(worker['pid'], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for worker in workers:
+            os.waitpid(worker['pid'], 0)
+
+
+def matchmake(listener, workers):
+    listener.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, None)
+    for worker in workers:
+        selector.register(worker['control'], selectors.EVENT_READ, worker)
+
+    live = list(workers)
+    rotation = itertools.cycle(live)
+
+    def odd(worker):
+        # Whether the worker will hold an odd number of players who aren't in a game yet once it has seated
+        # everything handed to it: its last reported parity, flipped by every handoff it hasn't reported on. A
+        # rejected handoff leaves the parity as it was. Connections are handed off without waiting for reports,
+        # so intake never waits on a worker's event loop.
+        return (worker['odd'] + worker['pending']) % 2 == 1
+
+    while live:
+        for key, _ in selector.select():
+            worker = key.data
+            if worker is None:
+                accept_connections(listener, live, rotation, odd)
+                continue
+
+            data = worker['control'].recv(64)
+            if not data:
+                # the worker exited; stop routing to it
+                logging.error(f"Worker {worker['index']} (pid {worker['pid']}) exited.")
+                selector.unregister(worker['control'])
+                live.remove(worker)
+                rotation = itertools.cycle(live)
+                continue
+
+            for status in data:
+                status = bytes((status,))
+                if status in (SEATED_WAITING, UNPAIRED):
+                    worker['odd'] = True
+                elif status in (SEATED_FULL, CANCELLED):
+                    worker['odd'] = False
+                if status in SEATING:
+                    worker['pending'] = max(worker['pending'] - 1, 0)
+
+
+def accept_connections(listener, live, rotation, odd):
+    # Hand every connection waiting to be accepted to a worker: one that will have a player with nobody to be
+    # matched with, or else the next in turn
+    for _ in range(ACCEPT_BATCH):
+        try:
+            client_socket, client_address = listener.accept()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # e.g. the client reset the connection before it was accepted
+            logging.warning(f"Could not accept a connection: {e}")
+            continue
+        worker = next((w for w in live if odd(w)), None) or next(rotation)
+        try:
+            socket.send_fds(worker['control'], [b'c'], [client_socket.fileno()])
+            worker['pending'] += 1
+        except OSError as e:
+            logging.error(f"Could not hand {client_address} to worker {worker['index']}: {e}")
+        client_socket.close()
+
+
+def run_worker(control, handle_connection):
+    global control_socket
+    control_socket = control
+    # the parent owns shutdown; workers just stop when told to
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    asyncio.run(serve_handed_connections(control, handle_connection))
+
+
+async def serve_handed_connections(control, handle_connection):
+    loop = asyncio.get_running_loop()
+    control.setblocking(False)
+    parent_gone = loop.create_future()
+
+    async def serve(client_socket):
+        # every handed-down connection reports how it was seated, even if serving it fails first, or the parent
+        # would count it as pending forever
+        unreported.set(True)
+        try:
+            reader, writer = await asyncio.open_connection(sock=client_socket)
+            await handle_connection(reader, writer)
+        except Exception:
+            logging.exception("Serving a connection failed.")
+            client_socket.close()
+        finally:
+            report(REJECTED)
+
+    def receive_connections():
+        # handoffs are pipelined, so take every one queued up
+        while True:
+            try:
+                message, fds, _, _ = socket.recv_fds(control, 16, 16)
+            except BlockingIOError:
+                return
+            if not message:
+                loop.remove_reader(control)
+                parent_gone.set_result(None)
+                return
+            for fd in fds:
+                asyncio.ensure_future(serve(socket.socket(fileno=fd)))
+
+    loop.add_reader(control, receive_connections)
+    await parent_gone